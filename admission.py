@@ -0,0 +1,211 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import math
+import os
+import time
+from fastapi import HTTPException
+from metrics import logger, observe_stage, ADMISSION_REJECTIONS, CREW_QUEUE_DEPTH
+
+class AdmissionConfig:
+    # Token buckets, per user: sustained requests per minute and burst size
+    CHAT_PER_MIN = float(os.getenv("CHAT_PER_MIN", "20"))
+    CHAT_BURST = int(os.getenv("CHAT_BURST", "5"))
+    UPLOAD_PER_MIN = float(os.getenv("UPLOAD_PER_MIN", "6"))
+    UPLOAD_BURST = int(os.getenv("UPLOAD_BURST", "3"))
+    BATCH_PER_MIN = float(os.getenv("BATCH_PER_MIN", "2"))
+    BATCH_BURST = int(os.getenv("BATCH_BURST", "1"))
+    # In-flight /chat, /update_vector and /batch_assess requests per user
+    MAX_CONCURRENT_PER_USER = int(os.getenv("MAX_CONCURRENT_PER_USER", "2"))
+    # process_summary runs: how many run at once, how many may wait, and how many one user may have queued or running
+    CREW_WORKERS = int(os.getenv("CREW_WORKERS", "4"))
+    CREW_MAX_QUEUED = int(os.getenv("CREW_MAX_QUEUED", "32"))
+    CREW_MAX_PENDING_PER_USER = int(os.getenv("CREW_MAX_PENDING_PER_USER", "1"))
+    # Run time assumed for Retry-After until real runs have been observed
+    CREW_EST_RUN_SEC = float(os.getenv("CREW_EST_RUN_SEC", "60"))
+    MAX_TRACKED_USERS = 10000
+
+class Rejected(Exception):
+    """Raised when a request is not admitted; retry_after is a hint in seconds for the Retry-After header."""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: int):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Takes one token. Returns 0 if it was available, otherwise the seconds until one will be."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full_at(self) -> float:
+        return self.updated + (self.capacity - self.tokens) / self.rate
+
+class RateLimiter:
+    """Per-user token buckets for one route."""
+
+    def __init__(self, name: str, per_min: float, burst: int):
+        self.name = name
+        self.rate = per_min / 60
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def check(self, user_id: str):
+        """Raises Rejected if the user is over the route's rate; 0 per minute disables the limit."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= AdmissionConfig.MAX_TRACKED_USERS:
+                self._prune(now)
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        wait = bucket.take(now)
+        if wait:
+            ADMISSION_REJECTIONS.labels(f"{self.name}.rate").inc()
+            raise Rejected(f"Too many {self.name} requests", wait)
+
+    def _prune(self, now: float):
+        # A bucket that has refilled is the same as a new one, so it can be dropped
+        for user_id in [u for u, b in self._buckets.items() if b.full_at() <= now]:
+            del self._buckets[user_id]
+
+class ConcurrencyLimiter:
+    """Caps how many requests each user has in flight at once."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._in_flight: Dict[str, int] = defaultdict(int)
+
+    def check(self, user_id: str):
+        """Raises Rejected if the user has no free slot, without taking one."""
+        if self.limit and self._in_flight.get(user_id, 0) >= self.limit:
+            ADMISSION_REJECTIONS.labels("concurrency").inc()
+            raise Rejected("Too many requests in progress", 1)
+
+    def acquire(self, user_id: str):
+        self.check(user_id)
+        self._in_flight[user_id] += 1
+
+    def release(self, user_id: str):
+        self._in_flight[user_id] -= 1
+        if self._in_flight[user_id] <= 0:
+            del self._in_flight[user_id]
+
+class FairQueue:
+    """
+    Weighted fair queue in front of a fixed pool of worker threads.
+    Each run gets a virtual finish time of max(virtual clock, the user's last finish time) + cost / weight,
+    and free workers take the smallest one, so a user who queues many runs only delays their own
+    later runs instead of everyone's. Runs over the queue or per-user limits raise Rejected.
+    """
+
+    def __init__(self, workers: int, max_queued: int, max_pending_per_user: int, executor: Optional[ThreadPoolExecutor] = None):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_pending_per_user = max_pending_per_user
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crew")
+        self._heap: List[tuple] = [] # (finish tag, seq, start tag, user_id, grant future)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._pending: Dict[str, int] = defaultdict(int) # queued + running, per user
+        self._queued = 0
+        self._running = 0
+        self.avg_run_sec = AdmissionConfig.CREW_EST_RUN_SEC
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def _retry_after(self, ahead: int) -> float:
+        return (ahead / self.workers + 1) * self.avg_run_sec
+
+    def _admit(self, user_id: str):
+        if self.max_pending_per_user and self._pending.get(user_id, 0) >= self.max_pending_per_user:
+            ADMISSION_REJECTIONS.labels("crew.user_pending").inc()
+            raise Rejected("An emissions assessment is already in progress for this account", self.avg_run_sec)
+        if self.max_queued and self._queued >= self.max_queued:
+            ADMISSION_REJECTIONS.labels("crew.queue_full").inc()
+            raise Rejected("The emissions assessment queue is full", self._retry_after(self._queued))
+
+    def _dispatch(self):
+        while self._running < self.workers and self._heap:
+            _, _, start_tag, _, grant = heapq.heappop(self._heap)
+            if grant.cancelled():
+                continue
+            self._queued -= 1
+            self._running += 1
+            self._virtual_time = max(self._virtual_time, start_tag)
+            grant.set_result(None)
+        CREW_QUEUE_DEPTH.set(self._queued)
+
+    def _done(self, user_id: str, started: float):
+        self.avg_run_sec = 0.8 * self.avg_run_sec + 0.2 * (time.perf_counter() - started)
+        self._running -= 1
+        self._leave(user_id)
+        self._dispatch()
+
+    def _leave(self, user_id: str):
+        self._pending[user_id] -= 1
+        if self._pending[user_id] <= 0:
+            del self._pending[user_id]
+            # A finish tag behind the virtual clock no longer affects scheduling
+            if self._last_finish.get(user_id, 0.0) <= self._virtual_time:
+                self._last_finish.pop(user_id, None)
+
+    async def run(self, user_id: str, fn: Callable, *args, weight: float = 1.0, cost: float = 1.0):
+        """Waits for a fair turn, then runs fn(*args) on a worker thread and returns its result."""
+        self._admit(user_id)
+        loop = asyncio.get_running_loop()
+        start_tag = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+        finish_tag = start_tag + cost / weight
+        self._last_finish[user_id] = finish_tag
+        grant = loop.create_future()
+        heapq.heappush(self._heap, (finish_tag, next(self._seq), start_tag, user_id, grant))
+        self._pending[user_id] += 1
+        self._queued += 1
+        queued_at = time.perf_counter()
+        self._dispatch()
+        try:
+            await grant
+        except asyncio.CancelledError:
+            if grant.done() and not grant.cancelled():
+                # Granted just as the caller went away: hand the worker to the next run
+                self._running -= 1
+                self._leave(user_id)
+                self._dispatch()
+            else:
+                grant.cancel()
+                self._queued -= 1
+                self._leave(user_id)
+                CREW_QUEUE_DEPTH.set(self._queued)
+            raise
+        observe_stage("crew.queue_wait", time.perf_counter() - queued_at)
+
+        started = time.perf_counter()
+        # Copied so the run's logs keep the request's trace ID
+        context = contextvars.copy_context()
+        work = loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args))
+        # The worker is only free once the thread finishes, even if the caller stops waiting
+        work.add_done_callback(lambda _: self._done(user_id, started))
+        return await asyncio.shield(work)
+
+def too_many_requests(rejected: Rejected) -> HTTPException:
+    logger.warning(f"Request rejected: {rejected.reason}")
+    return HTTPException(status_code=429, detail=rejected.reason, headers={"Retry-After": str(rejected.retry_after)})
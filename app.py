@@ -5,14 +5,44 @@ import os
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8000")
 
-def response_generator(prompt, history):
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_body(url, params, token, etag, _response=None):
+    """
+    The JSON body the backend served with `etag`. Filled from the 200 response that carried the ETag
+    (_response isn't part of the cache key); only refetched if the entry was evicted.
+    """
+    response = _response if _response is not None else requests.get(url, params=dict(params), headers={"Authorization": f"Bearer {token}"} if token else {})
+    response.raise_for_status()
+    return response.json()
+
+def get_json(path, params=None, token=None):
+    """
+    GET with ETag revalidation: Streamlit reruns the script on every interaction, so this sends the last
+    ETag seen and reuses the cached body on a 304. Raises requests.HTTPError on error statuses.
+    """
+    url = f"{BACKEND_URL}{path}"
+    key = (url, tuple(sorted((params or {}).items())), token or "")
+    etags = st.session_state.setdefault("etags", {})
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    if key in etags:
+        headers["If-None-Match"] = etags[key]
+    response = requests.get(url, params=params, headers=headers)
+    if response.status_code == 304:
+        return cached_body(*key, etags[key])
+    response.raise_for_status()
+    etag = response.headers.get("ETag")
+    if not etag:
+        return response.json()
+    etags[key] = etag
+    return cached_body(*key, etag, _response=response)
+
+def response_generator(prompt):
     try:
         if "user_id" not in st.session_state or not st.session_state.user_id:
             yield "Error: Please log in again."
             return
         payload = {
-            "query": prompt,
-            "history": history
+            "query": prompt # History is kept server-side
         }
         placeholder = st.empty()
         with placeholder:
@@ -59,23 +89,22 @@ if "access_token" not in st.session_state:
                     st.session_state.access_token = response.json()["access_token"]
                     st.session_state.user_id = response.json()["user_id"]
                     st.session_state.user_email = response.json()["user_email"]
-                    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-
                     try:
-                         role_response = requests.get(f"{BACKEND_URL}/my_role", headers=headers)
-                         if role_response.status_code == 200:
-                             st.session_state.user_role = role_response.json().get("role", "user") # Default to 'user'
-                         else:
-                             st.error("Could not determine user role.")
-                             st.session_state.user_role = "user" # Fallback
+                         st.session_state.user_role = get_json("/my_role", token=st.session_state.access_token).get("role", "user") # Default to 'user'
+                    except requests.HTTPError:
+                         st.error("Could not determine user role.")
+                         st.session_state.user_role = "user" # Fallback
                     except Exception as role_err:
                          st.error(f"Error fetching user role: {role_err}")
                          st.session_state.user_role = "user" # Fallback
 
-                    # --- Fetch history --- (haven't wrapped it in a try block)
-                    history_response = requests.get(f"{BACKEND_URL}/history", headers=headers)
-                    if history_response.status_code == 200:
-                        st.session_state.messages = history_response.json()["response_content"]
+                    # --- Fetch history ---
+                    try:
+                        history = get_json("/history", token=st.session_state.access_token)
+                    except requests.RequestException:
+                        history = None
+                    if history is not None:
+                        st.session_state.messages = history["response_content"]
                         if not st.session_state.messages: # Handle empty history
                                     st.session_state.messages = [{"role": "assistant", "content": "Welcome! How can I help?"}]
                     else:
@@ -120,9 +149,8 @@ else:
     else:
         st.sidebar.header(":red[ADMIN PRIVILEGES]")
         try:
-            response = requests.get(f"{BACKEND_URL}/list_files", params={"collection_name": "core_db"})
-            response.raise_for_status()
-            core_files = response.json().get("response_content", [])
+            # Revalidated on every rerun: a 304 unless the core collection changed
+            core_files = get_json("/list_files", params={"collection_name": "core_db"}, token=access_token).get("response_content", [])
             if core_files:
                 st.sidebar.subheader("Current Files in Core Knowledge Base")
                 for file in core_files:
@@ -171,7 +199,7 @@ else:
             with st.chat_message("user"):
                 st.markdown(query)
             with st.chat_message("assistant"):
-                streamed_response = st.write_stream(response_generator(query, st.session_state.messages))
+                streamed_response = st.write_stream(response_generator(query))
                 full_response = "".join(streamed_response)
                 st.session_state.messages.append({"role": "assistant", "content": full_response})
 
@@ -0,0 +1,152 @@
+"""
+Batch emissions assessments: runs process_summary for a portfolio of company descriptions, read from
+CSV (a 'description' column, plus 'id' or 'company' if present) or JSONL ({"id": ..., "description": ...}).
+Identical descriptions (ignoring case and whitespace) run once and share their result. Results are
+yielded as JSON lines in the order runs finish, followed by a summary line. The portfolio companies
+aren't the requesting user's own, so their uploaded files and consumption records are left out of the
+prompts unless asked for.
+
+    python batch.py portfolio.csv --user-id <id> --workers 4 --out results.jsonl
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List
+import argparse
+import asyncio
+import contextvars
+import csv
+import io
+import json
+import os
+import re
+import sys
+import time
+from metrics import logger, stage
+
+class BatchConfig:
+    # Concurrent runs per batch unless the request asks for fewer, and across all batches on this process
+    WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+    MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+    MAX_COMPANIES = int(os.getenv("BATCH_MAX_COMPANIES", "1000"))
+    # Largest portfolio file /batch_assess reads; enough for MAX_COMPANIES descriptions of a few KB each
+    MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+
+def read_companies(text: str, filename: str = "") -> List[Dict]:
+    """Parses a CSV or JSONL portfolio into [{'id', 'description'}]. Raises ValueError on bad input."""
+    text = text.lstrip("\ufeff") # Excel writes CSVs with a BOM
+    is_jsonl = filename.lower().endswith((".jsonl", ".ndjson")) or (not filename.lower().endswith(".csv") and text.lstrip().startswith("{"))
+    if is_jsonl:
+        rows = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Line {number} is not valid JSON: {e}")
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+        if rows and "description" not in rows[0]:
+            raise ValueError("CSV needs a 'description' column")
+
+    companies = []
+    for number, row in enumerate(rows, 1):
+        description = str(row.get("description") or "").strip() if isinstance(row, dict) else ""
+        if not description:
+            raise ValueError(f"Row {number} has no description")
+        companies.append({"id": str(row.get("id") or row.get("company") or number), "description": description})
+    return companies
+
+def dedupe(companies: List[Dict]) -> Dict[str, List[Dict]]:
+    """Groups companies by normalized description, keeping input order within and across groups."""
+    groups: Dict[str, List[Dict]] = {}
+    for company in companies:
+        groups.setdefault(re.sub(r"\s+", " ", company["description"]).strip().lower(), []).append(company)
+    return groups
+
+def parse_result(result: List[str]) -> Dict:
+    """process_summary's three JSON outputs, as /chat reads them."""
+    try:
+        return {
+            "status": "ok",
+            "operations": json.loads(result[0]),
+            "emissions": json.loads(result[1]),
+            "initiatives": json.loads(result[2]),
+        }
+    except Exception as e:
+        return {"status": "error", "error": f"Could not parse the assessment: {e}"}
+
+async def run_batch(companies: List[Dict], user_id: str, runner: Callable, executor: ThreadPoolExecutor,
+                    workers: int = None, user_context: bool = False) -> AsyncIterator[Dict]:
+    """
+    Runs runner(description, user_id, user_context) once per unique description, at most `workers` at a time on
+    `executor`, and yields one result per company as runs finish, then {'summary': ...}. Closing the
+    generator early cancels the runs that haven't started.
+    """
+    groups = dedupe(companies)
+    slots = asyncio.Semaphore(max(1, min(workers or BatchConfig.WORKERS, BatchConfig.MAX_WORKERS)))
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+
+    async def assess(group: List[Dict]):
+        async with slots:
+            run_started = time.perf_counter()
+            try:
+                # Copied context keeps the request's trace ID on the worker thread's logs and stages
+                result = await loop.run_in_executor(executor, contextvars.copy_context().run, runner, group[0]["description"], user_id, user_context)
+                outcome = parse_result(result)
+            except Exception as e:
+                logger.warning(f"Batch run for {group[0]['id']} failed: {e}")
+                outcome = {"status": "error", "error": str(e)}
+            return group, outcome, time.perf_counter() - run_started
+
+    tasks = [asyncio.ensure_future(assess(group)) for group in groups.values()]
+    counts = {"ok": 0, "error": 0}
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            group, outcome, seconds = await next_done
+            first = group[0]
+            counts[outcome["status"]] += len(group)
+            yield {"id": first["id"], **outcome, "seconds": round(seconds, 2)}
+            for duplicate in group[1:]:
+                yield {"id": duplicate["id"], **outcome, "duplicate_of": first["id"]}
+        elapsed = time.perf_counter() - started
+        yield {"summary": {
+            "companies": len(companies),
+            "unique": len(groups),
+            **counts,
+            "elapsed_sec": round(elapsed, 2),
+            "companies_per_min": round(len(companies) / elapsed * 60, 1) if elapsed else None,
+        }}
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def _run_cli(args):
+    from initiatives.process import process_summary
+    with open(args.input, encoding="utf-8") as f:
+        companies = read_companies(f.read(), args.input)
+    out = open(args.out, "w") if args.out else sys.stdout
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="batch")
+    try:
+        with stage("batch", companies=len(companies)):
+            async for line in run_batch(companies, args.user_id, process_summary, executor, args.workers, args.user_context):
+                out.write(json.dumps(line) + "\n")
+                out.flush()
+                if "summary" in line:
+                    print(f"{line['summary']['companies']} companies ({line['summary']['unique']} unique) in "
+                          f"{line['summary']['elapsed_sec']}s: {line['summary']['companies_per_min']} companies/min", file=sys.stderr)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run emissions assessments for a portfolio of companies.")
+    parser.add_argument("input", help="CSV with a 'description' column, or JSONL with 'description' fields")
+    parser.add_argument("--user-id", required=True, help="User the runs are metered to")
+    parser.add_argument("--user-context", action="store_true", help="Add the user's uploaded files and consumption records to every prompt")
+    parser.add_argument("--workers", type=int, default=BatchConfig.WORKERS)
+    parser.add_argument("--out", help="Write JSONL results here (default: stdout)")
+    args = parser.parse_args()
+    BatchConfig.MAX_WORKERS = max(BatchConfig.MAX_WORKERS, args.workers)
+    asyncio.run(_run_cli(args))
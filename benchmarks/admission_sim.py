@@ -0,0 +1,98 @@
+"""
+Tail latency of light users' process_summary runs while one heavy user floods the Crew workers.
+
+Runs are modelled as a fixed sleep on a worker thread, and time is scaled down (a run takes
+--run-sec instead of about a minute). Three schedulers are compared:
+  fifo         runs go straight to the worker pool in arrival order (no admission control)
+  fair         admission.FairQueue without per-user or queue limits
+  fair+limits  admission.FairQueue with the AdmissionConfig limits; rejected heavy runs are retried after one run length
+
+    python -m benchmarks.admission_sim
+
+"errors" in the results counts runs rejected with 429.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from admission import AdmissionConfig, FairQueue, Rejected
+from benchmarks.run import summarize
+
+def crew_run(seconds):
+    time.sleep(seconds)
+
+async def simulate(mode, args):
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    loop = asyncio.get_running_loop()
+    if mode == "fifo":
+        async def submit(user_id):
+            return await loop.run_in_executor(executor, crew_run, args.run_sec)
+    else:
+        limits = mode == "fair+limits"
+        queue = FairQueue(
+            args.workers,
+            AdmissionConfig.CREW_MAX_QUEUED if limits else 0,
+            AdmissionConfig.CREW_MAX_PENDING_PER_USER if limits else 0,
+            executor=executor,
+        )
+        queue.avg_run_sec = args.run_sec
+        async def submit(user_id):
+            return await queue.run(user_id, crew_run, args.run_sec)
+
+    deadline = time.perf_counter() + args.duration
+    light, heavy = [], []
+    rejected = {"light": 0, "heavy": 0}
+
+    async def heavy_client():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await submit("heavy")
+                heavy.append(time.perf_counter() - started)
+            except Rejected:
+                rejected["heavy"] += 1
+                # Retry-After is whole seconds, far longer than a scaled-down run, so retry after one run instead
+                await asyncio.sleep(args.run_sec)
+
+    async def light_client(index, rng):
+        await asyncio.sleep(rng.uniform(0, args.light_interval))
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await submit(f"light-{index}")
+                light.append(time.perf_counter() - started)
+            except Rejected:
+                rejected["light"] += 1
+            await asyncio.sleep(rng.expovariate(1 / args.light_interval))
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(heavy_client() for _ in range(args.heavy_parallel)),
+        *(light_client(i, random.Random(rng.random())) for i in range(args.light_users)),
+    )
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+    return {
+        "light_users": summarize(light, rejected["light"], elapsed),
+        "heavy_user": summarize(heavy, rejected["heavy"], elapsed),
+    }
+
+async def main(args):
+    return {mode: await simulate(mode, args) for mode in ("fifo", "fair", "fair+limits")}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=AdmissionConfig.CREW_WORKERS)
+    parser.add_argument("--run-sec", type=float, default=0.1, help="Simulated length of one Crew run")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to keep submitting runs")
+    parser.add_argument("--heavy-parallel", type=int, default=24, help="Runs the heavy user keeps in flight")
+    parser.add_argument("--light-users", type=int, default=6)
+    parser.add_argument("--light-interval", type=float, default=0.5, help="Mean seconds between a light user's runs")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    json.dump(asyncio.run(main(args)), sys.stdout, indent=2)
+    print()
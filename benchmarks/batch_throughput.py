@@ -0,0 +1,92 @@
+"""
+Throughput of POST /batch_assess in companies/minute with the fake-LLM Crew (see harness.py), for a
+range of worker counts. A share of the portfolio repeats earlier descriptions, which dedup runs once.
+The app is served by uvicorn on a local port: httpx's in-process ASGI transport buffers whole
+responses, which would hide when the first result line arrives.
+
+    python -m benchmarks.batch_throughput --companies 40 --workers 1 2 4 8
+    python -m benchmarks.batch_throughput --crew-mode replay --duplicates 0
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import sys
+import time
+
+FUELS = [("diesel trucks", "gallons of diesel"), ("gasoline vans", "gallons of gasoline"), ("natural gas boilers", "therms of natural gas")]
+
+def portfolio(companies: int, duplicates: float, seed: int) -> str:
+    rng = random.Random(seed)
+    unique = max(1, round(companies * (1 - duplicates)))
+    descriptions = []
+    for i in range(unique):
+        assets, fuel = FUELS[i % len(FUELS)]
+        descriptions.append(f"Site {i}: a logistics company operating {rng.randint(5, 80)} {assets}, each using {rng.randint(100, 900)} {fuel} per month.")
+    descriptions += [rng.choice(descriptions[:unique]) for _ in range(companies - unique)]
+    return "\n".join(json.dumps({"id": f"site-{i}", "description": d}) for i, d in enumerate(descriptions))
+
+async def run(args):
+    from benchmarks.harness import load_app
+    from benchmarks.fake_llm import FakeLLMConfig
+    from benchmarks.cassettes import CassetteConfig
+    from benchmarks.run import login
+    from benchmarks.fake_supabase import free_port
+    import httpx
+    import uvicorn
+
+    FakeLLMConfig.LATENCY_SEC = args.llm_latency
+    CassetteConfig.REPLAY_SPEED = args.replay_speed
+    main, store = load_app(args.crew_mode)
+    main.BatchConfig.MAX_WORKERS = max(args.workers)
+    main.batch_executor = main.ThreadPoolExecutor(max_workers=max(args.workers), thread_name_prefix="batch")
+    body = portfolio(args.companies, args.duplicates, args.seed)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    results = []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            headers, _ = await login(client, store, 0)
+            for workers in args.workers:
+                started = time.perf_counter()
+                first_result = None
+                lines = []
+                files = {"file": ("portfolio.jsonl", io.BytesIO(body.encode("utf-8")), "application/x-ndjson")}
+                async with client.stream("POST", "/batch_assess", files=files, data={"workers": str(workers)}, headers=headers) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if line:
+                            first_result = first_result or time.perf_counter() - started
+                            lines.append(json.loads(line))
+                summary = lines[-1]["summary"]
+                result = {
+                    "workers": workers,
+                    **summary,
+                    "first_result_sec": round(first_result, 2),
+                    "unique_runs_per_min": round(summary["unique"] / summary["elapsed_sec"] * 60, 1),
+                }
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+    finally:
+        server.should_exit = True
+        await serving
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=40)
+    parser.add_argument("--duplicates", type=float, default=0.25, help="Share of the portfolio repeating an earlier description")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake LLM time to first token (sec)")
+    parser.add_argument("--crew-mode", choices=["fake-llm", "replay"], default="fake-llm")
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    json.dump(asyncio.run(run(args)), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,62 @@
+"""
+Record/replay of Crew runs. Recording wraps the real process_summary (live Groq/OpenAI keys needed)
+and stores its outputs and wall time; replaying returns them without any LLM calls.
+
+    python -m benchmarks.cassettes record "A logistics company with 30 diesel trucks ..." --user-id 789
+"""
+from datetime import datetime, timezone
+import argparse
+import hashlib
+import json
+import os
+import time
+
+class CassetteConfig:
+    DIR = os.path.join(os.path.dirname(__file__), "cassettes")
+    # 1.0 replays with the recorded wall time, 0 returns immediately
+    REPLAY_SPEED = 1.0
+
+def cassette_path(summary: str) -> str:
+    key = hashlib.sha256(summary.strip().encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CassetteConfig.DIR, f"{key}.json")
+
+class CrewRecorder:
+    """Drop-in for process_summary that saves every run to a cassette."""
+    def __init__(self, process_summary):
+        self.process_summary = process_summary
+
+    def __call__(self, summary: str, user_id: str, user_context: bool = True):
+        started = time.perf_counter()
+        outputs = self.process_summary(summary, user_id, user_context)
+        cassette = {
+            "summary": summary,
+            "outputs": outputs,
+            "duration_sec": round(time.perf_counter() - started, 3),
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+        }
+        os.makedirs(CassetteConfig.DIR, exist_ok=True)
+        with open(cassette_path(summary), "w") as f:
+            json.dump(cassette, f, indent=2)
+        return outputs
+
+class CrewReplayer:
+    """Drop-in for process_summary that returns recorded outputs. Unknown summaries raise KeyError."""
+    def __call__(self, summary: str, user_id: str, user_context: bool = True):
+        path = cassette_path(summary)
+        if not os.path.exists(path):
+            raise KeyError(f"No cassette recorded for summary: {summary[:80]}")
+        with open(path) as f:
+            cassette = json.load(f)
+        time.sleep(cassette["duration_sec"] * CassetteConfig.REPLAY_SPEED)
+        return cassette["outputs"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a real Crew run as a cassette.")
+    parser.add_argument("command", choices=["record"])
+    parser.add_argument("summary")
+    parser.add_argument("--user-id", default="benchmark")
+    args = parser.parse_args()
+
+    from initiatives.process import process_summary
+    CrewRecorder(process_summary)(args.summary, args.user_id)
+    print(f"Saved {cassette_path(args.summary)}")
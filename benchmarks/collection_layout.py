@@ -0,0 +1,162 @@
+"""
+Query latency, disk and RAM of the per-user and sharded Chroma layouts (RAGConfig.COLLECTION_LAYOUT)
+at 100, 10k and 100k users, with random vectors standing in for embeddings.
+
+Each layout is built in a temp dir, then measured in a fresh process: the k=3 query for a random user
+(including opening the user's collection, as get_retriever does on every run) and the resident memory
+after querying --queries distinct users. Creating a collection costs tens of milliseconds and a few
+hundred KB of disk, so the per-user layout is only built up to --max-collections users; past that its
+disk is extrapolated linearly and marked as such.
+
+    python -m benchmarks.collection_layout
+    python -m benchmarks.collection_layout --users 100 10000 --dim 384 --output layout.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+def build_range(path: str, layout: str, first: int, last: int, args):
+    """Writes users first..last-1 in the given layout."""
+    import chromadb
+    from rag import shard_collection_name, chunk_id
+    client = chromadb.PersistentClient(path=path)
+    rng = np.random.default_rng(args.seed + first)
+    pending = {}
+    for user in range(first, last):
+        user_id = f"user-{user:06d}"
+        name = f"user_{user_id}" if layout == "per_user" else shard_collection_name(user_id, args.shards)
+        rows = pending.setdefault(name, [])
+        for index in range(args.chunks_per_user):
+            meta = {"user_id": user_id, "filename": "bills.pdf", "chunk_index": index}
+            rows.append((chunk_id("bills.pdf", index, user_id), meta))
+        if layout == "per_user" or len(rows) >= 2000 or user == last - 1:
+            # Shards are written in batches as they fill up; per-user collections one user at a time
+            for batch_name in ([name] if layout == "per_user" else list(pending)):
+                batch = pending.pop(batch_name, [])
+                if not batch:
+                    continue
+                collection = client.get_or_create_collection(name=batch_name, embedding_function=None)
+                collection.add(
+                    ids=[row[0] for row in batch],
+                    embeddings=rng.standard_normal((len(batch), args.dim), dtype=np.float32),
+                    documents=[f"2024-{i % 12 + 1:02d} electricity {1000 + i} kWh" for i in range(len(batch))],
+                    metadatas=[row[1] for row in batch],
+                )
+
+def build(path: str, layout: str, users: int, args) -> float:
+    """
+    Writes `users` users' chunks in the given layout and returns the build time. Runs in batches of fresh
+    processes: Chroma keeps every collection it has touched loaded, which alone runs out of memory
+    after a few thousand per-user collections.
+    """
+    step = 250 if layout == "per_user" else 25000
+    started = time.perf_counter()
+    for first in range(0, users, step):
+        command = [sys.executable, "-m", "benchmarks.collection_layout", "--build", path, "--layout", layout,
+                   "--first", str(first), "--last", str(min(users, first + step)), "--dim", str(args.dim),
+                   "--shards", str(args.shards), "--chunks-per-user", str(args.chunks_per_user), "--seed", str(args.seed)]
+        subprocess.run(command, capture_output=True, check=True)
+    return time.perf_counter() - started
+
+def measure(path: str, layout: str, users: int, args) -> dict:
+    """Runs in a fresh process so that RAM reflects only what the queries load."""
+    import chromadb
+    from rag import shard_collection_name
+    client = chromadb.PersistentClient(path=path)
+    baseline = rss_mb()
+    rng = np.random.default_rng(args.seed + 1)
+    sample = random.Random(args.seed).sample(range(users), min(args.queries, users))
+    latencies = []
+    for user in sample:
+        user_id = f"user-{user:06d}"
+        query = rng.standard_normal((1, args.dim), dtype=np.float32)
+        started = time.perf_counter()
+        if layout == "per_user":
+            client.get_collection(name=f"user_{user_id}").query(query_embeddings=query, n_results=3)
+        else:
+            client.get_collection(name=shard_collection_name(user_id, args.shards)).query(
+                query_embeddings=query, n_results=3, where={"user_id": user_id})
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        "query_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "query_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "rss_after_queries_mb": round(rss_mb() - baseline, 1),
+        "users_queried": len(sample),
+    }
+
+def run(args) -> list:
+    results = []
+    for users in args.users:
+        for layout in ("per_user", "sharded"):
+            built = min(users, args.max_collections) if layout == "per_user" else users
+            path = tempfile.mkdtemp(prefix="carbonx-layout-")
+            try:
+                build_sec = build(path, layout, built, args)
+                disk = directory_size(path)
+                command = [sys.executable, "-m", "benchmarks.collection_layout", "--measure", path, "--layout", layout,
+                           "--built-users", str(built), "--dim", str(args.dim), "--shards", str(args.shards),
+                           "--queries", str(args.queries), "--seed", str(args.seed)]
+                measured = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout)
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+            result = {
+                "users": users,
+                "layout": layout,
+                "users_built": built,
+                "build_sec": round(build_sec, 1),
+                "disk_mb": round(disk * users / built / 1e6, 1),
+                "disk_extrapolated": built < users,
+                **measured,
+            }
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--chunks-per-user", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=768, help="Embedding size (all-mpnet-base-v2 is 768)")
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--queries", type=int, default=200, help="Distinct users queried per measurement")
+    parser.add_argument("--max-collections", type=int, default=2000, help="Cap on per-user collections actually built")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write JSON results here")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("--layout", help=argparse.SUPPRESS)
+    parser.add_argument("--built-users", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--build", help=argparse.SUPPRESS)
+    parser.add_argument("--first", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--last", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.build:
+        build_range(args.build, args.layout, args.first, args.last, args)
+        sys.exit(0)
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.layout, args.built_users, args)))
+        sys.exit(0)
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    json.dump(results, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,184 @@
+"""
+Prompt context size and retrieval quality with and without ContextCompressor (compression.py), on a fixed
+knowledge base and question set. The knowledge base is a set of emission-factor and best-practice notes
+split like uploads are, plus a second edition of the handbook that repeats several notes verbatim, as
+re-uploaded files do. Each question lists the facts an answer needs; fact recall is the share of those
+facts present in the context handed to the LLM, which bounds what a grounded answer can get right.
+
+Embeddings are hashed TF-IDF vectors by default, so the run needs no model download; --embeddings hf uses
+RAGConfig.EMBEDDING_MODEL. Similarity thresholds are model-specific: TF-IDF vectors score lower than
+all-mpnet-base-v2, so the lexical run defaults to LEXICAL_MIN_SIMILARITY rather than CompressionConfig's.
+
+    python -m benchmarks.context_compression --budgets 250 500 800
+    python -m benchmarks.context_compression --embeddings hf --min-similarity 0.25
+"""
+import argparse
+import hashlib
+import json
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+BOILERPLATE = (
+    "Figures in this note are intended for screening-level estimates of greenhouse gas emissions. "
+    "Where supplier-specific or metered data is available it should be preferred over the defaults given here, "
+    "and all conversions should be documented so that the inventory can be reviewed and reproduced later."
+)
+
+NOTES = {
+    "diesel": "Diesel fuel. Burning one US gallon of diesel releases 10.21 kg of CO2. Fleet operators usually report diesel by the gallon from fuel cards; litres can be converted at 3.785 litres per gallon. Biodiesel blends such as B20 reduce the fossil share proportionally.",
+    "gasoline": "Motor gasoline. Combustion of one US gallon of gasoline produces 8.78 kg of CO2. Light vans and passenger cars in company fleets mostly run on gasoline, and odometer logs can be converted to fuel use with the vehicle's rated miles per gallon.",
+    "natural_gas": "Natural gas. Pipeline natural gas emits 5.31 kg CO2e per therm burned, including small amounts of methane and nitrous oxide. Utility bills report therms or hundreds of cubic feet (CCF); one CCF is roughly 1.037 therms.",
+    "electricity": "Purchased electricity. The US average grid emission factor is about 0.386 kg CO2e per kWh, although regional grids range from under 0.1 to over 0.8. Market-based reporting can use supplier-specific factors or renewable energy certificates.",
+    "propane": "Propane. Each gallon of propane burned emits 5.72 kg of CO2. Propane is common for forklifts, space heating and rural process heat, and is delivered by the gallon.",
+    "coal": "Coal. Bituminous coal emits roughly 2,325 kg of CO2 per short ton burned, with large variation by coal rank. Furnaces and kilns should use the heat content on the supplier's certificate where it is available.",
+    "jet_fuel": "Jet fuel. Kerosene-type jet fuel releases 9.75 kg of CO2 per gallon. Business travel on commercial flights is normally reported under Scope 3 using distance-based factors rather than fuel.",
+    "refrigerants": "Refrigerants. Leaks from air conditioning and refrigeration count as direct emissions. R-410A has a global warming potential of 2,088, so a 10 kg leak equals about 20.9 tonnes of CO2e. Annual leak checks and recovery at end of life limit these losses.",
+    "lighting": "Lighting retrofits. Replacing fluorescent and metal halide fixtures with LEDs cuts lighting electricity by 50 to 70 percent, and occupancy sensors save a further 20 to 30 percent in intermittently used spaces. Payback is typically two to four years.",
+    "idling": "Idle reduction. A heavy truck idling burns about 0.8 gallons of diesel per hour. Automatic engine shutdown, auxiliary power units and driver coaching reduce idling, which is one of the cheapest fleet measures.",
+    "heat_pumps": "Heat pumps. Electric heat pumps deliver heat with a coefficient of performance of about 3, meaning three units of heat per unit of electricity, compared with 80 to 95 percent efficiency for gas furnaces. Savings depend on the grid factor and climate.",
+    "scopes": "Scopes. Scope 1 covers direct emissions from owned or controlled sources such as boilers, furnaces and vehicles. Scope 2 covers indirect emissions from purchased electricity, steam, heat and cooling. Scope 3 covers all other value chain emissions.",
+    "solar": "On-site solar. Rooftop photovoltaic systems in the US typically reach a capacity factor of 15 to 25 percent, so each kW installed generates roughly 1,300 to 2,200 kWh a year, displacing grid electricity at the local emission factor.",
+    "ev_fleet": "Fleet electrification. Battery electric delivery vans use about 0.5 kWh per mile, so their emissions depend on the grid factor; on the US average grid they emit well under half as much as a gasoline van per mile.",
+    "waste": "Waste. Landfilled mixed waste generates methane as it decomposes; diverting food scraps to composting or anaerobic digestion avoids most of it. Recycling cardboard also avoids upstream emissions from virgin fibre.",
+    "water": "Water. Pumping and treating municipal water uses electricity, so water savings reduce Scope 3 emissions. Low-flow fixtures and leak repair cut use by 20 to 30 percent in offices.",
+}
+
+# Notes repeated verbatim in the second edition of the handbook
+REPEATED = ["diesel", "gasoline", "natural_gas", "electricity", "idling", "refrigerants"]
+
+QUESTIONS = [
+    ("What is the emission factor for diesel fuel per gallon?", ["10.21"]),
+    ("How much CO2 does burning a gallon of gasoline produce?", ["8.78"]),
+    ("What is the emission factor for natural gas per therm?", ["5.31"]),
+    ("What emission factor should I use for grid electricity per kWh?", ["0.386"]),
+    ("How much CO2 comes from a gallon of propane for forklifts?", ["5.72"]),
+    ("How much can LED lighting retrofits reduce lighting electricity?", ["50 to 70 percent"]),
+    ("How much diesel does a truck waste idling per hour?", ["0.8 gallons"]),
+    ("What is the global warming potential of R-410A refrigerant leaks?", ["2,088"]),
+    ("What is the difference between Scope 1 and Scope 2 emissions?", ["direct emissions from owned", "purchased electricity"]),
+    ("Compare the emission factors of diesel and gasoline per gallon.", ["10.21", "8.78"]),
+    ("A bakery uses natural gas ovens and grid electricity; which emission factors apply per therm and per kWh?", ["5.31", "0.386"]),
+    ("How efficient are heat pumps compared with gas furnaces?", ["coefficient of performance of about 3"]),
+]
+
+LEXICAL_MIN_SIMILARITY = 0.15
+
+STOPWORDS = set("a an and are as at be by can compare for from how i in is it much of on or per should the their to use what which with does comes do".split())
+
+class LexicalEmbeddings(Embeddings):
+    """
+    Hashed TF-IDF over words and word pairs, with document frequencies from the benchmark corpus: texts
+    sharing distinctive terms are similar, with no model to download.
+    """
+
+    def __init__(self, texts, size: int = 768):
+        self.size = size
+        frequency = {}
+        for text in texts:
+            for term in set(self._terms(text)):
+                frequency[term] = frequency.get(term, 0) + 1
+        self.idf = {term: float(np.log((len(texts) + 1) / (count + 1)) + 1) for term, count in frequency.items()}
+        self.default_idf = float(np.log(len(texts) + 1) + 1)
+
+    @staticmethod
+    def _terms(text: str):
+        words = [w for w in re.findall(r"[a-z0-9][a-z0-9.,-]*[a-z0-9]|[a-z0-9]", text.lower()) if w not in STOPWORDS]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def _embed(self, text: str):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for term in self._terms(text):
+            vector[int(hashlib.md5(term.encode("utf-8")).hexdigest(), 16) % self.size] += self.idf.get(term, self.default_idf)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+def corpus():
+    from ingest import split_documents
+    notes = [f"{text} {BOILERPLATE}" for text in NOTES.values()]
+    # Two notes per page, as in a handbook PDF, so chunks mix a relevant and an unrelated note
+    pages = ["\n\n".join(notes[i:i + 2]) for i in range(0, len(notes), 2)]
+    first = [Document(page_content=page, metadata={"filename": "handbook.pdf", "page": i}) for i, page in enumerate(pages)]
+    second = [Document(page_content=f"{NOTES[name]} {BOILERPLATE}", metadata={"filename": "handbook_2nd_edition.pdf", "page": i}) for i, name in enumerate(REPEATED)]
+    return split_documents(first + second)
+
+def evaluate(retrieve, questions) -> dict:
+    from session import estimate_tokens
+    context_tokens, recalls, complete, seconds = [], [], 0, []
+    for question, facts in questions:
+        started = time.perf_counter()
+        docs = retrieve(question)
+        seconds.append(time.perf_counter() - started)
+        context = "\n".join(doc.page_content for doc in docs)
+        context_tokens.append(estimate_tokens(context) if context else 0)
+        found = sum(fact in context for fact in facts)
+        recalls.append(found / len(facts))
+        complete += found == len(facts)
+    return {
+        "context_tokens_mean": round(statistics.mean(context_tokens), 1),
+        "context_tokens_max": max(context_tokens),
+        "fact_recall": round(statistics.mean(recalls), 3),
+        "questions_fully_covered": f"{complete}/{len(questions)}",
+        "retrieve_ms_mean": round(statistics.mean(seconds) * 1000, 2),
+    }
+
+def run(args):
+    import chromadb
+    from langchain.vectorstores import Chroma
+    from compression import CompressionConfig, ContextCompressor
+    from rag import RAGConfig, ContextRetriever
+
+    chunks = corpus()
+    if args.embeddings == "hf":
+        from langchain.embeddings import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=RAGConfig.EMBEDDING_MODEL)
+    else:
+        embeddings = LexicalEmbeddings([chunk.page_content for chunk in chunks])
+    min_similarity = args.min_similarity
+    if min_similarity is None:
+        min_similarity = CompressionConfig.MIN_SIMILARITY if args.embeddings == "hf" else LEXICAL_MIN_SIMILARITY
+
+    work = tempfile.mkdtemp(prefix="carbonx-compress-")
+    try:
+        db = Chroma.from_documents(chunks, embeddings, client=chromadb.PersistentClient(path=work), collection_name="core_db")
+        print(f"{len(chunks)} chunks", file=sys.stderr)
+
+        def plain(k):
+            return db.as_retriever(search_type="similarity", search_kwargs={"k": k}).invoke
+
+        results = {
+            f"uncompressed_k{RAGConfig.K}": evaluate(plain(RAGConfig.K), QUESTIONS),
+            f"uncompressed_k{args.fetch_k}": evaluate(plain(args.fetch_k), QUESTIONS),
+        }
+        for budget in args.budgets:
+            compressor = ContextCompressor(embeddings=embeddings, token_budget=budget, min_similarity=min_similarity, mmr_lambda=args.mmr_lambda)
+            retriever = ContextRetriever(collection=db._collection, compressor=compressor, fetch_k=args.fetch_k)
+            results[f"compressed_k{args.fetch_k}_budget{budget}"] = evaluate(retriever.invoke, QUESTIONS)
+        for name, result in results.items():
+            print(f"{name}: {json.dumps(result)}", file=sys.stderr)
+        return {"chunks": len(chunks), "questions": len(QUESTIONS), "min_similarity": min_similarity, "results": results}
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", choices=["lexical", "hf"], default="lexical")
+    parser.add_argument("--fetch-k", type=int, default=8)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[250, 500, 800])
+    parser.add_argument("--min-similarity", type=float, help="Default: CompressionConfig.MIN_SIMILARITY for hf, LEXICAL_MIN_SIMILARITY for lexical")
+    parser.add_argument("--mmr-lambda", type=float, default=0.7)
+    args = parser.parse_args()
+    json.dump(run(args), sys.stdout, indent=2)
+    print()
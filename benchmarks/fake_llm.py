@@ -0,0 +1,131 @@
+"""
+Deterministic stand-ins for the Groq/OpenAI models with configurable latency.
+FakeChatModel replaces ChatGroq in the /chat RAG chain, FakeCrewLLM replaces the Crew agents' LLMs.
+Latency is FakeLLMConfig.LATENCY_SEC plus completion tokens / FakeLLMConfig.TOKENS_PER_SEC, scaled per model
+by FakeLLMConfig.MODEL_PROFILES so that model routing has something to choose between.
+"""
+from typing import Any, List, Optional
+import json
+import random
+import re
+import time
+import zlib
+from crewai import BaseLLM
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from session import estimate_tokens
+
+class FakeLLMConfig:
+    LATENCY_SEC = 0.05
+    TOKENS_PER_SEC = 500.0
+    # A user message containing this makes the fake interviewer emit FINAL DESCRIPTION
+    FINAL_TRIGGER = "no other sources"
+    # Model name fragment -> (latency multiplier, generation speed multiplier, share of Crew answers with broken JSON).
+    # Rough relative figures for the Groq tiers, not measurements; unlisted models use (1, 1, 0).
+    MODEL_PROFILES = {
+        "8b-instant": (0.3, 3.0, 0.15),
+        "specdec": (0.6, 2.5, 0.05),
+        "versatile": (1.0, 1.0, 0.0),
+        "deepseek-r1": (1.5, 0.5, 0.0),
+        "gpt-4o-mini": (1.0, 1.2, 0.0),
+    }
+
+def model_profile(model: str):
+    return next((profile for fragment, profile in FakeLLMConfig.MODEL_PROFILES.items() if fragment in (model or "")), (1.0, 1.0, 0.0))
+
+def simulate_latency(completion: str, model: str = ""):
+    latency, speed, _ = model_profile(model)
+    time.sleep(FakeLLMConfig.LATENCY_SEC * latency + estimate_tokens(completion) / (FakeLLMConfig.TOKENS_PER_SEC * speed))
+
+def emission_sources(text: str) -> List[dict]:
+    """Pulls '<n> <thing> ... <m> gallons/kWh' pairs out of a description."""
+    sources = []
+    pattern = r"(\d+)\s+([a-z\-]+(?: [a-z\-]+)?)\D*?(\d+(?:\.\d+)?)\s*(gallons|kwh|litres|liters|tons|therms)"
+    for count, thing, amount, unit in re.findall(pattern, text.lower()):
+        thing = re.sub(r" (using|each|consuming|that|burning|with)$", "", thing)
+        sources.append({"type": thing, "quantity": int(count), "amount_per_unit_monthly": float(amount), "unit": unit})
+    return sources or [{"type": "diesel trucks", "quantity": 1, "amount_per_unit_monthly": 100.0, "unit": "gallons"}]
+
+def find_json(text: str, key: str):
+    """Returns the first JSON object embedded in text that has the given key."""
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"\{", text):
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+        except ValueError:
+            continue
+        if isinstance(value, dict) and key in value:
+            return value
+    return None
+
+def crew_task_answer(prompt: str) -> str:
+    """Valid JSON answers for the parse, calculate and suggest tasks in initiatives/tasks.py."""
+    if "Suggest 3 initiatives" in prompt:
+        emissions = find_json(prompt, "breakdown") or {"breakdown": []}
+        return json.dumps([
+            {"initiative": f"Reduce {b['source']} emissions", "description": f"Improve efficiency of {b['source']}.",
+             "impact": f"10-20%, {b['emissions'] * 0.1:.0f}-{b['emissions'] * 0.2:.0f} kg CO2e/month", "metrics": ["monthly fuel use", "emissions per unit"]}
+            for b in sorted(emissions["breakdown"], key=lambda b: -b["emissions"])[:3]
+        ])
+    if "calculate the total carbon emissions" in prompt:
+        parsed = find_json(prompt, "emission_sources") or {"emission_sources": emission_sources("")}
+        breakdown = [
+            {"source": s["type"], "emissions": round(s.get("quantity", 1) * s.get("amount_per_unit_monthly", 0) * 10.21, 2)}
+            for s in parsed["emission_sources"]
+        ]
+        return json.dumps({"total_emissions": round(sum(b["emissions"] for b in breakdown), 2), "unit": "kg CO2e monthly", "breakdown": breakdown})
+    description = re.search(r"company description: '(.*?)'\.", prompt, re.S)
+    return json.dumps({"company_type": "logistics", "emission_sources": emission_sources(description.group(1) if description else prompt)})
+
+class FakeChatModel(BaseChatModel):
+    """Plays the interviewer in main.py: echoes rewrites, asks for numbers, then ends with FINAL DESCRIPTION."""
+    model_name: str = ""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        system = messages[0].content if messages and messages[0].type == "system" else ""
+        latest = messages[-1].content if messages else ""
+        if "formulate a standalone question" in system:
+            answer = latest
+        elif FakeLLMConfig.FINAL_TRIGGER in latest.lower():
+            described = " ".join(m.content for m in messages if m.type == "human" and FakeLLMConfig.FINAL_TRIGGER not in m.content.lower())
+            answer = f"FINAL DESCRIPTION: A logistics company. {described}"
+        else:
+            answer = "Thanks! How many gallons of diesel does each truck use per month? Any other sources?"
+        simulate_latency(answer, self.model_name)
+        prompt_tokens = sum(estimate_tokens(str(m.content)) for m in messages)
+        message = AIMessage(content=answer, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": estimate_tokens(answer),
+            "total_tokens": prompt_tokens + estimate_tokens(answer),
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+class FakeCrewLLM(BaseLLM):
+    """Answers every Crew agent step straight away with a Final Answer in the ReAct format."""
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs) -> str:
+        prompt = messages if isinstance(messages, str) else "\n".join(str(m.get("content", "")) for m in messages)
+        content = crew_task_answer(prompt)
+        # Seeded by prompt and model, so a retry on the same model fails the same way and runs are repeatable
+        if random.Random(zlib.crc32(f"{self.model}|{prompt}".encode("utf-8"))).random() < model_profile(self.model)[2]:
+            content = content[: len(content) // 2]
+        answer = f"Thought: I now can give a great answer\nFinal Answer: {content}"
+        simulate_latency(answer, self.model)
+        # Reported like a provider's usage block, so run accounting sees real-looking counts
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(answer)
+        self._track_token_usage_internal({"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens})
+        return answer
+
+    def supports_function_calling(self) -> bool:
+        return False
+
+    def supports_stop_words(self) -> bool:
+        return False
+
+    def get_context_window_size(self) -> int:
+        return 128000
@@ -0,0 +1,225 @@
+"""
+A local stand-in for Supabase: enough of GoTrue (/auth/v1) and PostgREST (/rest/v1)
+for the real supabase-py clients used by main.py to run against it unchanged.
+Data is kept in memory; every user created here is approved so the benchmarks can log in.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+import asyncio
+import itertools
+import json
+import socket
+import threading
+import time
+import uuid
+from fastapi import FastAPI, Request, Response
+import uvicorn
+
+FAKE_KEY = "fake.benchmark.key" # Looks enough like a JWT for the client libraries
+
+class FakeSupabaseConfig:
+    # Added to every response to stand in for the network round trip to a hosted project
+    LATENCY_SEC = 0.0
+
+# Columns that make a row unique, used for upserts without an explicit on_conflict
+PRIMARY_KEYS = {
+    "user_roles": ["user_id"],
+    "chat_summaries": ["user_id"],
+    "emission_rollups": ["user_id", "period_type", "period", "source"],
+}
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables: Dict[str, List[dict]] = {}
+        self.users: Dict[str, dict] = {} # email -> user
+        self.tokens: Dict[str, dict] = {} # access token -> user
+        self.passwords: Dict[str, str] = {}
+        self._ids = itertools.count(1)
+        self._clock = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self._lock = threading.Lock()
+
+    def _now(self) -> str:
+        # Strictly increasing timestamps keep created_at ordering deterministic
+        self._clock += timedelta(milliseconds=1)
+        return self._clock.isoformat()
+
+    def create_user(self, email: str, password: str, role: str = "user", is_approved: bool = True) -> dict:
+        with self._lock:
+            user = {
+                "id": str(uuid.uuid4()),
+                "aud": "authenticated",
+                "role": "authenticated",
+                "email": email,
+                "app_metadata": {"provider": "email"},
+                "user_metadata": {},
+                "created_at": self._now(),
+            }
+            self.users[email] = user
+            self.passwords[email] = password
+            self.tables.setdefault("user_roles", []).append({"user_id": user["id"], "role": role, "is_approved": is_approved})
+            return user
+
+    def issue_token(self, user: dict) -> str:
+        token = f"token-{uuid.uuid4().hex}"
+        self.tokens[token] = user
+        return token
+
+    def session_for(self, user: dict) -> dict:
+        return {
+            "access_token": self.issue_token(user),
+            "refresh_token": uuid.uuid4().hex,
+            "token_type": "bearer",
+            "expires_in": 3600,
+            "expires_at": int(time.time()) + 3600,
+            "user": user,
+        }
+
+    # --- PostgREST ---
+
+    @staticmethod
+    def _matches(row: dict, filters: List[tuple]) -> bool:
+        for column, op, value in filters:
+            current = row.get(column)
+            text = None if current is None else str(current).lower() if isinstance(current, bool) else str(current)
+            if op == "eq" and text != value:
+                return False
+            if op == "neq" and text == value:
+                return False
+            if op == "in" and text not in value.strip("()").split(","):
+                return False
+            if op in ("gt", "gte", "lt", "lte"):
+                if current is None:
+                    return False
+                left, right = (float(current), float(value)) if isinstance(current, (int, float)) else (text, value)
+                if not {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[op]:
+                    return False
+        return True
+
+    def query(self, table: str, params, method: str, body=None, prefer: str = "") -> List[dict]:
+        filters, order, limit, on_conflict, columns = [], [], None, None, None
+        for key, value in params.multi_items():
+            if key == "select":
+                columns = None if value == "*" else [c.strip() for c in value.split(",")]
+            elif key == "order":
+                order = [part.split(".") for part in value.split(",")]
+            elif key == "limit":
+                limit = int(value)
+            elif key == "on_conflict":
+                on_conflict = value.split(",")
+            elif key in ("offset", "columns"):
+                continue
+            else:
+                op, _, operand = value.partition(".")
+                filters.append((key, op, operand))
+
+        with self._lock:
+            rows = self.tables.setdefault(table, [])
+            if method == "POST":
+                new_rows = body if isinstance(body, list) else [body]
+                keys = on_conflict or PRIMARY_KEYS.get(table)
+                result = []
+                for new_row in new_rows:
+                    existing = None
+                    if "merge-duplicates" in prefer and keys:
+                        existing = next((r for r in rows if all(r.get(k) == new_row.get(k) for k in keys)), None)
+                    if existing is not None:
+                        existing.update(new_row)
+                        result.append(existing)
+                    else:
+                        row = {"id": next(self._ids), "created_at": self._now(), **new_row}
+                        rows.append(row)
+                        result.append(row)
+                return [dict(r) for r in result]
+
+            matched = [r for r in rows if self._matches(r, filters)]
+            if method == "PATCH":
+                for row in matched:
+                    row.update(body)
+            elif method == "DELETE":
+                self.tables[table] = [r for r in rows if r not in matched]
+
+            for column, *direction in reversed(order):
+                matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse="desc" in direction)
+            if limit is not None:
+                matched = matched[:limit]
+            if columns:
+                return [{c: r.get(c) for c in columns} for r in matched]
+            return [dict(r) for r in matched]
+
+def create_app(store: FakeSupabase) -> FastAPI:
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def network_latency(request: Request, call_next):
+        if FakeSupabaseConfig.LATENCY_SEC:
+            await asyncio.sleep(FakeSupabaseConfig.LATENCY_SEC)
+        return await call_next(request)
+
+    def error(status: int, message: str, code: str = "") -> Response:
+        body = {"msg": message, "message": message, "error": message, "code": code or status, "error_code": code or str(status)}
+        return Response(json.dumps(body), status_code=status, media_type="application/json")
+
+    def bearer_user(request: Request):
+        token = request.headers.get("authorization", "").removeprefix("Bearer ")
+        return store.tokens.get(token)
+
+    @app.get("/auth/v1/user")
+    async def get_user(request: Request):
+        user = bearer_user(request)
+        if not user:
+            return error(401, "invalid JWT", "bad_jwt")
+        return user
+
+    @app.post("/auth/v1/signup")
+    async def signup(request: Request):
+        payload = await request.json()
+        if payload["email"] in store.users:
+            return error(422, "User already registered", "user_already_exists")
+        user = store.create_user(payload["email"], payload["password"], is_approved=False)
+        # The backend inserts the user_roles row itself after signing up
+        store.tables["user_roles"] = [r for r in store.tables["user_roles"] if r["user_id"] != user["id"]]
+        return user
+
+    @app.post("/auth/v1/token")
+    async def token(request: Request):
+        payload = await request.json()
+        email = payload.get("email")
+        if email not in store.users or store.passwords[email] != payload.get("password"):
+            return error(400, "Invalid login credentials", "invalid_credentials")
+        return store.session_for(store.users[email])
+
+    @app.post("/auth/v1/logout")
+    async def logout():
+        return Response(status_code=204)
+
+    @app.api_route("/rest/v1/{table}", methods=["GET", "POST", "PATCH", "DELETE", "HEAD"])
+    async def rest(table: str, request: Request):
+        body = await request.json() if request.method in ("POST", "PATCH") else None
+        prefer = request.headers.get("prefer", "")
+        rows = store.query(table, request.query_params, request.method, body, prefer)
+        headers = {"Content-Range": f"0-{max(len(rows) - 1, 0)}/{len(rows)}"}
+        if request.headers.get("accept") == "application/vnd.pgrst.object+json":
+            if len(rows) != 1:
+                return error(406, "JSON object requested, multiple (or no) rows returned", "PGRST116")
+            return Response(json.dumps(rows[0]), media_type="application/json", headers=headers)
+        if request.method != "GET" and "return=minimal" in prefer:
+            return Response(status_code=201 if request.method == "POST" else 204, headers=headers)
+        return Response(json.dumps(rows), status_code=201 if request.method == "POST" else 200, media_type="application/json", headers=headers)
+
+    return app
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(store: FakeSupabase = None, port: int = None):
+    """Runs the fake Supabase in a background thread. Returns (store, base_url, server)."""
+    store = store or FakeSupabase()
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(store), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return store, f"http://127.0.0.1:{port}", server
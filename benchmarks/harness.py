@@ -0,0 +1,53 @@
+"""
+Loads main.py fully offline: Supabase points at the local fake, embeddings are deterministic,
+ChatGroq, ChatOpenAI and the Crew LLMs are replaced by the fake models, and Chroma lives in a temp dir.
+Must run before anything else imports main, rag or initiatives.
+"""
+import os
+import tempfile
+from benchmarks.fake_supabase import start_server, FAKE_KEY
+
+def load_app(crew_mode: str = "fake-llm"):
+    """
+    Returns (main module, FakeSupabase store).
+    crew_mode: 'fake-llm' runs the real Crew with FakeCrewLLM, 'replay' serves process_summary from cassettes.
+    """
+    store, url, _ = start_server()
+    data_dir = tempfile.mkdtemp(prefix="carbonx-bench-")
+    os.environ.update({
+        "CONSUMPTION_DB_PATH": os.path.join(data_dir, "consumption.db"),
+        "VERSIONS_DB_PATH": os.path.join(data_dir, "versions.db"),
+        "FACTORS_DB_PATH": os.path.join(data_dir, "factors.db"),
+        "PROFILE_DIR": os.path.join(data_dir, "profiles"),
+        "SUPABASE_URL": url,
+        "SUPABASE_ANON_KEY": FAKE_KEY,
+        "SUPABASE_SERVICE_KEY": FAKE_KEY,
+        "GROQ_API_KEY": "fake-benchmark-key",
+        "OPENAI_API_KEY": "fake-benchmark-key",
+        "CREWAI_DISABLE_TELEMETRY": "true",
+        "OTEL_SDK_DISABLED": "true",
+        "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+    })
+    # Load tests measure capacity, so per-user rate and concurrency limits are off unless set explicitly
+    for limit in ("CHAT_PER_MIN", "UPLOAD_PER_MIN", "BATCH_PER_MIN", "MAX_CONCURRENT_PER_USER"):
+        os.environ.setdefault(limit, "0")
+
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    import rag
+    rag.RAGConfig.DB_PATH = os.path.join(data_dir, "chroma_db")
+    rag.get_embeddings = lambda: DeterministicFakeEmbedding(size=768) # Same size as all-mpnet-base-v2
+
+    from benchmarks.fake_llm import FakeChatModel, FakeCrewLLM
+    import langchain_groq
+    import langchain_openai
+    langchain_groq.ChatGroq = lambda **kwargs: FakeChatModel(model_name=kwargs.get("model", ""))
+    langchain_openai.ChatOpenAI = lambda **kwargs: FakeChatModel(model_name=kwargs.get("model", ""))
+
+    import initiatives.agents as agents
+    agents.crew_llm = lambda model: FakeCrewLLM(model=model)
+
+    import main
+    if crew_mode == "replay":
+        from benchmarks.cassettes import CrewReplayer
+        main.process_summary = CrewReplayer()
+    return main, store
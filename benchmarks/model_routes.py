@@ -0,0 +1,87 @@
+"""
+Cost and latency per LLM route, with routing (RouterConfig.ROUTES) against the single models used before
+(RouterConfig.FIXED_ROUTES), over the same conversations in the offline harness. Each conversation is a
+few /chat turns ending in FINAL DESCRIPTION, which runs the Crew. Fake model speeds and JSON failure
+rates come from FakeLLMConfig.MODEL_PROFILES; costs use RouterConfig.PRICES on estimated tokens.
+
+    python -m benchmarks.model_routes --conversations 8
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+TURNS = ["We run {n} diesel trucks, each using {g} gallons a month.", "We also have {k} kWh of electricity per month.", "That's it, no other sources."]
+
+async def conversation(client, headers, i: int) -> dict:
+    turn_sec, final_sec, failed = [], None, False
+    for turn, template in enumerate(TURNS):
+        started = time.perf_counter()
+        response = await client.post("/chat", json={"query": template.format(n=5 + i, g=300 + 10 * i, k=2000 + 100 * i)}, headers=headers)
+        elapsed = time.perf_counter() - started
+        failed = failed or response.status_code != 200 or response.json().get("status_code", 200) != 200
+        if turn == len(TURNS) - 1:
+            final_sec = elapsed
+        else:
+            turn_sec.append(elapsed)
+    return {"turn_sec": turn_sec, "final_sec": final_sec, "failed": failed}
+
+async def run_mode(main, store, client, routes, conversations: int, offset: int) -> dict:
+    from initiatives.router import model_router
+    from benchmarks.run import login
+    model_router.routes = routes
+    model_router.reset_stats()
+    results = []
+    for i in range(conversations):
+        headers, _ = await login(client, store, offset + i)
+        results.append(await conversation(client, headers, i))
+    rows = model_router.report()
+    per_route = {}
+    for row in rows:
+        route = per_route.setdefault(row["route"], {"calls": 0, "escalations": 0, "failures": 0, "seconds": 0.0, "cost_usd": 0.0, "models": {}})
+        route["calls"] += row["calls"]
+        route["escalations"] += row["escalations"]
+        route["failures"] += row["failures"]
+        route["seconds"] += row["mean_sec"] * row["calls"]
+        route["cost_usd"] += row["cost_usd"]
+        route["models"][row["model"]] = row["calls"]
+    for route in per_route.values():
+        route["mean_sec"] = round(route.pop("seconds") / route["calls"], 3)
+        route["cost_usd"] = round(route["cost_usd"], 6)
+    return {
+        "chat_turn_mean_sec": round(statistics.mean(t for r in results for t in r["turn_sec"]), 3),
+        "final_mean_sec": round(statistics.mean(r["final_sec"] for r in results), 3),
+        "failed_conversations": sum(r["failed"] for r in results),
+        "cost_per_conversation_usd": round(sum(r["cost_usd"] for r in rows) / conversations, 6),
+        "routes": per_route,
+    }
+
+async def run(args):
+    from benchmarks.harness import load_app
+    from benchmarks.fake_llm import FakeLLMConfig
+    import httpx
+
+    FakeLLMConfig.LATENCY_SEC = args.llm_latency
+    FakeLLMConfig.TOKENS_PER_SEC = args.tokens_per_sec
+    main, store = load_app("fake-llm")
+    from initiatives.router import RouterConfig
+
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for offset, (mode, routes) in enumerate([("fixed", RouterConfig.FIXED_ROUTES), ("routed", RouterConfig.ROUTES)]):
+                results[mode] = await run_mode(main, store, client, routes, args.conversations, offset * args.conversations)
+                print(f"{mode}: {json.dumps(results[mode])}", file=sys.stderr)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake LLM time to first token for a 1x model (sec)")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="Fake LLM generation rate for a 1x model")
+    args = parser.parse_args()
+    json.dump(asyncio.run(run(args)), sys.stdout, indent=2)
+    print()
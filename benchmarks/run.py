@@ -0,0 +1,176 @@
+"""
+Offline load test of the FastAPI app. Runs every scenario against main.app in-process with the
+fake LLMs and fake Supabase (see harness.py), and writes JSON results for comparison between commits.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output new.json --compare results.json
+"""
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+SCENARIOS = ["history", "list_files", "update_vector", "chat", "chat_final", "process_summary"]
+
+UPLOAD_TEXT = "\n".join(
+    f"2024-{month:02d} electricity {1000 + month * 37} kWh, diesel {200 + month * 11} gallons"
+    for month in range(1, 13)
+) * 8
+
+SUMMARY = "A logistics company operating 30 diesel trucks, each consuming 800 gallons of diesel per month."
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(latencies, errors, elapsed):
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+    }
+
+async def login(client, store, index):
+    email, password = f"bench{index}@example.com", "benchmark-password"
+    if email not in store.users:
+        store.create_user(email, password)
+    response = await client.post("/login", data={"email": email, "password": password})
+    body = response.json()
+    return {"Authorization": f"Bearer {body['access_token']}"}, body["user_id"]
+
+def is_error(result) -> bool:
+    """main.py reports some failures as a 200 with an error status_code or apology in the body."""
+    if not hasattr(result, "status_code"):
+        return False
+    if result.status_code >= 400:
+        return True
+    body = result.json()
+    return body.get("status_code", 200) >= 400 or "Sorry, an error occurred" in str(body.get("response_content", ""))
+
+def make_request(main, client, scenario, headers, user_id, i):
+    """Returns a coroutine performing one request of the scenario."""
+    if scenario == "history":
+        return client.get("/history", headers=headers)
+    if scenario == "list_files":
+        return client.get("/list_files", params={"collection_name": f"user_{user_id}"}, headers=headers)
+    if scenario == "update_vector":
+        files = {"file": (f"bills_{i % 5}.txt", UPLOAD_TEXT.encode("utf-8"), "text/plain")}
+        return client.post("/update_vector", files=files, data={"is_core": "false"}, headers=headers)
+    if scenario == "chat":
+        return client.post("/chat", json={"query": f"We run {i + 3} diesel trucks."}, headers=headers)
+    if scenario == "chat_final":
+        return client.post("/chat", json={"query": "That's it, no other sources."}, headers=headers)
+    if scenario == "process_summary":
+        return asyncio.to_thread(main.process_summary, SUMMARY, user_id)
+    raise ValueError(f"Unknown scenario {scenario}")
+
+async def run_scenario(main, client, scenario, users, requests):
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker(headers, user_id):
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                result = await make_request(main, client, scenario, headers, user_id, i)
+                if is_error(result):
+                    errors += 1
+            except Exception as e:
+                print(f"{scenario} request failed: {e}", file=sys.stderr)
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(headers, user_id) for headers, user_id in users))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+async def run(args):
+    from benchmarks.harness import load_app
+    from benchmarks.fake_llm import FakeLLMConfig
+    from benchmarks.cassettes import CassetteConfig
+    from benchmarks.fake_supabase import FakeSupabaseConfig
+    import httpx
+
+    FakeLLMConfig.LATENCY_SEC = args.llm_latency
+    FakeLLMConfig.TOKENS_PER_SEC = args.tokens_per_sec
+    CassetteConfig.REPLAY_SPEED = args.replay_speed
+    FakeSupabaseConfig.LATENCY_SEC = args.supabase_latency
+    main, store = load_app(args.crew_mode)
+
+    transport = httpx.ASGITransport(app=main.app)
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            users = [await login(client, store, i) for i in range(args.concurrency)]
+            for scenario in args.scenarios:
+                results[scenario] = await run_scenario(main, client, scenario, users, args.requests)
+                print(f"{scenario}: {results[scenario]}", file=sys.stderr)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare(current, baseline, max_regression):
+    """Prints per-scenario deltas and returns True if any p95 or throughput regressed beyond max_regression."""
+    regressed = False
+    for scenario, stats in current["scenarios"].items():
+        base = baseline["scenarios"].get(scenario)
+        if not base or "p95_ms" not in base or "p95_ms" not in stats:
+            continue
+        p95_delta = stats["p95_ms"] / base["p95_ms"] - 1
+        rps_delta = stats["throughput_rps"] / base["throughput_rps"] - 1
+        flag = ""
+        if p95_delta > max_regression or rps_delta < -max_regression:
+            regressed, flag = True, "  REGRESSION"
+        print(f"{scenario:16} p95 {base['p95_ms']:>9.1f} -> {stats['p95_ms']:>9.1f} ms ({p95_delta:+.1%})  "
+              f"rps {base['throughput_rps']:>7.2f} -> {stats['throughput_rps']:>7.2f} ({rps_delta:+.1%}){flag}")
+    return regressed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the CarbonXAgent API.")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent virtual users")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake LLM time to first token (sec)")
+    parser.add_argument("--tokens-per-sec", type=float, default=500.0, help="Fake LLM generation rate")
+    parser.add_argument("--supabase-latency", type=float, default=0.0, help="Simulated Supabase round trip (sec)")
+    parser.add_argument("--crew-mode", choices=["fake-llm", "replay"], default="fake-llm")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Cassette wall time multiplier")
+    parser.add_argument("--output", help="Write JSON results here")
+    parser.add_argument("--compare", help="Baseline JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "scenarios": asyncio.run(run(args)),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(results, baseline, args.max_regression) else 0)
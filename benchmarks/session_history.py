@@ -0,0 +1,88 @@
+"""
+Prompt size and latency of the chat history at turn 5, 50 and 200.
+
+Compares sending the full history (what clients used to post) against the server-side
+session window + rolling summary from session.py. LLM latency is modelled from prompt
+tokens, so this runs offline:
+
+    python -m benchmarks.session_history
+"""
+import asyncio
+import json
+import re
+import sys
+import time
+from types import SimpleNamespace
+from session import ChatSessionStore, estimate_tokens
+
+TURNS = (5, 50, 200)
+PREFILL_TOKENS_PER_SEC = 2000 # Rough hosted 70B prompt processing rate
+SUMMARY_LATENCY_SEC = 0.8
+
+class InMemoryStore:
+    """Just the chat methods of db.SupabaseStore that ChatSessionStore uses."""
+    def __init__(self):
+        self.summaries = {}
+
+    async def fetch_messages(self, user_id):
+        return []
+
+    async def fetch_summary(self, user_id):
+        return self.summaries.get(user_id)
+
+    async def upsert_summary(self, user_id, summary, summarized_count):
+        self.summaries[user_id] = {"summary": summary, "summarized_count": summarized_count}
+
+class FakeSummarizer:
+    """Keeps the lines that carry numbers, bounded like a real summary would be."""
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(SUMMARY_LATENCY_SEC / 100) # Scaled down; the modelled latency is reported separately
+        facts = [line for line in prompt.splitlines() if re.search(r"\d", line)]
+        return SimpleNamespace(content="\n".join(facts)[-1600:])
+
+def conversation_turn(i):
+    user = f"We also run {i + 2} diesel forklifts, each burning about {30 + i} gallons of diesel per month at site {i}."
+    assistant = (
+        f"Thanks, I've noted {i + 2} diesel forklifts at {30 + i} gallons per month each. "
+        "Do you have any other emission sources, such as electricity, natural gas heating or company vehicles?"
+    )
+    return user, assistant
+
+async def run():
+    results = []
+    for turns in TURNS:
+        db = InMemoryStore()
+        summarizer = FakeSummarizer()
+        store = ChatSessionStore(db, summarizer)
+        full_history = []
+        overhead = 0.0
+        for i in range(turns):
+            user_msg, assistant_msg = conversation_turn(i)
+            started = time.perf_counter()
+            window = await store.build_history("bench-user")
+            overhead += time.perf_counter() - started
+            store.append("bench-user", "user", user_msg)
+            store.append("bench-user", "assistant", assistant_msg)
+            full_history.extend([user_msg, assistant_msg])
+
+        full_tokens = sum(estimate_tokens(m) for m in full_history[:-2])
+        window_tokens = sum(estimate_tokens(m.content) for m in window)
+        results.append({
+            "turn": turns,
+            "full_history_tokens": full_tokens,
+            "session_history_tokens": window_tokens,
+            "full_history_prefill_sec": round(full_tokens / PREFILL_TOKENS_PER_SEC, 3),
+            "session_history_prefill_sec": round(window_tokens / PREFILL_TOKENS_PER_SEC, 3),
+            "summarization_calls": summarizer.calls,
+            "modelled_summarization_sec": round(summarizer.calls * SUMMARY_LATENCY_SEC, 2),
+            "session_overhead_ms_per_turn": round(overhead / turns * 1000, 3),
+        })
+    return results
+
+if __name__ == "__main__":
+    json.dump(asyncio.run(run()), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,87 @@
+"""
+Export and import throughput of snapshot.py on a synthetic collection, for float32 and float16 snapshots,
+plus how far the restored vectors are from the originals.
+
+    python -m benchmarks.snapshot_roundtrip --chunks 50000
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+import chromadb
+import numpy as np
+from snapshot import export_collection, import_collection, directory_size
+
+def embedding_check(source, restored, dim: int, queries: int, seed: int) -> dict:
+    """
+    Max error of the restored vectors, and how often exact (brute-force L2) top-3 results match the
+    original's. Exact search keeps HNSW's own approximation out of the comparison.
+    """
+    expected = source.get(include=["embeddings"])
+    actual = restored.get(ids=expected["ids"], include=["embeddings"])
+    order = {chunk: i for i, chunk in enumerate(actual["ids"])}
+    original = np.asarray(expected["embeddings"], dtype=np.float32)
+    copy = np.asarray(actual["embeddings"], dtype=np.float32)[[order[chunk] for chunk in expected["ids"]]]
+    probes = np.random.default_rng(seed).standard_normal((queries, dim), dtype=np.float32)
+
+    def top3(vectors):
+        distances = (vectors ** 2).sum(axis=1)[None, :] - 2 * probes @ vectors.T
+        return np.argsort(distances, axis=1)[:, :3]
+
+    return {
+        "max_abs_error": float(np.abs(original - copy).max()),
+        "exact_top3_agreement": float((top3(original) == top3(copy)).all(axis=1).mean()),
+    }
+
+def run(args):
+    work = tempfile.mkdtemp(prefix="carbonx-snapshot-")
+    try:
+        source_client = chromadb.PersistentClient(path=f"{work}/source")
+        source = source_client.get_or_create_collection(name="core_db", embedding_function=None)
+        rng = np.random.default_rng(args.seed)
+        started = time.perf_counter()
+        for i in range(0, args.chunks, 5000):
+            n = min(5000, args.chunks - i)
+            source.add(
+                ids=[f"chunk-{j}" for j in range(i, i + n)],
+                embeddings=rng.standard_normal((n, args.dim), dtype=np.float32),
+                documents=[f"Emission factor table row {j}: diesel 10.21 kg CO2e per gallon, region {j % 50}." for j in range(i, i + n)],
+                metadatas=[{"filename": f"factors_{j % 20}.pdf", "chunk_index": j} for j in range(i, i + n)],
+            )
+        results = {"chunks": args.chunks, "dim": args.dim, "initial_add_sec": round(time.perf_counter() - started, 1)}
+
+        for dtype in ("float32", "float16"):
+            out = f"{work}/snap_{dtype}"
+            started = time.perf_counter()
+            export_collection(source_client, "core_db", out, dtype)
+            export_sec = time.perf_counter() - started
+
+            target_client = chromadb.PersistentClient(path=f"{work}/target_{dtype}")
+            started = time.perf_counter()
+            import_collection(target_client, f"{out}/core_db")
+            import_sec = time.perf_counter() - started
+            restored = target_client.get_collection(name="core_db")
+            results[dtype] = {
+                "snapshot_mb": round(directory_size(out) / 1e6, 1),
+                "export_sec": round(export_sec, 2),
+                "export_chunks_per_sec": round(args.chunks / export_sec),
+                "import_sec": round(import_sec, 2),
+                "import_chunks_per_sec": round(args.chunks / import_sec),
+                "restored_count": restored.count(),
+                **embedding_check(source, restored, args.dim, args.queries, args.seed + 1),
+            }
+        return results
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    json.dump(run(args), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,82 @@
+"""
+Offline compaction of the Chroma collections: removes vectors left behind by earlier uploads of a file
+(chunks from before uploads replaced by filename, or from an upload interrupted before its cleanup)
+and reports each collection's size before and after. Run it while the API is stopped: Chroma's
+PersistentClient does not coordinate writes between processes.
+
+    python compact.py --dry-run
+    python compact.py --collection core_db --collection user_<id>
+"""
+from collections import defaultdict
+from typing import Dict, List
+import argparse
+import hashlib
+import os
+from rag import RAGConfig, SHARD_PREFIX, get_chroma_client, iter_chunks
+from metrics import logger
+
+PAGE_SIZE = 5000
+
+def orphaned_ids(collection) -> List[str]:
+    """
+    Chunks that the latest upload of their file didn't write. Files that only have chunks from before
+    uploads were tagged with an upload_id can't be told apart by upload, so there exact duplicate chunks go.
+    """
+    # Shared collections hold many users' files, which may have the same name
+    shared = collection.name.startswith(SHARD_PREFIX)
+    by_file: Dict[tuple, List[tuple]] = defaultdict(list)
+    for chunk, meta, document in iter_chunks(collection, ["metadatas", "documents"]):
+        meta = meta or {}
+        if "filename" in meta:
+            by_file[(meta.get("user_id") if shared else None, meta["filename"])].append((chunk, meta, document))
+
+    orphans = []
+    for chunks in by_file.values():
+        tagged = [meta for _, meta, _ in chunks if meta.get("upload_id")]
+        if tagged:
+            latest = max(tagged, key=lambda meta: meta.get("uploaded_at", ""))["upload_id"]
+            orphans.extend(chunk for chunk, meta, _ in chunks if meta.get("upload_id") != latest)
+        else:
+            seen = set()
+            for chunk, _, document in chunks:
+                digest = hashlib.sha1((document or "").encode("utf-8")).hexdigest()
+                if digest in seen:
+                    orphans.append(chunk)
+                seen.add(digest)
+    return orphans
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+def compact(client, names: List[str] = None, dry_run: bool = False) -> List[Dict]:
+    """Compacts the named collections (all of them by default) and returns a size report per collection."""
+    names = names or [c.name if hasattr(c, "name") else c for c in client.list_collections()]
+    report = []
+    for name in names:
+        collection = client.get_collection(name=name)
+        before = collection.count()
+        orphans = orphaned_ids(collection)
+        if orphans and not dry_run:
+            for i in range(0, len(orphans), PAGE_SIZE):
+                collection.delete(ids=orphans[i:i + PAGE_SIZE])
+        after = before - len(orphans) if dry_run else collection.count()
+        logger.info(f"Compacted {name}: {before} -> {after} chunks")
+        report.append({"collection": name, "chunks_before": before, "orphans": len(orphans), "chunks_after": after})
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove orphaned vectors from the Chroma collections.")
+    parser.add_argument("--collection", action="append", help="Collection to compact (repeatable; default: all)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+    parser.add_argument("--db-path", default=RAGConfig.DB_PATH)
+    args = parser.parse_args()
+
+    RAGConfig.DB_PATH = args.db_path
+    disk_before = directory_size(args.db_path)
+    rows = compact(get_chroma_client(), args.collection, args.dry_run)
+    print(f"{'collection':40} {'before':>8} {'orphans':>8} {'after':>8}")
+    for row in rows:
+        print(f"{row['collection']:40} {row['chunks_before']:>8} {row['orphans']:>8} {row['chunks_after']:>8}")
+    print(f"{'total':40} {sum(r['chunks_before'] for r in rows):>8} {sum(r['orphans'] for r in rows):>8} {sum(r['chunks_after'] for r in rows):>8}")
+    # Chroma reuses freed space rather than shrinking its files, so disk size may not drop right away
+    print(f"Disk: {disk_before / 1e6:.1f} MB before, {directory_size(args.db_path) / 1e6:.1f} MB after")
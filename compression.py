@@ -0,0 +1,135 @@
+"""
+Compression of retrieved context before it goes into a prompt (the chat answer, CoreKnowledgeLookupTool
+and the parse task's file context). Retrievers fetch CompressionConfig.FETCH_K candidates, and
+ContextCompressor keeps the part of them worth paying prompt tokens for:
+
+1. drops chunks whose text is mostly contained in a better-ranked chunk (re-uploads, overlapping splits),
+2. drops chunks less similar to the query than MIN_SIMILARITY,
+3. orders the rest by maximal marginal relevance, so near-identical passages don't crowd out other facts,
+4. keeps chunks in that order until TOKEN_BUDGET is reached, cutting the last one at a sentence end.
+
+Similarities use the vectors Chroma already stores for the candidates (rag.ContextRetriever fetches them
+with the documents), so the only embedding per query is the query's own, and repeated queries hit a cache.
+"""
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+import os
+import re
+import threading
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from pydantic import ConfigDict, PrivateAttr
+from session import estimate_tokens, SessionConfig
+from metrics import stage, CONTEXT_TOKENS
+
+class CompressionConfig:
+    ENABLED = os.getenv("CONTEXT_COMPRESSION", "true").lower() == "true"
+    # Candidates fetched from Chroma before compression (RAGConfig.K is used when compression is off)
+    FETCH_K = int(os.getenv("CONTEXT_FETCH_K", "8"))
+    TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "500"))
+    # Cosine similarity to the query; all-mpnet-base-v2 puts unrelated passages well below this
+    MIN_SIMILARITY = float(os.getenv("CONTEXT_MIN_SIMILARITY", "0.25"))
+    # 1 ranks by relevance only, 0 by diversity only
+    MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+    # A chunk is a duplicate when this share of its word shingles appears in a better-ranked chunk
+    DUPLICATE_OVERLAP = 0.8
+    SHINGLE_WORDS = 5
+    # A chunk that would be cut shorter than this is left out instead
+    MIN_TRUNCATED_TOKENS = 40
+    # Query embeddings kept between calls; the same question is retrieved for by /chat and the Crew tools
+    QUERY_CACHE_SIZE = int(os.getenv("CONTEXT_QUERY_CACHE_SIZE", "1024"))
+
+def shingles(text: str, size: int = None) -> set:
+    size = size or CompressionConfig.SHINGLE_WORDS
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def drop_duplicates(documents: Sequence[Document], overlap: float = None) -> List[Document]:
+    """Keeps documents in order, skipping any mostly contained in one already kept."""
+    overlap = CompressionConfig.DUPLICATE_OVERLAP if overlap is None else overlap
+    kept, kept_shingles = [], []
+    for document in documents:
+        own = shingles(document.page_content)
+        if not own:
+            continue
+        if any(len(own & other) >= overlap * len(own) for other in kept_shingles):
+            continue
+        kept.append(document)
+        kept_shingles.append(own)
+    return kept
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """The longest prefix within `tokens` that ends at a sentence (or, failing that, a word) boundary."""
+    limit = tokens * SessionConfig.CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    cut = max(head.rfind(". "), head.rfind(".\n"), head.rfind("\n"))
+    if cut < limit // 2:
+        cut = head.rfind(" ")
+    return head[:cut + 1].rstrip() if cut > 0 else head
+
+class ContextCompressor(BaseDocumentCompressor):
+    """Deduplicates, filters by similarity, diversifies (MMR) and trims retrieved chunks to a token budget."""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    embeddings: Embeddings
+    token_budget: int = CompressionConfig.TOKEN_BUDGET
+    min_similarity: float = CompressionConfig.MIN_SIMILARITY
+    mmr_lambda: float = CompressionConfig.MMR_LAMBDA
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        with self._lock:
+            if query in self._cache:
+                self._cache.move_to_end(query)
+                return self._cache[query]
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        with self._lock:
+            self._cache[query] = vector
+            while len(self._cache) > CompressionConfig.QUERY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return vector
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        """BaseDocumentCompressor entry point for documents without stored vectors: embeds them first."""
+        vectors = self.embeddings.embed_documents([document.page_content for document in documents]) if documents else []
+        return self.compress(documents, vectors, self.embed_query(query))
+
+    def compress(self, documents: Sequence[Document], vectors: Sequence[Sequence[float]], query_vector: np.ndarray) -> List[Document]:
+        """Compresses retrieved documents given their embeddings (in the same order) and the query's."""
+        with stage("retrieval.compress", candidates=len(documents)):
+            kept = self._select(documents, vectors, query_vector)
+        # Every call is observed, including ones with nothing relevant to keep, so small contexts count too
+        CONTEXT_TOKENS.labels("raw").observe(sum(estimate_tokens(document.page_content) for document in documents))
+        CONTEXT_TOKENS.labels("compressed").observe(sum(estimate_tokens(document.page_content) for document in kept))
+        return kept
+
+    def _select(self, documents: Sequence[Document], vectors: Sequence[Sequence[float]], query_vector: np.ndarray) -> List[Document]:
+        kept, remaining = [], self.token_budget
+        vector_of = {id(document): vector for document, vector in zip(documents, vectors)}
+        unique = drop_duplicates(documents)
+        if not unique:
+            return kept
+        vectors = np.asarray([vector_of[id(document)] for document in unique], dtype=np.float32)
+        similarity = vectors @ query_vector / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector) + 1e-12)
+        relevant = [i for i in range(len(unique)) if similarity[i] >= self.min_similarity]
+        order = maximal_marginal_relevance(query_vector, vectors[relevant], self.mmr_lambda, k=len(relevant)) if relevant else []
+
+        for index in (relevant[i] for i in order):
+            document = unique[index]
+            tokens = estimate_tokens(document.page_content)
+            if tokens > remaining:
+                if remaining >= CompressionConfig.MIN_TRUNCATED_TOKENS:
+                    text = truncate_to_tokens(document.page_content, remaining)
+                    kept.append(Document(page_content=text, metadata={**document.metadata, "truncated": True}))
+                break
+            kept.append(document)
+            remaining -= tokens
+        return kept
@@ -0,0 +1,181 @@
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+import os
+import httpx
+from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from metrics import stage, logger
+
+load_dotenv()
+
+class SupabaseConfig:
+    URL = os.getenv("SUPABASE_URL")
+    ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
+    SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+    HTTP2 = os.getenv("SUPABASE_HTTP2", "true").lower() == "true"
+    MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+    MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    KEEPALIVE_EXPIRY_SEC = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY_SEC", "30"))
+    TIMEOUT_SEC = float(os.getenv("SUPABASE_TIMEOUT_SEC", "10"))
+    CONNECT_TIMEOUT_SEC = float(os.getenv("SUPABASE_CONNECT_TIMEOUT_SEC", "3"))
+    RETRIES = int(os.getenv("SUPABASE_RETRIES", "2"))
+    RETRY_BACKOFF_SEC = float(os.getenv("SUPABASE_RETRY_BACKOFF_SEC", "0.2"))
+
+# Failures where the request never reached Supabase, so even writes are safe to retry
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Failures that are worth retrying for reads
+_TRANSIENT_ERRORS = _NOT_SENT_ERRORS + (httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.ReadError)
+_TRANSIENT_STATUS = {"502", "503", "504"}
+
+class SupabaseStore:
+    """
+    Async data-access layer for everything main.py reads or writes in Supabase.
+    One pooled (HTTP/2 where the server supports it) httpx client is shared by two supabase clients:
+    the service client for table access and token checks, and the anon client for sign up / sign in,
+    which is kept separate because signing in switches a client's own auth state to that user.
+    Call connect() at startup and close() at shutdown.
+    """
+
+    def __init__(self):
+        self.http: Optional[httpx.AsyncClient] = None
+        self.service: Optional[AsyncClient] = None
+        self.anon: Optional[AsyncClient] = None
+
+    async def connect(self):
+        self.http = httpx.AsyncClient(
+            http2=SupabaseConfig.HTTP2,
+            limits=httpx.Limits(
+                max_connections=SupabaseConfig.MAX_CONNECTIONS,
+                max_keepalive_connections=SupabaseConfig.MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=SupabaseConfig.KEEPALIVE_EXPIRY_SEC,
+            ),
+            timeout=httpx.Timeout(SupabaseConfig.TIMEOUT_SEC, connect=SupabaseConfig.CONNECT_TIMEOUT_SEC),
+        )
+        # The backend never keeps a user session itself, so nothing needs refreshing or persisting
+        options = dict(httpx_client=self.http, auto_refresh_token=False, persist_session=False)
+        self.service = await acreate_client(SupabaseConfig.URL, SupabaseConfig.SERVICE_KEY, options=AsyncClientOptions(**options))
+        self.anon = await acreate_client(SupabaseConfig.URL, SupabaseConfig.ANON_KEY, options=AsyncClientOptions(**options))
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+
+    async def _call(self, name: str, operation: Callable[[], Awaitable], idempotent: bool = True):
+        """Runs one Supabase call as a timed stage, retrying transient failures with exponential backoff."""
+        retryable = _TRANSIENT_ERRORS if idempotent else _NOT_SENT_ERRORS
+        for attempt in range(SupabaseConfig.RETRIES + 1):
+            try:
+                with stage(f"supabase.{name}"):
+                    return await operation()
+            except Exception as e:
+                transient = isinstance(e, retryable) or (idempotent and isinstance(e, APIError) and str(e.code) in _TRANSIENT_STATUS)
+                if not transient or attempt == SupabaseConfig.RETRIES:
+                    raise
+                logger.warning(f"Retrying supabase.{name} after {type(e).__name__} (attempt {attempt + 1})")
+                await asyncio.sleep(SupabaseConfig.RETRY_BACKOFF_SEC * 2 ** attempt)
+
+    # --- Auth ---
+
+    async def get_user(self, token: str):
+        """Validates an access token and returns the Supabase user, or None."""
+        response = await self._call("auth.get_user", lambda: self.service.auth.get_user(token))
+        return response.user if response else None
+
+    async def sign_up(self, email: str, password: str):
+        return await self._call("auth.sign_up", lambda: self.anon.auth.sign_up({"email": email, "password": password}), idempotent=False)
+
+    async def sign_in(self, email: str, password: str):
+        return await self._call("auth.sign_in", lambda: self.anon.auth.sign_in_with_password({"email": email, "password": password}))
+
+    # --- user_roles ---
+
+    async def get_role(self, user_id: str) -> Optional[dict]:
+        """
+        Returns the user's {'role', 'is_approved'} row, or None if there isn't exactly one: like the
+        .single() query this replaced, duplicate rows grant nothing rather than whichever comes first.
+        """
+        response = await self._call(
+            "user_roles.select",
+            lambda: self.service.table("user_roles").select("role, is_approved").eq("user_id", user_id).limit(2).execute(),
+        )
+        if len(response.data or []) > 1:
+            logger.warning(f"User {user_id} has more than one user_roles row; treating them as having none")
+            return None
+        return response.data[0] if response.data else None
+
+    async def insert_role(self, user_id: str, role: str = "user", is_approved: bool = False):
+        return await self._call(
+            "user_roles.insert",
+            lambda: self.service.table("user_roles").insert({"user_id": user_id, "role": role, "is_approved": is_approved}).execute(),
+            idempotent=False,
+        )
+
+    # --- chat_messages / chat_summaries ---
+
+    async def insert_message(self, user_id: str, role: str, content: str):
+        return await self._call(
+            "chat_messages.insert",
+            lambda: self.service.table("chat_messages").insert({"user_id": user_id, "role": role, "content": content}).execute(),
+            idempotent=False,
+        )
+
+    async def fetch_messages(self, user_id: str) -> List[dict]:
+        response = await self._call(
+            "chat_messages.select",
+            lambda: self.service.table("chat_messages").select("role, content").eq("user_id", user_id).order("created_at").execute(),
+        )
+        return response.data or []
+
+    async def fetch_summary(self, user_id: str) -> Optional[dict]:
+        response = await self._call(
+            "chat_summaries.select",
+            lambda: self.service.table("chat_summaries").select("summary, summarized_count").eq("user_id", user_id).limit(1).execute(),
+        )
+        return response.data[0] if response.data else None
+
+    async def upsert_summary(self, user_id: str, summary: str, summarized_count: int):
+        return await self._call(
+            "chat_summaries.upsert",
+            lambda: self.service.table("chat_summaries").upsert({
+                "user_id": user_id, "summary": summary, "summarized_count": summarized_count,
+            }).execute(),
+        )
+
+    # --- emission_runs / emission_rollups (see emissions.py) ---
+
+    async def insert_emission_run(self, run: dict):
+        return await self._call(
+            "emission_runs.insert",
+            lambda: self.service.table("emission_runs").insert(run).execute(),
+            idempotent=False,
+        )
+
+    async def fetch_rollups(self, user_id: str, period_type: str, periods: List[str] = None,
+                            since: str = None, sources: List[str] = None) -> List[dict]:
+        def query():
+            builder = (self.service.table("emission_rollups").select("period, source, emissions_kg, runs")
+                       .eq("user_id", user_id).eq("period_type", period_type))
+            if periods:
+                builder = builder.in_("period", periods)
+            if since:
+                builder = builder.gte("period", since)
+            if sources:
+                builder = builder.in_("source", sources)
+            return builder.order("period").execute()
+        response = await self._call("emission_rollups.select", query)
+        return response.data or []
+
+    async def upsert_rollups(self, rows: List[dict]):
+        return await self._call(
+            "emission_rollups.upsert",
+            lambda: self.service.table("emission_rollups").upsert(rows, on_conflict="user_id,period_type,period,source").execute(),
+        )
+
+    async def delete_rollups(self, user_id: str, period_type: str, period: str, sources: List[str]):
+        return await self._call(
+            "emission_rollups.delete",
+            lambda: (self.service.table("emission_rollups").delete()
+                     .eq("user_id", user_id).eq("period_type", period_type).eq("period", period)
+                     .in_("source", sources).execute()),
+        )
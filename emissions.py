@@ -0,0 +1,141 @@
+"""
+Structured emissions results. Every completed process_summary run is stored as a row in `emission_runs`,
+and the per-user rollups in `emission_rollups` are updated in the same step, so dashboards read
+precomputed aggregates instead of re-parsing chat history.
+
+emission_runs: run_id, user_id, period (YYYY-MM), summary, company_type, total_emissions, unit,
+    parsed, emissions, suggestions (jsonb), created_at
+emission_rollups: user_id, period_type ('month' | 'quarter'), period ('2025-06' | '2025-Q2'),
+    source (an emission source in lower case, or TOTAL), emissions_kg, runs, updated_at;
+    primary key (user_id, period_type, period, source)
+
+Breakdowns are monthly figures (kg CO2e/month), so a month's rollup is the latest run's estimate in that
+month, not a sum over runs, and a quarter's rollup is the sum of its months' rollups.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import asyncio
+import re
+import uuid
+from metrics import logger
+
+TOTAL = "__total__"
+PERIOD_TYPES = ("month", "quarter")
+
+def to_number(value) -> Optional[float]:
+    """Emission figures as the agents write them: 1234.5, '1,234.5', '1234.5 kg CO2e'."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = re.search(r"-?\d[\d,]*(?:\.\d+)?", str(value or ""))
+    return float(match.group().replace(",", "")) if match else None
+
+def source_name(source) -> str:
+    """Rollup key of an emission source: 'Diesel ' and 'diesel' are one series."""
+    return " ".join(str(source or "unknown").split()).lower()
+
+def source_totals(emissions: Dict) -> Dict[str, float]:
+    """{source: kg CO2e per month} from the calculate task's breakdown, plus TOTAL."""
+    totals: Dict[str, float] = defaultdict(float)
+    for item in emissions.get("breakdown") or []:
+        amount = to_number(item.get("emissions")) if isinstance(item, dict) else None
+        if amount is not None:
+            totals[source_name(item.get("source"))] += amount
+    total = to_number(emissions.get("total_emissions"))
+    totals[TOTAL] = total if total is not None else sum(totals.values())
+    return dict(totals)
+
+def month_of(moment: datetime) -> str:
+    return moment.strftime("%Y-%m")
+
+def quarter_of(month: str) -> str:
+    year, number = month.split("-")
+    return f"{year}-Q{(int(number) - 1) // 3 + 1}"
+
+def quarter_months(quarter: str) -> List[str]:
+    year, number = quarter.split("-Q")
+    first = (int(number) - 1) * 3 + 1
+    return [f"{year}-{month:02d}" for month in range(first, first + 3)]
+
+class EmissionsRecorder:
+    """
+    Stores runs and keeps the rollups current. Each run touches only its own month and quarter: the
+    month's rows are replaced by the run's figures and the quarter is re-added from its (at most three)
+    months. Updates for one user are serialized by an asyncio.Lock so concurrent runs can't interleave their
+    read-modify-writes, but only within this process: with several API workers, two runs of one user finishing
+    at the same moment in different workers can still race, until the next run in that month rewrites its rollups.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def record(self, user_id: str, summary: str, parsed: Dict, emissions: Dict, suggestions: List,
+                     run_id: str = None, at: datetime = None) -> str:
+        """Persists one run and updates its rollups. Returns the run ID."""
+        run_id = run_id or uuid.uuid4().hex
+        at = at or datetime.now(timezone.utc)
+        month = month_of(at)
+        totals = source_totals(emissions)
+        await self.store.insert_emission_run({
+            "run_id": run_id,
+            "user_id": user_id,
+            "period": month,
+            "summary": summary,
+            "company_type": parsed.get("company_type"),
+            "total_emissions": totals[TOTAL],
+            "unit": emissions.get("unit"),
+            "parsed": parsed,
+            "emissions": emissions,
+            "suggestions": suggestions,
+        })
+        async with self._locks[user_id]:
+            await self._update_month(user_id, month, totals, at)
+            await self._update_quarter(user_id, quarter_of(month), at)
+        logger.info(f"Recorded emissions run {run_id} for user {user_id} in {month}")
+        return run_id
+
+    async def _replace(self, user_id: str, period_type: str, period: str, rows: List[Dict], previous: List[Dict]):
+        """Writes a period's rows and removes the sources it no longer has."""
+        if rows:
+            await self.store.upsert_rollups(rows)
+        dropped = sorted({row["source"] for row in previous} - {row["source"] for row in rows})
+        if dropped:
+            await self.store.delete_rollups(user_id, period_type, period, dropped)
+
+    async def _update_month(self, user_id: str, month: str, totals: Dict[str, float], at: datetime):
+        previous = await self.store.fetch_rollups(user_id, "month", [month])
+        runs = max((row["runs"] for row in previous), default=0) + 1
+        rows = [
+            {"user_id": user_id, "period_type": "month", "period": month, "source": source,
+             "emissions_kg": amount, "runs": runs, "updated_at": at.isoformat()}
+            for source, amount in totals.items()
+        ]
+        await self._replace(user_id, "month", month, rows, previous)
+
+    async def _update_quarter(self, user_id: str, quarter: str, at: datetime):
+        months = await self.store.fetch_rollups(user_id, "month", quarter_months(quarter))
+        previous = await self.store.fetch_rollups(user_id, "quarter", [quarter])
+        amounts: Dict[str, float] = defaultdict(float)
+        runs: Dict[str, int] = defaultdict(int)
+        for row in months:
+            amounts[row["source"]] += row["emissions_kg"]
+            runs[row["source"]] += row["runs"]
+        rows = [
+            {"user_id": user_id, "period_type": "quarter", "period": quarter, "source": source,
+             "emissions_kg": amount, "runs": runs[source], "updated_at": at.isoformat()}
+            for source, amount in amounts.items()
+        ]
+        await self._replace(user_id, "quarter", quarter, rows, previous)
+
+def timeseries(rows: List[Dict]) -> List[Dict]:
+    """Rollup rows as a series ordered by period: [{'period', 'total_kg', 'runs', 'sources': {source: kg}}]."""
+    periods: Dict[str, Dict] = {}
+    for row in rows:
+        point = periods.setdefault(row["period"], {"period": row["period"], "total_kg": 0.0, "runs": 0, "sources": {}})
+        if row["source"] == TOTAL:
+            point["total_kg"] = row["emissions_kg"]
+            point["runs"] = row["runs"]
+        else:
+            point["sources"][row["source"]] = row["emissions_kg"]
+    return [periods[period] for period in sorted(periods)]
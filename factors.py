@@ -0,0 +1,371 @@
+"""
+Emission-factor index built from the reference documents admins load into core_db. Uploads to core_db
+also extract (substance, unit, factor, source document, year) tuples into a SQLite table, and
+FactorIndex keeps them in memory keyed by normalized substance name, so a factor lookup is a dictionary
+hit instead of a vector search plus an LLM reading prose.
+
+Extraction understands the ways reference documents state factors:
+- '... emits 5.31 kg CO2e per therm', '0.386 kg CO2e/kWh', '2,325 kg of CO2 per short ton'
+- 'Burning one US gallon of diesel releases 10.21 kg of CO2'
+- tables with a factor column such as 'Fuel | kg CO2 per gallon' or 'Fuel | Unit | kg CO2e per unit'
+- global warming potentials ('R-410A has a global warming potential of 2,088'), stored per kg of gas
+Factors are stored in kg per unit; g, lb and tonnes are converted.
+
+    python factors.py rebuild                  # re-extract from every core_db document (API stopped or not)
+    python factors.py lookup "R410a" --unit kg
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from difflib import get_close_matches
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+from langchain_core.documents import Document
+from ingest import FUELS, UNITS
+from metrics import logger
+
+class FactorConfig:
+    FACTORS_DB_PATH = os.getenv("FACTORS_DB_PATH", "./factors.db")
+    # difflib ratio a name needs to match a substance it isn't spelled exactly like
+    # High enough that 'biodiesel' doesn't match 'diesel' (0.8) or 'charcoal' 'coal' (0.67)
+    FUZZY_CUTOFF = float(os.getenv("FACTOR_FUZZY_CUTOFF", "0.85"))
+    # Resolved names remembered per index, so repeated fuzzy lookups are dictionary hits too
+    MAX_CACHED_NAMES = 10000
+
+_NUMBER = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+_MASS = r"kg|kilograms?|g|grams?|lbs?|pounds?|metric\s+tons?|tonnes?|t"
+_GAS = r"CO2\s*e|CO2e|CO2-?eq\.?|CO2\s+equivalent|CO2|carbon\s+dioxide(?:\s+equivalent)?"
+_UNIT_WORDS = sorted(set(UNITS) | {"mmbtu", "scf", "mile", "miles", "km", "unit"}, key=len, reverse=True)
+# The qualifier stays part of the unit: a metric ton is a tonne, a short ton isn't
+_UNIT = r"(?:US\s+|short\s+|metric\s+)?(?:" + "|".join(re.escape(u) for u in _UNIT_WORDS) + ")"
+_PER_UNIT = rf"(?:/|\s+per\s+)(?P<unit>{_UNIT})(?![a-z])"
+_FACTOR = re.compile(rf"(?<![\w.])(?P<value>{_NUMBER})\s*(?P<mass>{_MASS})\s*(?:of\s+)?(?P<gas>{_GAS})(?:{_PER_UNIT})?", re.I)
+_UNIT_OF = re.compile(rf"\b(?:one|1|a|an|each|every|per)\s+(?P<unit>{_UNIT})\s+of\s+(?P<substance>[a-z][\w -]{{1,40}}?)(?=\s+(?:burned|combusted|consumed|used|releases?|emits?|produces?|generates?)\b|[,.;]|$)", re.I)
+_FACTOR_HEADER = re.compile(rf"(?P<mass>{_MASS})\s*(?:of\s+)?(?P<gas>{_GAS})\s*(?:/|\s+per\s+)\s*(?P<unit>{_UNIT})", re.I)
+_GWP = re.compile(rf"(?P<name>R-?\s?\d{{2,3}}[A-Z]?|HFC[-\s]?\d+[a-z]*|SF6|methane|CH4|nitrous oxide|N2O)\b[^.\n]{{0,60}}?(?:global warming potential|GWP)\b[^0-9.\n]{{0,25}}(?P<value>{_NUMBER})", re.I)
+_REFRIGERANT = re.compile(r"\b(?:R-?\s?(\d{2,3}[A-Z]?)|HFC[-\s]?(\d+[a-z]*))\b", re.I)
+_YEAR = re.compile(r"\b(19[89]\d|20\d{2})\b")
+_CELL = re.compile(r"\s*(?:\||\t|;|\s{2,})\s*")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+(?=[A-Z(])|\n+")
+_SUBJECT_END = re.compile(r"\s+(?:emits?|releases?|produces?|generates?|has|have|is|are)\b|:", re.I)
+
+KG_PER = {"g": 0.001, "gram": 0.001, "lb": 0.453592, "pound": 0.453592, "t": 1000.0, "tonne": 1000.0, "metric ton": 1000.0}
+GASES = {"methane": "methane", "ch4": "methane", "nitrous oxide": "nitrous oxide", "n2o": "nitrous oxide", "sf6": "sf6"}
+FUEL_ALIASES = {alias: fuel for fuel, aliases in FUELS.items() for alias in aliases}
+# Whole aliases only: 'diesel' is in 'renewable diesel' but not in 'biodiesel', 'coal' not in 'charcoal'
+_FUEL = re.compile(r"(?<![\w-])(" + "|".join(sorted(map(re.escape, FUEL_ALIASES), key=len, reverse=True)) + r")(?![\w-])", re.I)
+# Words that don't change which fuel a name means ('US diesel', 'motor gasoline', 'pipeline natural gas').
+# Any other qualifier ('renewable diesel', 'landfill gas', 'bituminous coal') names a substance of its own.
+GENERIC_WORDS = {"the", "a", "an", "us", "u.s.", "average", "typical", "pipeline", "grid", "motor", "kerosene-type"}
+# Words before a fuel name that aren't part of it ('one gallon of diesel', 'burning propane')
+_NOT_QUALIFIERS = {"of", "for", "from", "and", "or", "per", "with", "by", "to", "in", "on", "as", "is", "are", "burning", "burned", "combusting", "using"}
+
+def normalize(name: str) -> str:
+    """Lookup key of a substance name: canonical fuel, refrigerant ('R410a' -> 'r-410a') or cleaned-up words."""
+    text = " ".join(re.sub(r"[^\w\s.-]", " ", name.lower()).split())
+    refrigerant = _REFRIGERANT.search(text)
+    if refrigerant:
+        return f"r-{refrigerant.group(1)}" if refrigerant.group(1) else f"hfc-{refrigerant.group(2)}"
+    if text in GASES:
+        return GASES[text]
+    # 'diesel fuel', 'us diesel' and 'petrol' all mean the same fuel, 'diesel' and 'renewable diesel' don't
+    words = text.split()
+    while words:
+        name = " ".join(words)
+        for candidate in (name, re.sub(r"\s+fuel$", "", name)):
+            if candidate in FUEL_ALIASES:
+                return FUEL_ALIASES[candidate]
+        if words[0] not in GENERIC_WORDS:
+            break
+        words = words[1:]
+    return re.sub(r"^(?:the|a|an|us)\s+", "", text)
+
+def _fuel_phrase(text: str) -> Optional[str]:
+    """The last fuel named in the text with the word qualifying it, if any: '... renewable diesel' -> 'renewable diesel'."""
+    matches = list(_FUEL.finditer(text))
+    if not matches:
+        return None
+    match = matches[-1]
+    before = re.findall(r"[\w.-]+", text[:match.start()])
+    if before and before[-1].lower() not in _NOT_QUALIFIERS:
+        return f"{before[-1]} {match.group(1)}"
+    return match.group(1)
+
+def to_kg(value: float, mass: str) -> float:
+    mass = re.sub(r"s$", "", " ".join(mass.lower().split()))
+    for prefix, factor in KG_PER.items():
+        if mass == prefix or (len(prefix) > 1 and mass.startswith(prefix)):
+            return value * factor
+    return value
+
+def unit_name(unit: str) -> str:
+    """Canonical unit: 'US gallon' -> 'gallons', 'short ton' -> 'tons', 'metric ton' -> 'tonnes'."""
+    unit = " ".join(unit.lower().split())
+    if re.fullmatch(r"metric tons?", unit):
+        return "tonnes"
+    unit = re.sub(r"^(?:us|short|metric)\s+", "", unit)
+    return UNITS.get(unit, {"miles": "mile"}.get(unit, unit))
+
+def gas_name(gas: str) -> str:
+    return "CO2" if re.fullmatch(r"CO2|carbon\s+dioxide", gas.strip(), re.I) else "CO2e"
+
+def _subject(sentence: str, end: int) -> Optional[str]:
+    """The words a sentence opens with, up to its verb: 'Wood pellets emit ...' -> 'wood pellets'."""
+    match = _SUBJECT_END.search(sentence[:end])
+    if not match:
+        return None
+    words = re.findall(r"[A-Za-z][\w-]*", sentence[:match.start()])[-4:]
+    return " ".join(words).lower() or None
+
+def _substance(sentence: str, start: int, end: int) -> Optional[str]:
+    before, after = sentence[:start], sentence[end:]
+    refrigerant = _REFRIGERANT.search(before)
+    if refrigerant:
+        return normalize(refrigerant.group(0))
+    return _fuel_phrase(before) or _fuel_phrase(re.split(r"[,;]", after, 1)[0]) or _subject(sentence, start)
+
+def _year(text: str, default: Optional[int], skip: str = "") -> Optional[int]:
+    years = [int(y) for y in _YEAR.findall(text.replace(skip, " ")) if 1980 <= int(y) <= 2100]
+    return years[0] if years else default
+
+def _factor(substance: str, unit: str, value: float, gas: str, year: Optional[int], text: str) -> Dict:
+    return {"substance": normalize(substance), "unit": unit_name(unit), "factor": value, "gas": gas, "year": year, "source_text": " ".join(text.split())[:300]}
+
+def _prose_factors(sentence: str, year: Optional[int]) -> List[Dict]:
+    found = []
+    unit_of = _UNIT_OF.search(sentence)
+    for match in _FACTOR.finditer(sentence):
+        unit = match.group("unit")
+        substance = _substance(sentence, match.start(), match.end())
+        if unit is None and unit_of and unit_of.end() <= match.start():
+            # 'one gallon of diesel releases 10.21 kg of CO2': the unit and substance come first
+            unit, substance = unit_of.group("unit"), unit_of.group("substance")
+        if unit is None or substance is None:
+            continue
+        value = to_kg(float(match.group("value").replace(",", "")), match.group("mass"))
+        found.append(_factor(substance, unit, value, gas_name(match.group("gas")), _year(sentence, year, match.group("value")), sentence))
+    for match in _GWP.finditer(sentence):
+        found.append(_factor(match.group("name"), "kg", float(match.group("value").replace(",", "")), "CO2e", _year(sentence, year, match.group("value")), sentence))
+    return found
+
+def _table_factors(lines: List[str], year: Optional[int]) -> List[Dict]:
+    """Rows under a header naming a factor column ('kg CO2 per gallon', 'kg CO2e/unit' or 'GWP')."""
+    found = []
+    columns: Dict[int, Tuple[str, str, str]] = {}
+    unit_column = None
+    for line in lines:
+        cells = [cell for cell in _CELL.split(line.strip()) if cell]
+        if len(cells) < 2:
+            continue
+        header = {i: _FACTOR_HEADER.search(cell) for i, cell in enumerate(cells)}
+        gwp = {i for i, cell in enumerate(cells) if re.search(r"\bGWP\b|global warming potential", cell, re.I)}
+        if any(header.values()) or gwp:
+            columns = {i: (m.group("mass"), m.group("gas"), m.group("unit")) for i, m in header.items() if m}
+            columns.update({i: ("kg", "CO2e", "kg") for i in gwp})
+            unit_column = next((i for i, cell in enumerate(cells) if cell.strip().lower() in ("unit", "units", "per")), None)
+            continue
+        if not columns or re.fullmatch(_NUMBER, cells[0].replace("$", "")):
+            continue
+        for i, (mass, gas, unit) in columns.items():
+            if i >= len(cells) or not re.fullmatch(_NUMBER, cells[i]):
+                continue
+            if unit.lower() == "unit":
+                if unit_column is None or unit_column >= len(cells):
+                    continue
+                unit = cells[unit_column]
+            value = to_kg(float(cells[i].replace(",", "")), mass)
+            found.append(_factor(cells[0], unit, value, gas_name(gas), _year(line, year, cells[i]), line))
+    return found
+
+def extract_factors(text: str, default_year: Optional[int] = None) -> List[Dict]:
+    """
+    Emission factors stated in a document's text, one per (substance, unit): the first statement wins, and
+    later statements giving a different value are logged rather than stored.
+    """
+    years = Counter(int(y) for y in _YEAR.findall(text) if 1980 <= int(y) <= 2100)
+    year = default_year or (years.most_common(1)[0][0] if years else None)
+    found = _table_factors(text.splitlines(), year)
+    for sentence in _SENTENCE.split(text):
+        found.extend(_prose_factors(sentence, year))
+    unique = {}
+    for factor in found:
+        if not factor["substance"] or factor["factor"] <= 0:
+            continue
+        kept = unique.setdefault((factor["substance"], factor["unit"]), factor)
+        if kept is not factor and abs(kept["factor"] - factor["factor"]) > 1e-9 * kept["factor"]:
+            logger.warning(f"Ignoring second emission factor for {factor['substance']} per {factor['unit']}: {factor['factor']:g} ('{factor['source_text'][:80]}'), kept {kept['factor']:g}")
+    return list(unique.values())
+
+# --- Store and index ---
+
+class FactorIndex:
+    """
+    SQLite table of extracted factors plus an in-memory {substance: [factors]} dictionary, reloaded
+    when the database file changes (e.g. after `python factors.py rebuild`). Safe to use from any thread.
+    emission_factors: substance, unit, factor (kg per unit), gas ('CO2' | 'CO2e'), source (core_db
+    filename), year, source_text, created_at
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or FactorConfig.FACTORS_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS emission_factors (
+                    substance TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    factor REAL NOT NULL,
+                    gas TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    year INTEGER,
+                    source_text TEXT,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS emission_factors_substance ON emission_factors (substance)")
+            conn.execute("CREATE INDEX IF NOT EXISTS emission_factors_source ON emission_factors (source)")
+        self._by_substance: Dict[str, List[Dict]] = {}
+        self._resolved: Dict[str, Tuple[Optional[str], str]] = {}
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+        with self._lock:
+            if mtime == self._loaded_mtime:
+                return
+            by_substance = defaultdict(list)
+            with self._connect() as conn:
+                for row in conn.execute("SELECT substance, unit, factor, gas, source, year, source_text FROM emission_factors ORDER BY year DESC, created_at DESC"):
+                    by_substance[row["substance"]].append(dict(row))
+            self._by_substance, self._resolved, self._loaded_mtime = dict(by_substance), {}, mtime
+        logger.info(f"Loaded {sum(len(rows) for rows in by_substance.values())} emission factors for {len(by_substance)} substances")
+
+    def replace_source(self, source: str, factors: List[Dict]) -> int:
+        """Stores the factors extracted from one core_db file, replacing those of an earlier upload of it."""
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM emission_factors WHERE source = ?", (source,))
+            conn.executemany(
+                "INSERT INTO emission_factors (substance, unit, factor, gas, source, year, source_text, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(f["substance"], f["unit"], f["factor"], f["gas"], source, f.get("year"), f.get("source_text"), created_at) for f in factors],
+            )
+        self._loaded_mtime = None # Coarse file timestamps could hide a write made within the same tick
+        return len(factors)
+
+    def delete_source(self, source: str) -> int:
+        with self._connect() as conn:
+            removed = conn.execute("DELETE FROM emission_factors WHERE source = ?", (source,)).rowcount
+        self._loaded_mtime = None
+        return removed
+
+    def substances(self) -> List[str]:
+        self._reload_if_changed()
+        return sorted(self._by_substance)
+
+    def _resolve(self, name: str) -> Tuple[Optional[str], str]:
+        """(indexed substance, how it matched: 'exact' | 'fuzzy'), or (None, 'none')."""
+        resolved = self._resolved.get(name)
+        if resolved is not None:
+            return resolved
+        key = normalize(name)
+        if key in self._by_substance:
+            resolved = (key, "exact")
+        else:
+            close = get_close_matches(key, list(self._by_substance), n=1, cutoff=FactorConfig.FUZZY_CUTOFF)
+            resolved = (close[0], "fuzzy") if close else (None, "none")
+        if len(self._resolved) < FactorConfig.MAX_CACHED_NAMES:
+            self._resolved[name] = resolved
+        return resolved
+
+    def lookup(self, name: str, unit: str = None) -> Optional[Dict]:
+        """
+        The factor for a substance name, preferring the given unit and then the most recent year:
+        {'substance', 'match', 'factor': {...}, 'alternatives': [other units/sources], 'unit_mismatch'}.
+        unit_mismatch is set when a unit was asked for and no factor is indexed per that unit, so 'factor'
+        is per some other unit and can't be applied to the quantity as is. None if nothing matches.
+        """
+        self._reload_if_changed()
+        substance, match = self._resolve(name)
+        if substance is None:
+            return None
+        rows = self._by_substance[substance]
+        wanted = unit_name(unit) if unit else None
+        if wanted:
+            rows = sorted(rows, key=lambda row: row["unit"] != wanted) # Stable: keeps year order within each group
+        return {"substance": substance, "match": match, "factor": rows[0], "alternatives": rows[1:],
+                "unit": wanted, "unit_mismatch": bool(wanted) and rows[0]["unit"] != wanted}
+
+def factor_text(result: Dict) -> str:
+    """One-line description of a lookup result, for the Crew tool."""
+    factor = result["factor"]
+    year = f", {factor['year']}" if factor.get("year") else ""
+    text = f"{result['substance']}: {factor['factor']:g} kg {factor['gas']} per {factor['unit']} (source: {factor['source']}{year})"
+    others = "; ".join(f"{alt['factor']:g} kg {alt['gas']} per {alt['unit']} ({alt['source']})" for alt in result["alternatives"][:3])
+    text += f". Also: {others}" if others else ""
+    if result.get("unit_mismatch"):
+        return (f"UNIT MISMATCH: no factor per {result['unit']} is indexed for {result['substance']}. Do not apply these to a quantity "
+                f"in {result['unit']} without converting it to their unit first. {text}")
+    return text
+
+# Shared by the API and the Crew tool, so invalidation after an upload or delete reaches both
+factor_index = FactorIndex()
+
+def extract_and_index(index: FactorIndex, filename: str, docs: List[Document]) -> int:
+    """Extracts the factors in a core_db upload and saves them under its filename. Returns how many were found."""
+    factors = extract_factors("\n".join(doc.page_content for doc in docs), _year(filename, None))
+    logger.info(f"Extracted {len(factors)} emission factors from {filename}")
+    return index.replace_source(filename, factors)
+
+def rebuild(index: FactorIndex, collection) -> Dict[str, int]:
+    """Re-extracts every file in a core_db collection, e.g. after improving extraction. Returns {filename: factors}."""
+    from rag import iter_chunks
+    by_file: Dict[str, List[tuple]] = defaultdict(list)
+    for _, meta, document in iter_chunks(collection, ["metadatas", "documents"]):
+        meta = meta or {}
+        if meta.get("filename") and document:
+            by_file[meta["filename"]].append((meta.get("chunk_index", 0), document))
+    counts = {}
+    for filename, chunks in sorted(by_file.items()):
+        docs = [Document(page_content=text) for _, text in sorted(chunks, key=lambda chunk: chunk[0])]
+        counts[filename] = extract_and_index(index, filename, docs)
+    with index._connect() as conn:
+        stale = [row["source"] for row in conn.execute("SELECT DISTINCT source FROM emission_factors") if row["source"] not in by_file]
+    for source in stale:
+        index.delete_source(source)
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emission-factor index of the core_db reference documents.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="Re-extract factors from every document in core_db")
+    lookup = commands.add_parser("lookup", help="Look up a substance")
+    lookup.add_argument("substance")
+    lookup.add_argument("--unit")
+    args = parser.parse_args()
+
+    index = factor_index
+    if args.command == "rebuild":
+        from rag import get_chroma_client
+        counts = rebuild(index, get_chroma_client().get_or_create_collection(name="core_db", embedding_function=None))
+        for filename, count in counts.items():
+            print(f"{filename}: {count} factors")
+        print(f"{sum(counts.values())} factors from {len(counts)} files, {len(index.substances())} substances")
+    else:
+        print(json.dumps(index.lookup(args.substance, args.unit), indent=2))
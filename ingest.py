@@ -0,0 +1,315 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import os
+import re
+import sqlite3
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from metrics import logger
+
+class IngestConfig:
+    CHUNK_SIZE = 1000
+    CONSUMPTION_DB_PATH = os.getenv("CONSUMPTION_DB_PATH", "./consumption.db")
+    # Rows listed individually in the parse prompt; older ones are only counted in the per-fuel totals
+    MAX_ROWS_IN_PROMPT = int(os.getenv("MAX_CONSUMPTION_ROWS_IN_PROMPT", "24"))
+
+# --- Table-aware chunking ---
+
+_NUMBER = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+_CELL_SEPARATOR = re.compile(r"\s*(?:\||\t|;|,(?!\d{3})|\s{2,})\s*")
+_MULTIWORD_FUELS = "natural gas|heating oil|fuel oil|jet fuel|jet a"
+# One cell of a line whose columns are single spaces apart: a month and its year, a multi-word fuel name,
+# or a word, each with a '(unit)' that follows it
+_SPACED_CELL = re.compile(r"(?:(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?,?\s+'?\d{2,4}(?!\S)|"
+                          rf"(?:{_MULTIWORD_FUELS})(?!\S)|\S+)(?:\s+\([^)]*\))?", re.I)
+_NUMERIC_CELL = re.compile(rf"\$?(?:{_NUMBER})|\d{{1,4}}[-/.]\d{{1,2}}(?:[-/.]\d{{1,4}})?")
+
+def _cells(line: str) -> List[str]:
+    """
+    Cells of a table row. PyPDF's text keeps only a single space between columns ('03/15/2024 Diesel 45.2 $150.00'),
+    so a line with no wider separator is split at spaces, keeping 'Jan 2024', 'Natural Gas' and 'Diesel (gal)' whole.
+    """
+    cells = _CELL_SEPARATOR.split(line.strip())
+    return cells if len(cells) > 1 else _SPACED_CELL.findall(line)
+
+def _spaced(line: str) -> bool:
+    return _CELL_SEPARATOR.search(line.strip()) is None
+
+def _is_table_line(line: str) -> bool:
+    """Rows of bills and logs: several cells, at least one of them numeric (half of them when single-spaced, unlike prose)."""
+    cells = [c for c in _cells(line) if c]
+    if len(cells) < 3 or not re.search(r"\d", line):
+        return False
+    return not _spaced(line) or 2 * sum(bool(_NUMERIC_CELL.fullmatch(c)) for c in cells) >= len(cells)
+
+def _blocks(text: str) -> List[Tuple[bool, List[str]]]:
+    """Groups lines into runs of table rows and prose. A table needs two rows; its header is the line above."""
+    lines = text.splitlines()
+    blocks: List[Tuple[bool, List[str]]] = []
+    i = 0
+    while i < len(lines):
+        j = i
+        while j < len(lines) and _is_table_line(lines[j]):
+            j += 1
+        if j - i >= 2:
+            # Take the header row along with the table when it's the last line of the preceding prose
+            if blocks and not blocks[-1][0] and blocks[-1][1] and blocks[-1][1][-1].strip():
+                header = blocks[-1][1].pop()
+                blocks.append((True, [header] + lines[i:j]))
+            else:
+                blocks.append((True, lines[i:j]))
+            i = j
+            continue
+        if blocks and not blocks[-1][0]:
+            blocks[-1][1].append(lines[i])
+        else:
+            blocks.append((False, [lines[i]]))
+        i += 1
+    return blocks
+
+def _split_table(lines: List[str], chunk_size: int) -> List[str]:
+    """Splits a table between rows, repeating the header in every chunk."""
+    header, rows = lines[0], lines[1:]
+    chunks, current = [], [header]
+    for row in rows:
+        if len(current) > 1 and sum(len(l) + 1 for l in current) + len(row) > chunk_size:
+            chunks.append("\n".join(current))
+            current = [header]
+        current.append(row)
+    chunks.append("\n".join(current))
+    return chunks
+
+def split_documents(docs: List[Document], chunk_size: int = IngestConfig.CHUNK_SIZE) -> List[Document]:
+    """
+    Chunks documents like RecursiveCharacterTextSplitter, except that tables are never cut mid-row
+    and every table chunk starts with the table's header. Table chunks get content_type='table'.
+    """
+    prose_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0)
+    chunks = []
+    for doc in docs:
+        for is_table, lines in _blocks(doc.page_content):
+            if is_table:
+                for text in _split_table(lines, chunk_size):
+                    chunks.append(Document(page_content=text, metadata={**doc.metadata, "content_type": "table"}))
+            elif "\n".join(lines).strip():
+                chunks.extend(prose_splitter.split_documents([Document(page_content="\n".join(lines), metadata=dict(doc.metadata))]))
+    return chunks
+
+# --- Consumption row extraction ---
+
+UNITS = {
+    "kwh": "kWh", "mwh": "MWh", "gj": "GJ", "therm": "therms", "therms": "therms", "ccf": "ccf", "mcf": "mcf",
+    "m3": "m3", "m³": "m3", "cubic meters": "m3", "gallon": "gallons", "gallons": "gallons", "gal": "gallons",
+    "litre": "litres", "litres": "litres", "liter": "litres", "liters": "litres", "l": "litres",
+    "kg": "kg", "tonne": "tonnes", "tonnes": "tonnes", "ton": "tons", "tons": "tons", "t": "tonnes",
+}
+FUELS = {
+    "electricity": ["electricity", "electric", "power", "grid"],
+    "natural gas": ["natural gas", "gas"],
+    "diesel": ["diesel", "gasoil"],
+    "gasoline": ["gasoline", "petrol", "unleaded"],
+    "propane": ["propane", "lpg"],
+    "heating oil": ["heating oil", "fuel oil", "kerosene"],
+    "coal": ["coal"],
+    "jet fuel": ["jet fuel", "jet a", "avgas"],
+}
+# Used when the row itself doesn't name the fuel
+DEFAULT_FUEL = {"kWh": "electricity", "MWh": "electricity", "therms": "natural gas", "ccf": "natural gas", "mcf": "natural gas"}
+
+MONTHS = {m: i + 1 for i, m in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}
+_UNIT_PATTERN = "|".join(sorted((re.escape(u) for u in UNITS), key=len, reverse=True))
+_QUANTITY = re.compile(rf"(?<![\w.])({_NUMBER})\s*({_UNIT_PATTERN})(?![a-z])", re.I)
+
+def _day_month_year(m) -> Optional[Tuple[str, str]]:
+    """03/15/2024 is US month-first; 15/03/2024 can only be day-first. Month-first when both could be the month."""
+    first, second = int(m.group(1)), int(m.group(3))
+    year = m.group(4) if len(m.group(4)) == 4 else f"20{m.group(4)}"
+    if 1 <= first <= 12 and 1 <= second <= 31:
+        return year, first
+    if 1 <= second <= 12 and 1 <= first <= 31:
+        return year, second
+    return None
+
+_PERIODS = [
+    (re.compile(r"\b(20\d{2})[-/.](0?[1-9]|1[0-2])(?:[-/.]\d{1,2})?\b"), lambda m: (m.group(1), m.group(2))),
+    (re.compile(r"(?<![\d/.-])(\d{1,2})([-/.])(\d{1,2})\2(20\d{2}|\d{2})(?![\d/.-])"), _day_month_year),
+    (re.compile(r"\b(0?[1-9]|1[0-2])[-/.](20\d{2})\b"), lambda m: (m.group(2), m.group(1))),
+    (re.compile(r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?,?\s+'?(20\d{2}|\d{2})\b", re.I),
+     lambda m: (m.group(2) if len(m.group(2)) == 4 else f"20{m.group(2)}", MONTHS[m.group(1).lower()[:3]])),
+]
+
+def find_period(text: str) -> Optional[str]:
+    """First month mentioned in the text as 'YYYY-MM' (handles 2024-01, 03/15/2024, 15/03/2024, 01/2024 and Jan 2024)."""
+    for pattern, parts in _PERIODS:
+        for match in pattern.finditer(text):
+            period = parts(match)
+            if period:
+                year, month = period
+                return f"{int(year):04d}-{int(month):02d}"
+    return None
+
+def find_fuel(text: str) -> Optional[str]:
+    lowered = text.lower()
+    best = None
+    for fuel, keywords in FUELS.items():
+        for keyword in keywords:
+            position = lowered.rfind(keyword)
+            # The keyword closest to the quantity (i.e. last in the text before it) wins, then the longest ('gasoline' over 'gas')
+            if position >= 0 and (best is None or (position, len(keyword)) > best[:2]):
+                best = (position, len(keyword), fuel)
+    return best[2] if best else None
+
+def _number(text: str) -> float:
+    return float(text.replace(",", ""))
+
+def _header_columns(line: str) -> List[Tuple[Optional[str], Optional[str]]]:
+    """(fuel, unit) named by each column of a header row such as 'Month | Electricity (kWh) | Diesel (gal)'."""
+    columns = []
+    cells = _cells(line)
+    if _spaced(line) and any(_NUMERIC_CELL.fullmatch(cell) for cell in cells):
+        return columns # A single-spaced line with figures in it is prose, not a header
+    for cell in cells:
+        unit = next((UNITS[u.lower()] for u in re.findall(rf"(?<![a-z])({_UNIT_PATTERN})(?![a-z])", cell, re.I)), None)
+        columns.append((find_fuel(cell), unit))
+    return columns
+
+def extract_consumption_rows(text: str) -> List[Dict]:
+    """
+    Pulls monthly consumption figures out of bills and fuel logs. Handles rows that carry their own units
+    ('2024-01 electricity 1,037 kWh, diesel 211 gallons') and tables whose header names the columns
+    ('Month | Electricity (kWh) | Diesel (gal)' / 'Jan 2024 | 1,200 | 300'). Lines without a month are skipped.
+    """
+    rows = []
+    header: List[Tuple[Optional[str], Optional[str]]] = []
+    for line in text.splitlines():
+        period = find_period(line)
+        if period is None:
+            columns = _header_columns(line)
+            if len(columns) >= 2 and any(unit for _, unit in columns):
+                header = columns
+            continue
+
+        found = False
+        previous_end = 0
+        for match in _QUANTITY.finditer(line):
+            unit = UNITS[match.group(2).lower()]
+            fuel = find_fuel(line[previous_end:match.start()]) or find_fuel(line[:match.start()]) or DEFAULT_FUEL.get(unit)
+            previous_end = match.end()
+            if fuel is None:
+                continue
+            rows.append({"period": period, "fuel_type": fuel, "quantity": _number(match.group(1)), "unit": unit, "source_text": line.strip()[:200]})
+            found = True
+
+        if not found and header:
+            cells = _cells(line)
+            for cell, (fuel, unit) in zip(cells, header):
+                value = re.fullmatch(rf"\$?({_NUMBER})", cell.strip())
+                if value and unit and find_period(cell) is None:
+                    # Logs often name the fuel in a cell of the row rather than in the header
+                    fuel = fuel or find_fuel(line) or DEFAULT_FUEL.get(unit)
+                    if fuel:
+                        rows.append({"period": period, "fuel_type": fuel, "quantity": _number(value.group(1)), "unit": unit, "source_text": line.strip()[:200]})
+    return rows
+
+# --- Per-user store ---
+
+class ConsumptionStore:
+    """
+    SQLite store of extracted consumption rows, one set per (user, file), each row tagged with the SHA-256
+    of the uploaded file so the same file uploaded under two names can be recognized. Safe to use from any thread.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or IngestConfig.CONSUMPTION_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS consumption_rows (
+                    user_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    fuel_type TEXT NOT NULL,
+                    quantity REAL NOT NULL,
+                    unit TEXT NOT NULL,
+                    source_text TEXT,
+                    created_at TEXT NOT NULL,
+                    content_hash TEXT
+                )
+            """)
+            # Databases created before content_hash was stored
+            if "content_hash" not in {row["name"] for row in conn.execute("PRAGMA table_info(consumption_rows)")}:
+                conn.execute("ALTER TABLE consumption_rows ADD COLUMN content_hash TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS consumption_rows_user ON consumption_rows (user_id, filename)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def replace_file(self, user_id: str, filename: str, rows: List[Dict], content_hash: str = None) -> int:
+        """Stores the rows extracted from one upload, replacing any from an earlier upload of the same file."""
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM consumption_rows WHERE user_id = ? AND filename = ?", (user_id, filename))
+            conn.executemany(
+                "INSERT INTO consumption_rows (user_id, filename, period, fuel_type, quantity, unit, source_text, created_at, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(user_id, filename, r["period"], r["fuel_type"], r["quantity"], r["unit"], r.get("source_text"), created_at, content_hash) for r in rows],
+            )
+        return len(rows)
+
+    def delete_file(self, user_id: str, filename: str) -> int:
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM consumption_rows WHERE user_id = ? AND filename = ?", (user_id, filename)).rowcount
+
+    def rows_for_user(self, user_id: str) -> List[Dict]:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "SELECT filename, period, fuel_type, quantity, unit, content_hash FROM consumption_rows WHERE user_id = ? ORDER BY period, fuel_type",
+                (user_id,),
+            )
+            return [dict(row) for row in cursor.fetchall()]
+
+def format_consumption(rows: List[Dict], max_rows: int = None) -> str:
+    """
+    Compact text of a user's consumption rows for the parse prompt: a monthly average per fuel and unit,
+    then the most recent monthly totals. Rows in the same month are summed, including those of different
+    files (two meters, two sites). A file whose content is identical to another's (the same bill uploaded
+    under two names) is only counted once; equal totals alone don't make files duplicates.
+    """
+    if not rows:
+        return ""
+    max_rows = IngestConfig.MAX_ROWS_IN_PROMPT if max_rows is None else max_rows
+    kept_file = {}
+    for r in rows:
+        kept_file.setdefault(r.get("content_hash") or ("filename", r["filename"]), r["filename"])
+    counted = set(kept_file.values())
+    monthly = defaultdict(float)
+    for r in rows:
+        if r["filename"] in counted:
+            monthly[(r["period"], r["fuel_type"], r["unit"])] += r["quantity"]
+    unique = {key: {"period": key[0], "fuel_type": key[1], "unit": key[2], "quantity": quantity} for key, quantity in monthly.items()}
+    totals = defaultdict(list)
+    for (period, fuel, unit), row in unique.items():
+        totals[(fuel, unit)].append((period, row["quantity"]))
+
+    lines = ["Monthly averages:"]
+    for (fuel, unit), values in sorted(totals.items()):
+        periods = sorted(p for p, _ in values)
+        average = sum(q for _, q in values) / len(values)
+        lines.append(f"- {fuel}: {average:,.1f} {unit} per month (average of {len(values)} months, {periods[0]} to {periods[-1]})")
+    recent = sorted(unique.values(), key=lambda r: r["period"])[-max_rows:]
+    lines.append("Recent monthly totals (period, fuel, quantity, unit):")
+    lines.extend(f"- {r['period']}, {r['fuel_type']}, {r['quantity']:g}, {r['unit']}" for r in recent)
+    return "\n".join(lines)
+
+def extract_and_store(store: ConsumptionStore, user_id: str, filename: str, docs: List[Document], content_hash: str = None) -> int:
+    """Runs extraction over an upload's documents and saves the rows. Returns how many were found."""
+    rows = []
+    for doc in docs:
+        rows.extend(extract_consumption_rows(doc.page_content))
+    logger.info(f"Extracted {len(rows)} consumption rows from {filename}")
+    return store.replace_file(user_id, filename, rows, content_hash)
@@ -0,0 +1,213 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from session import estimate_tokens
+from metrics import logger
+
+class BudgetConfig:
+    # Per process_summary run; 0 disables a limit
+    MAX_TOKENS = int(os.getenv("RUN_MAX_TOKENS", "60000"))
+    MAX_TOOL_CALLS = int(os.getenv("RUN_MAX_TOOL_CALLS", "8"))
+    DEADLINE_SEC = float(os.getenv("RUN_DEADLINE_SEC", "240"))
+    USAGE_LOG_PATH = os.getenv("RUN_USAGE_LOG", "./runs/usage.jsonl")
+
+class BudgetExceeded(Exception):
+    """Raised from inside a Crew run when it goes over one of its BudgetConfig limits."""
+
+_log_lock = threading.Lock()
+
+class RunAccount:
+    """
+    Token, call, tool and wall-time accounting for one process_summary run, broken down per agent.
+    Agents report through step_callback (one call per LLM step), tools through record_tool_call.
+    Token counts are the provider's when the LLM client reports usage (record_usage, called by
+    router.RoutedCrewLLM around each provider call), else estimates: completion tokens from each step's
+    output, prompt tokens from the task prompt plus the transcript the agent has built up so far.
+    """
+
+    def __init__(self, user_id: str = None):
+        self.run_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.agents: Dict[str, Dict] = {}
+        self._transcript_tokens: Dict[str, int] = {}
+        self._last_event: Dict[str, float] = {}
+        self._task_steps: Dict[str, int] = {}
+        # Provider-reported [prompt, completion] tokens of each agent's calls since its last step
+        self._reported: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.stopped_reason: Optional[str] = None
+
+    def _agent(self, role: str) -> Dict:
+        if role not in self.agents:
+            self.agents[role] = {
+                "task": None, "prompt_tokens": 0, "completion_tokens": 0,
+                "llm_calls": 0, "tool_calls": 0, "wall_time_sec": 0.0, "reported_steps": 0,
+            }
+        return self.agents[role]
+
+    def start_task(self, role: str, task_name: str, prompt: str):
+        """Marks the start of an agent's task; its prompt is resent on every step of the task."""
+        with self._lock:
+            self._agent(role)["task"] = task_name
+            self._transcript_tokens[role] = estimate_tokens(prompt)
+            self._last_event[role] = time.perf_counter()
+            self._task_steps[role] = 0
+
+    @property
+    def total_tokens(self) -> int:
+        recorded = sum(a["prompt_tokens"] + a["completion_tokens"] for a in self.agents.values())
+        return recorded + sum(prompt + completion for prompt, completion in list(self._reported.values()))
+
+    def record_usage(self, role: str, prompt_tokens: int, completion_tokens: int):
+        """Adds token usage the provider reported for one of the agent's calls (retries and hedges included)."""
+        if prompt_tokens or completion_tokens:
+            with self._lock:
+                pending = self._reported.setdefault(role, [0, 0])
+                pending[0] += prompt_tokens
+                pending[1] += completion_tokens
+
+    @property
+    def total_tool_calls(self) -> int:
+        return sum(a["tool_calls"] for a in self.agents.values())
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def check_budget(self):
+        """Raises BudgetExceeded once any limit is crossed."""
+        reason = None
+        if BudgetConfig.MAX_TOKENS and self.total_tokens > BudgetConfig.MAX_TOKENS:
+            reason = f"token budget of {BudgetConfig.MAX_TOKENS} exceeded ({self.total_tokens})"
+        elif BudgetConfig.MAX_TOOL_CALLS and self.total_tool_calls > BudgetConfig.MAX_TOOL_CALLS:
+            reason = f"tool call budget of {BudgetConfig.MAX_TOOL_CALLS} exceeded"
+        elif BudgetConfig.DEADLINE_SEC and self.elapsed() > BudgetConfig.DEADLINE_SEC:
+            reason = f"deadline of {BudgetConfig.DEADLINE_SEC}s exceeded"
+        if reason:
+            self.stopped_reason = reason
+            raise BudgetExceeded(reason)
+
+    def step_callback(self, role: str):
+        """Returns an Agent step_callback that records one LLM call per step for the given agent."""
+        def on_step(step):
+            completion = getattr(step, "text", None) or str(getattr(step, "output", step))
+            observation = getattr(step, "result", None) or ""
+            self._record_call(role, completion, str(observation))
+            self.check_budget()
+        return on_step
+
+    def _record_call(self, role: str, completion: str, observation: str = ""):
+        now = time.perf_counter()
+        with self._lock:
+            agent = self._agent(role)
+            prompt_tokens = self._transcript_tokens.get(role, 0)
+            completion_tokens = estimate_tokens(completion)
+            reported = self._reported.pop(role, None)
+            agent["llm_calls"] += 1
+            if reported:
+                agent["prompt_tokens"] += reported[0]
+                agent["completion_tokens"] += reported[1]
+                agent["reported_steps"] += 1
+            else:
+                agent["prompt_tokens"] += prompt_tokens
+                agent["completion_tokens"] += completion_tokens
+            agent["wall_time_sec"] += now - self._last_event.get(role, self.started)
+            self._last_event[role] = now
+            self._task_steps[role] = self._task_steps.get(role, 0) + 1
+            self._transcript_tokens[role] = prompt_tokens + completion_tokens + (estimate_tokens(observation) if observation else 0)
+
+    def finish_task(self, role: str, output: str):
+        """
+        Closes an agent's task. Some Crew executors skip step_callback when the first answer is final;
+        the task still took one LLM call to produce its output, so it's recorded here.
+        """
+        if self._task_steps.get(role, 0) == 0:
+            self._record_call(role, output)
+        self.check_budget()
+
+    def record_tool_call(self, role: str, tool_name: str) -> bool:
+        """Counts a tool call. Returns False when the run's tool budget is already used up."""
+        with self._lock:
+            self._agent(role)["tool_calls"] += 1
+            over = BudgetConfig.MAX_TOOL_CALLS and self.total_tool_calls > BudgetConfig.MAX_TOOL_CALLS
+        if over:
+            self.stopped_reason = self.stopped_reason or f"tool call budget of {BudgetConfig.MAX_TOOL_CALLS} exceeded"
+            logger.warning(f"Run {self.run_id}: {role} called {tool_name} over the tool call budget")
+        return not over
+
+    def finish(self, status: str, reported_usage: Optional[dict] = None) -> dict:
+        """Appends the run record to BudgetConfig.USAGE_LOG_PATH and returns it."""
+        with self._lock:
+            # Usage of calls no step followed (a failed last step, a hedge that lost)
+            for role, (prompt_tokens, completion_tokens) in self._reported.items():
+                self._agent(role)["prompt_tokens"] += prompt_tokens
+                self._agent(role)["completion_tokens"] += completion_tokens
+            self._reported.clear()
+        record = {
+            "run_id": self.run_id,
+            "user_id": self.user_id,
+            "started_at": self.started_at,
+            "status": status,
+            "stopped_reason": self.stopped_reason,
+            "wall_time_sec": round(self.elapsed(), 3),
+            "total_tokens": self.total_tokens,
+            "tool_calls": self.total_tool_calls,
+            "agents": {role: {**a, "wall_time_sec": round(a["wall_time_sec"], 3)} for role, a in self.agents.items()},
+            "reported_usage": reported_usage,
+        }
+        try:
+            directory = os.path.dirname(BudgetConfig.USAGE_LOG_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with _log_lock, open(BudgetConfig.USAGE_LOG_PATH, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.error(f"Could not persist usage for run {self.run_id}: {e}")
+        logger.info("crew run finished", extra={"fields": {"run_id": self.run_id, "status": status, "total_tokens": self.total_tokens}})
+        return record
+
+def load_runs(path: str, last: int):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = f.readlines()
+    return [json.loads(line) for line in lines[-last:] if line.strip()]
+
+def report(runs) -> str:
+    """Per-agent averages over the given runs, plus how many runs each budget stopped."""
+    if not runs:
+        return "No runs recorded."
+    per_agent = defaultdict(lambda: defaultdict(float))
+    for run in runs:
+        for role, usage in run["agents"].items():
+            per_agent[role]["runs"] += 1
+            for key in ("prompt_tokens", "completion_tokens", "llm_calls", "tool_calls", "wall_time_sec"):
+                per_agent[role][key] += usage[key]
+
+    lines = [f"{len(runs)} runs, {sum(r['status'] != 'ok' for r in runs)} not ok, "
+             f"avg {sum(r['total_tokens'] for r in runs) / len(runs):.0f} tokens, "
+             f"avg {sum(r['wall_time_sec'] for r in runs) / len(runs):.1f}s wall time",
+             f"{'agent':28} {'prompt tok':>10} {'compl tok':>10} {'calls':>6} {'tools':>6} {'wall s':>7}"]
+    for role, totals in sorted(per_agent.items(), key=lambda item: -item[1]["wall_time_sec"]):
+        n = totals["runs"]
+        lines.append(f"{role:28} {totals['prompt_tokens'] / n:>10.0f} {totals['completion_tokens'] / n:>10.0f} "
+                     f"{totals['llm_calls'] / n:>6.1f} {totals['tool_calls'] / n:>6.1f} {totals['wall_time_sec'] / n:>7.2f}")
+    stopped = [r["stopped_reason"] for r in runs if r.get("stopped_reason")]
+    if stopped:
+        lines.append(f"Stopped by budget: {len(stopped)} (latest: {stopped[-1]})")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize LLM usage of recent process_summary runs.")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--last", type=int, default=20)
+    parser.add_argument("--path", default=BudgetConfig.USAGE_LOG_PATH)
+    args = parser.parse_args()
+    print(report(load_runs(args.path, args.last)))
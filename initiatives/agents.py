@@ -2,24 +2,39 @@ from crewai import Agent, LLM
 from textwrap import dedent
 from groq import Groq
 from dotenv import load_dotenv
-from .tools import CoreKnowledgeLookupTool, CustomCalculatorTool
-from langchain_openai import ChatOpenAI
+from .tools import CoreKnowledgeLookupTool, CustomCalculatorTool, EmissionFactorLookupTool
+from .router import RoutedCrewLLM
+from .resilience import ResilienceConfig
 
 load_dotenv()
 groq_client = Groq()
 
-llm = LLM(model="groq/deepseek-r1-distill-llama-70b")
-llama_llm = LLM(model="groq/llama-3.3-70b-versatile")
-llama_fast_llm = LLM(model="groq/llama-3.3-70b-specdec")
+def crew_llm(model: str) -> LLM:
+    """A new LLM client for a model name (see router.RouterConfig for the tiers)."""
+    timeout = ResilienceConfig.CLIENT_TIMEOUT_SEC
+    return LLM(model=model, temperature=0.7, timeout=timeout) if model.startswith("openai/") else LLM(model=model, timeout=timeout)
 
-openai_llm = ChatOpenAI(
-            model="gpt-4o-mini", 
-            temperature=0.7 
-        )
+def routed_llm(route: str, account=None, role: str = "") -> RoutedCrewLLM:
+    # Each agent step goes to the cheapest tier that fits, escalating on invalid output (initiatives/router.py)
+    clients = {}
+
+    def client(model: str):
+        # Clients are the agent's own, so the token usage the provider reports on them is this run's alone
+        if model not in clients:
+            clients[model] = crew_llm(model)
+        return clients[model]
+    return RoutedCrewLLM(model=f"routed/{route}", route=route, factory=client, account=account, agent_role=role)
 
 
 class CarbonAgents:
 
+    def __init__(self, account=None):
+        # Optional RunAccount that meters each agent's steps and tool calls
+        self.account = account
+
+    def _step_callback(self, role):
+        return self.account.step_callback(role) if self.account else None
+
     def operations_analyst(self):
         return Agent(
             role="Operations Analyst",
@@ -27,19 +42,22 @@ class CarbonAgents:
             goal=dedent("""Parse the company description and any uploaded file data to extract structured data about emission sources."""),
             verbose=True,
             allow_delegation=False,
-            llm=llm,
+            llm=routed_llm("parse", self.account, "Operations Analyst"),
+            step_callback=self._step_callback("Operations Analyst"),
         )
 
     def emissions_expert(self):
-        knowledge_tool_instance = CoreKnowledgeLookupTool()
-        calculator_tool_instance = CustomCalculatorTool()
+        factor_tool_instance = EmissionFactorLookupTool(run_account=self.account, agent_role="Emissions Expert")
+        knowledge_tool_instance = CoreKnowledgeLookupTool(run_account=self.account, agent_role="Emissions Expert")
+        calculator_tool_instance = CustomCalculatorTool(run_account=self.account, agent_role="Emissions Expert")
 
 
         return Agent(
             role="Emissions Expert",
             goal=dedent("""Calculate total carbon emissions based on structured data.
                 Before calculating, critically assess if you need specific information (like emission factors, calculation methodologies for unusual sources, or conversion constants) that isn't common knowledge or provided in the context.
-                If specific information is needed, formulate a precise question and use the 'Core Knowledge Lookup' tool ONCE for that piece of information.
+                For an emission factor, use the 'Emission Factor Lookup' tool with the substance name first.
+                If other specific information is needed, or no factor is indexed, formulate a precise question and use the 'Core Knowledge Lookup' tool ONCE for that piece of information.
                 Evaluate the retrieved information: Is it directly relevant and useful for *this calculation*?
                 If relevant, use it. If not relevant, or if the tool finds nothing, proceed using standard assumptions or clearly state the limitation/unhandled source in your output.
                 Do NOT use the tool speculatively or for general knowledge. Focus only on necessary data for the calculation. Avoid getting sidetracked by irrelevant details.
@@ -48,10 +66,11 @@ class CarbonAgents:
                 You are a precise and efficient emissions calculation specialist. 
                 You rely on provided data and standard factors, but you know when to seek specific, necessary information using the knowledge lookup tool. 
                 You don't waste time on irrelevant lookups and focus solely on accurate calculation based on available, relevant data."""),
-            tools=[knowledge_tool_instance, calculator_tool_instance],  
+            tools=[factor_tool_instance, knowledge_tool_instance, calculator_tool_instance],  
             allow_delegation=False, 
             verbose=True,
-            llm=openai_llm
+            llm=routed_llm("calculate", self.account, "Emissions Expert"),
+            step_callback=self._step_callback("Emissions Expert"),
         )
 
     def sustainability_advisor(self):
@@ -61,7 +80,8 @@ class CarbonAgents:
             goal=dedent("""Provide tailored suggestions to reduce the company’s carbon footprint, including metrics to track."""),
             verbose=True,
             allow_delegation=False,
-            llm=llm
+            llm=routed_llm("suggest", self.account, "Sustainability Advisor"),
+            step_callback=self._step_callback("Sustainability Advisor"),
         )
 
     # def tracking_system_designer(self):
@@ -1,8 +1,12 @@
 import re
+import time
 from initiatives.agents import CarbonAgents
 from initiatives.tasks import CarbonTasks
 from crewai import Task, Crew
-from rag import get_retriever
+from rag import get_user_retriever
+from metrics import stage, logger, CrewTaskTimer
+from initiatives.accounting import RunAccount, BudgetExceeded
+from ingest import ConsumptionStore, format_consumption
 
 def remove_code_fences(text):
     # Removes all code block markers like ```json or ```
@@ -19,45 +23,94 @@ def clean_outputs(full_list):
         cleaned_outputs.append(cleaned_output) 
     return cleaned_outputs
 
-def process_summary(summary: str, user_id: str):
-    agents = CarbonAgents()
+def process_summary(summary: str, user_id: str, user_context: bool = True):
+    """
+    Runs the parse, calculate and suggest Crew for a company description, metered to user_id.
+    user_context: add the user's uploaded files and consumption records to the parse prompt. Off for
+    descriptions of companies other than the user's own (batch assessments).
+    """
+    account = RunAccount(str(user_id))
+    agents = CarbonAgents(account)
     tasks = CarbonTasks()
 
-    try:
-        user_retriever = get_retriever(f"user_{user_id}")
-        docs = user_retriever.get_relevant_documents(summary)
-        file_context = "\n".join([doc.page_content for doc in docs]) if docs else ""
-    except Exception as e:
-        file_context = f"Error retrieving user context: {str(e)}"
+    file_context, consumption = "", ""
+    if user_context:
+        try:
+            with stage("retrieval.user_context"):
+                user_retriever = get_user_retriever(str(user_id))
+                docs = user_retriever.get_relevant_documents(summary)
+            file_context = "\n".join([doc.page_content for doc in docs]) if docs else ""
+        except Exception as e:
+            file_context = f"Error retrieving user context: {str(e)}"
+
+        # Rows extracted from bills and fuel logs at upload time, so the parse task doesn't have to re-read tables
+        try:
+            with stage("consumption.read"):
+                consumption = format_consumption(ConsumptionStore().rows_for_user(str(user_id)))
+        except Exception as e:
+            logger.error(f"Error reading consumption rows for user {user_id}: {e}")
+
+    operations_analyst = agents.operations_analyst()
+    emissions_expert = agents.emissions_expert()
+    sustainability_advisor = agents.sustainability_advisor()
 
     parse_task = Task(
-        description=tasks.parse_description(summary, file_context),
+        name="parse",
+        description=tasks.parse_description(summary, file_context, consumption),
         expected_output="JSON structured data",
-        agent=agents.operations_analyst(),
+        agent=operations_analyst,
     )
 
     calc_task = Task(
+        name="calculate",
         description=tasks.calculate_emissions_description(),
         expected_output="JSON emissions data",
-        agent=agents.emissions_expert(),
+        agent=emissions_expert,
         context=[parse_task],
     )
 
     suggest_task = Task(
+        name="suggest",
         description=tasks.suggest_initiatives_description(),
         expected_output="JSON list of initiatives",
-        agent=agents.sustainability_advisor(),
+        agent=sustainability_advisor,
         context=[parse_task, calc_task],
     )
 
+    crew_tasks = [parse_task, calc_task, suggest_task]
+    task_timer = CrewTaskTimer()
+
+    def on_task_done(task_output):
+        task_timer(task_output)
+        account.finish_task(str(task_output.agent), task_output.raw)
+        # Tasks run sequentially: start metering the next one with its prompt and the context it receives
+        done = sum(task.output is not None for task in crew_tasks) or 1
+        if done < len(crew_tasks):
+            next_task = crew_tasks[done]
+            context = "\n".join(task.output.raw for task in next_task.context or [] if task.output is not None)
+            account.start_task(next_task.agent.role, next_task.name, next_task.description + context)
+
     crew = Crew(
-    agents=[agents.operations_analyst(), agents.emissions_expert(), 
-            agents.sustainability_advisor()],
-    tasks=[parse_task, calc_task, suggest_task],
-    verbose=True
+    agents=[operations_analyst, emissions_expert, sustainability_advisor],
+    tasks=crew_tasks,
+    verbose=True,
+    task_callback=on_task_done
     )
 
-    crew.kickoff()
+    account.start_task(operations_analyst.role, parse_task.name, parse_task.description)
+    task_timer.last = time.perf_counter()
+    try:
+        with stage("crew.kickoff"):
+            crew.kickoff()
+    except BudgetExceeded:
+        account.finish("budget_exceeded")
+        raise
+    except Exception:
+        account.finish("error")
+        raise
+    usage = getattr(crew, "usage_metrics", None)
+    account.finish("ok", reported_usage=usage.model_dump() if hasattr(usage, "model_dump") else None)
+
     outputs = [
         parse_task.output.raw,
         calc_task.output.raw,
@@ -65,7 +118,7 @@ def process_summary(summary: str, user_id: str):
     ]
     final_output = clean_outputs(outputs)
     for output in final_output:
-        print(output + "-------")
+        logger.debug(output)
     return final_output
 
 # process_summary("A manufacturing plant with 70 diesel vans, each consuming 30 gallons of diesel a month.")
\ No newline at end of file
@@ -0,0 +1,313 @@
+"""
+Deadlines, circuit breakers and hedging for LLM calls (used by ModelRouter for every attempt).
+
+- Every attempt has a deadline (the route's Route.deadline_sec). A call past it is abandoned and counts
+  as a failure of that model.
+- Each model has a circuit breaker. After BREAKER_FAILURES consecutive failures it opens for
+  BREAKER_COOLDOWN_SEC: calls skip the model without waiting on it. The first call after the cooldown
+  is a probe that closes it again on success.
+- A call whose model fails or is open falls back once to the model's backup on another provider.
+- With LLM_HEDGING=true, a call still running after the model's p95 latency gets a duplicate on the backup,
+  and whichever answers first wins. The other is cancelled (async) or left to finish in the background (sync).
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from metrics import logger, LLM_RESILIENCE_EVENTS
+
+class ResilienceConfig:
+    HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+    # Backup for models of another provider; a model whose provider is the backup's falls back to SECOND_BACKUP_MODEL
+    BACKUP_MODEL = os.getenv("LLM_BACKUP_MODEL", "openai/gpt-4o-mini")
+    SECOND_BACKUP_MODEL = os.getenv("LLM_SECOND_BACKUP_MODEL", "groq/llama-3.3-70b-versatile")
+    BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+    BREAKER_COOLDOWN_SEC = float(os.getenv("LLM_BREAKER_COOLDOWN_SEC", "30"))
+    # Hedge after the model's p95 over its last HEDGE_WINDOW successful calls; until there are
+    # HEDGE_MIN_SAMPLES of them, after HEDGE_DEFAULT_DELAY_SEC
+    HEDGE_QUANTILE = 0.95
+    HEDGE_WINDOW = 200
+    HEDGE_MIN_SAMPLES = 20
+    HEDGE_DEFAULT_DELAY_SEC = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SEC", "3"))
+    # Threads for sync calls; abandoned calls hold one until the client's own timeout ends them
+    WORKERS = int(os.getenv("LLM_CALL_WORKERS", "64"))
+    # HTTP timeout of the Groq/OpenAI clients, the longest any abandoned call keeps running
+    CLIENT_TIMEOUT_SEC = float(os.getenv("LLM_CLIENT_TIMEOUT_SEC", "60"))
+
+class LLMUnavailable(Exception):
+    """No model could answer within the deadline: the model and its backup failed, timed out or are open."""
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+def provider(model: str) -> str:
+    return model.split("/", 1)[0] if "/" in model else ""
+
+def backup_for(model: str) -> Optional[str]:
+    backup = ResilienceConfig.BACKUP_MODEL if provider(model) != provider(ResilienceConfig.BACKUP_MODEL) else ResilienceConfig.SECOND_BACKUP_MODEL
+    return backup if backup and backup != model else None
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open (cooldown) -> half-open (one probe) -> closed or open."""
+
+    def __init__(self, failures: int = None, cooldown_sec: float = None):
+        self.max_failures = failures or ResilienceConfig.BREAKER_FAILURES
+        self.cooldown_sec = ResilienceConfig.BREAKER_COOLDOWN_SEC if cooldown_sec is None else cooldown_sec
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown_sec else "open"
+
+    def available(self) -> bool:
+        """Whether a call could go through now (without claiming the half-open probe)."""
+        with self._lock:
+            state = self._state()
+            return state == "closed" or (state == "half_open" and not self.probing)
+
+    def acquire(self) -> bool:
+        """Claims a call; in half-open state only one caller gets through until it reports back."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self):
+        """The call ended without a verdict (a cancelled hedge): let another probe through."""
+        with self._lock:
+            self.probing = False
+
+class LatencyWindow:
+    """Recent successful call latencies of one model, for the hedge delay."""
+
+    def __init__(self, size: int = None):
+        self.samples = deque(maxlen=size or ResilienceConfig.HEDGE_WINDOW)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < ResilienceConfig.HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class ResilientCaller:
+    """
+    Runs invoke(model) with a deadline, breaker checks, backup fallback and optional hedging.
+    call() and acall() return (model that answered, result) or raise LLMUnavailable.
+    """
+
+    def __init__(self, hedging: bool = None, backup: Callable[[str], Optional[str]] = backup_for, executor: ThreadPoolExecutor = None):
+        self.hedging = ResilienceConfig.HEDGING if hedging is None else hedging
+        self.backup = backup
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latency: Dict[str, LatencyWindow] = {}
+        self.executor = executor or ThreadPoolExecutor(max_workers=ResilienceConfig.WORKERS, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            return self.breakers.setdefault(model, CircuitBreaker())
+
+    def available(self, model: str) -> bool:
+        return self.breaker(model).available()
+
+    def hedge_delay(self, model: str) -> float:
+        with self._lock:
+            window = self.latency.setdefault(model, LatencyWindow())
+        p95 = window.quantile(ResilienceConfig.HEDGE_QUANTILE)
+        return ResilienceConfig.HEDGE_DEFAULT_DELAY_SEC if p95 is None else p95
+
+    def _succeeded(self, model: str, seconds: float):
+        self.breaker(model).success()
+        with self._lock:
+            window = self.latency.setdefault(model, LatencyWindow())
+        window.add(seconds)
+
+    def _failed(self, model: str, error: BaseException):
+        event = "timeout" if isinstance(error, DeadlineExceeded) else "error"
+        LLM_RESILIENCE_EVENTS.labels(model, event).inc()
+        logger.warning(f"LLM call on {model} failed: {type(error).__name__}: {error}")
+        self.breaker(model).failure()
+
+    def _plan(self, model: str) -> Tuple[Optional[str], Optional[str]]:
+        """(primary, backup) after breaker checks; a skipped primary leaves only the backup."""
+        backup = self.backup(model)
+        primary = model if self.breaker(model).acquire() else None
+        if primary is None:
+            LLM_RESILIENCE_EVENTS.labels(model, "short_circuit").inc()
+        if backup is not None and not self.breaker(backup).available():
+            backup = None
+        if primary is None and backup is None:
+            raise LLMUnavailable(f"{model} circuit is open and there is no available backup")
+        return primary, backup
+
+    # --- sync ---
+
+    def _run(self, model: str, invoke: Callable[[str], Any]):
+        started = time.perf_counter()
+        return model, started, self.executor.submit(contextvars.copy_context().run, invoke, model)
+
+    def _settle(self, attempt, deadline_at: float):
+        """Waits for one attempt until deadline_at, recording the outcome on the model's breaker."""
+        model, started, future = attempt
+        try:
+            result = future.result(timeout=max(0.0, deadline_at - time.monotonic()))
+        except TimeoutError:
+            self._failed(model, DeadlineExceeded("no answer within the deadline"))
+            raise DeadlineExceeded(model)
+        except Exception as e:
+            self._failed(model, e)
+            raise
+        self._succeeded(model, time.perf_counter() - started)
+        return model, result
+
+    def call(self, model: str, invoke: Callable[[str], Any], deadline_sec: float) -> Tuple[str, Any]:
+        primary, backup = self._plan(model)
+        if primary is None:
+            return self._fallback(model, backup, invoke, deadline_sec)
+        deadline_at = time.monotonic() + deadline_sec
+        attempt = self._run(primary, invoke)
+        if self.hedging and backup is not None:
+            done, _ = wait([attempt[2]], timeout=min(self.hedge_delay(primary), deadline_sec))
+            if not done and self.breaker(backup).acquire():
+                LLM_RESILIENCE_EVENTS.labels(primary, "hedge").inc()
+                return self._race(attempt, self._run(backup, invoke), deadline_at)
+        try:
+            return self._settle(attempt, deadline_at)
+        except Exception as e:
+            if backup is None:
+                raise LLMUnavailable(f"{primary} failed and has no available backup") from e
+        return self._fallback(primary, backup, invoke, deadline_sec)
+
+    def _fallback(self, model: str, backup: str, invoke, deadline_sec: float) -> Tuple[str, Any]:
+        LLM_RESILIENCE_EVENTS.labels(model, "fallback").inc()
+        logger.warning(f"Falling back from {model} to {backup}")
+        if not self.breaker(backup).acquire():
+            raise LLMUnavailable(f"{model} failed and the circuit of its backup {backup} is open")
+        try:
+            return self._settle(self._run(backup, invoke), time.monotonic() + deadline_sec)
+        except Exception as e:
+            raise LLMUnavailable(f"{model} and its backup {backup} both failed") from e
+
+    def _race(self, primary, hedge, deadline_at: float) -> Tuple[str, Any]:
+        """First successful answer of two attempts within the deadline."""
+        pending = {primary[2]: primary, hedge[2]: hedge}
+        while pending:
+            done, _ = wait(list(pending), timeout=max(0.0, deadline_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                attempt = pending.pop(future)
+                try:
+                    model, result = self._settle(attempt, deadline_at)
+                except Exception:
+                    continue
+                if attempt is hedge:
+                    LLM_RESILIENCE_EVENTS.labels(primary[0], "hedge_won").inc()
+                for loser in pending.values():
+                    loser[2].cancel()
+                    self.breaker(loser[0]).release()
+                return model, result
+        for attempt in pending.values():
+            self._failed(attempt[0], DeadlineExceeded("no answer within the deadline"))
+        raise LLMUnavailable(f"{primary[0]} and its hedge on {hedge[0]} both failed or timed out")
+
+    # --- async ---
+
+    async def _arun(self, model: str, invoke, deadline_at: float) -> Tuple[str, Any]:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(invoke(model), timeout=max(0.0, deadline_at - time.monotonic()))
+        except asyncio.CancelledError:
+            self.breaker(model).release()
+            raise
+        except asyncio.TimeoutError:
+            self._failed(model, DeadlineExceeded("no answer within the deadline"))
+            raise DeadlineExceeded(model)
+        except Exception as e:
+            self._failed(model, e)
+            raise
+        self._succeeded(model, time.perf_counter() - started)
+        return model, result
+
+    async def acall(self, model: str, invoke, deadline_sec: float) -> Tuple[str, Any]:
+        """call() for an async invoke(model)."""
+        primary, backup = self._plan(model)
+        if primary is None:
+            return await self._afallback(model, backup, invoke, deadline_sec)
+        deadline_at = time.monotonic() + deadline_sec
+        first = asyncio.ensure_future(self._arun(primary, invoke, deadline_at))
+        if self.hedging and backup is not None:
+            done, _ = await asyncio.wait({first}, timeout=min(self.hedge_delay(primary), deadline_sec))
+            if not done and self.breaker(backup).acquire():
+                LLM_RESILIENCE_EVENTS.labels(primary, "hedge").inc()
+                second = asyncio.ensure_future(self._arun(backup, invoke, deadline_at))
+                return await self._arace(primary, first, second)
+        try:
+            return await first
+        except Exception as e:
+            if backup is None:
+                raise LLMUnavailable(f"{primary} failed and has no available backup") from e
+        return await self._afallback(primary, backup, invoke, deadline_sec)
+
+    async def _afallback(self, model: str, backup: str, invoke, deadline_sec: float) -> Tuple[str, Any]:
+        LLM_RESILIENCE_EVENTS.labels(model, "fallback").inc()
+        logger.warning(f"Falling back from {model} to {backup}")
+        if not self.breaker(backup).acquire():
+            raise LLMUnavailable(f"{model} failed and the circuit of its backup {backup} is open")
+        try:
+            return await self._arun(backup, invoke, time.monotonic() + deadline_sec)
+        except Exception as e:
+            raise LLMUnavailable(f"{model} and its backup {backup} both failed") from e
+
+    async def _arace(self, model: str, first: asyncio.Future, second: asyncio.Future) -> Tuple[str, Any]:
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            LLM_RESILIENCE_EVENTS.labels(model, "hedge_won").inc()
+                        return task.result()
+            raise LLMUnavailable(f"{model} and its hedge both failed or timed out")
+        finally:
+            for task in pending:
+                task.cancel()
+
+resilient_caller = ResilientCaller()
@@ -0,0 +1,312 @@
+"""
+Latency-aware model routing for the chat chain and the Crew agents.
+Each call has a route (its task type). A route lists model tiers from cheapest/fastest to heaviest; a call
+goes to the first tier that fits its prompt size, is within the route's latency budget (by the tier's
+observed latency) and hasn't been failing validation for that route. If the answer fails validation, it is
+retried once on the route's last, heaviest tier. Stalls and errors are handled per attempt by resilience.py
+(deadline, circuit breaker, backup model, hedging).
+"""
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+import json
+import os
+import re
+import threading
+import time
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatResult
+from crewai import BaseLLM
+from crewai.llms.base_llm import call_stop_override
+from session import estimate_tokens
+from .resilience import ResilientCaller, LLMUnavailable, resilient_caller
+from metrics import logger, observe_stage, LLM_ROUTED_CALLS
+
+class Route(NamedTuple):
+    tiers: List[str]           # Cheapest first; the last one is the escalation target
+    max_fast_input_tokens: int # Larger prompts skip straight to the last tier
+    latency_budget_sec: float  # Tiers observed slower than this are skipped
+    deadline_sec: float = 60.0 # Per attempt, after which it is abandoned (see resilience.py)
+
+SMALL = os.getenv("LLM_SMALL_MODEL", "groq/llama-3.1-8b-instant")
+FAST = os.getenv("LLM_FAST_MODEL", "groq/llama-3.3-70b-specdec")
+STANDARD = os.getenv("LLM_STANDARD_MODEL", "groq/llama-3.3-70b-versatile")
+HEAVY = os.getenv("LLM_HEAVY_MODEL", "groq/deepseek-r1-distill-llama-70b")
+
+class RouterConfig:
+    ENABLED = os.getenv("LLM_ROUTING", "true").lower() == "true"
+    ROUTES = {
+        "parse": Route([SMALL, FAST, HEAVY], 6000, 20, 45),
+        "calculate": Route(["openai/gpt-4o-mini", FAST, HEAVY], 8000, 40, 60),
+        "suggest": Route([FAST, HEAVY], 6000, 30, 60),
+        "chat_rewrite": Route([SMALL, STANDARD], 4000, 2, 8),
+        "chat": Route([FAST, STANDARD], 3000, 5, 15),
+        "summary": Route([SMALL, STANDARD], 4000, 10, 20),
+    }
+    # What each route used before routing (one model, no escalation); LLM_ROUTING=false restores it
+    FIXED_ROUTES = {
+        "parse": Route([HEAVY], 0, 0, 45),
+        "calculate": Route(["openai/gpt-4o-mini"], 0, 0, 60),
+        "suggest": Route([HEAVY], 0, 0, 60),
+        "chat_rewrite": Route([STANDARD], 0, 0, 8),
+        "chat": Route([STANDARD], 0, 0, 15),
+        "summary": Route([STANDARD], 0, 0, 20),
+    }
+    # USD per million (prompt, completion) tokens, for the cost report
+    PRICES = {
+        "groq/llama-3.1-8b-instant": (0.05, 0.08),
+        "groq/llama-3.3-70b-specdec": (0.59, 0.99),
+        "groq/llama-3.3-70b-versatile": (0.59, 0.79),
+        "groq/deepseek-r1-distill-llama-70b": (0.75, 0.99),
+        "openai/gpt-4o-mini": (0.15, 0.60),
+    }
+    LATENCY_EWMA_ALPHA = 0.2
+    # A tier whose validation failure rate (EWMA) for a route goes over this is skipped for that route
+    MAX_FAILURE_RATE = 0.5
+    # Every Nth call on a route ignores those estimates, so skipped tiers get fresh samples and can come back
+    PROBE_EVERY = 20
+
+class ModelRouter:
+    """Picks a model per call and keeps per-model latency and per-route failure estimates. Thread-safe."""
+
+    def __init__(self, routes: Dict[str, Route] = None, caller: ResilientCaller = None):
+        self.routes = routes or (RouterConfig.ROUTES if RouterConfig.ENABLED else RouterConfig.FIXED_ROUTES)
+        self.caller = caller or resilient_caller
+        self.latency: Dict[str, float] = {}
+        self.failure_rate: Dict[tuple, float] = {}
+        self.stats: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def choose(self, route: str, prompt_tokens: int) -> str:
+        spec = self.routes[route]
+        if prompt_tokens <= spec.max_fast_input_tokens:
+            with self._lock:
+                self._calls[route] += 1
+                if self._calls[route] % RouterConfig.PROBE_EVERY == 0 and len(spec.tiers) > 1:
+                    return spec.tiers[0]
+                for model in spec.tiers[:-1]:
+                    if not self.caller.available(model):
+                        continue
+                    if self.latency.get(model, 0.0) > spec.latency_budget_sec:
+                        continue
+                    if self.failure_rate.get((route, model), 0.0) > RouterConfig.MAX_FAILURE_RATE:
+                        continue
+                    return model
+        return spec.tiers[-1]
+
+    def record(self, route: str, model: str, seconds: float, prompt_tokens: int, completion_tokens: int, ok: bool, escalated: bool):
+        alpha = RouterConfig.LATENCY_EWMA_ALPHA
+        prompt_price, completion_price = RouterConfig.PRICES.get(model, (0.0, 0.0))
+        with self._lock:
+            self.latency[model] = seconds if model not in self.latency else (1 - alpha) * self.latency[model] + alpha * seconds
+            key = (route, model)
+            self.failure_rate[key] = (1 - alpha) * self.failure_rate.get(key, 0.0) + alpha * (0.0 if ok else 1.0)
+            stats = self.stats[key]
+            stats["calls"] += 1
+            stats["failures"] += not ok
+            stats["escalations"] += escalated
+            stats["seconds"] += seconds
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost_usd"] += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+        outcome = "escalated" if escalated else "ok" if ok else "invalid"
+        LLM_ROUTED_CALLS.labels(route, model, outcome).inc()
+        observe_stage(f"llm.{route}", seconds, model=model, outcome=outcome)
+
+    def _finish(self, route: str, model: str, started: float, prompt_tokens: int, text: Optional[str], validate, escalated: bool) -> bool:
+        ok = text is not None and validate(text)
+        self.record(route, model, time.perf_counter() - started, prompt_tokens, estimate_tokens(text or ""), ok, escalated)
+        return ok
+
+    def _keep_first(self, route: str, heavy: str, started: float, prompt_tokens: int, validate, first: Any, error: Exception) -> Any:
+        """The first model's answer, when escalating an invalid one found the heavy tier unavailable."""
+        self._finish(route, heavy, started, prompt_tokens, None, validate, True)
+        logger.warning(f"Escalation of {route} to {heavy} failed ({error}); keeping the first answer")
+        return first
+
+    def call(self, route: str, prompt: str, invoke: Callable[[str], Any], text_of: Callable[[Any], str], validate: Callable[[str], bool]) -> Any:
+        """
+        invoke(model) runs the call on a model; text_of(result) gives the text that validate() checks.
+        An answer that fails validation is retried on the route's heavy tier; if that tier is unavailable,
+        the first answer is returned as it is (the caller's own parsing decides what to do with it).
+        Raises LLMUnavailable when neither the chosen model nor its backup answers in time.
+        """
+        prompt_tokens = estimate_tokens(prompt)
+        spec = self.routes[route]
+        model, heavy = self.choose(route, prompt_tokens), spec.tiers[-1]
+        started = time.perf_counter()
+        try:
+            model, result = self.caller.call(model, invoke, spec.deadline_sec)
+        except LLMUnavailable:
+            self._finish(route, model, started, prompt_tokens, None, validate, False)
+            raise
+        if self._finish(route, model, started, prompt_tokens, text_of(result), validate, False) or model == heavy:
+            return result
+        started = time.perf_counter()
+        try:
+            escalated_model, escalated = self.caller.call(heavy, invoke, spec.deadline_sec)
+        except LLMUnavailable as e:
+            return self._keep_first(route, heavy, started, prompt_tokens, validate, result, e)
+        self._finish(route, escalated_model, started, prompt_tokens, text_of(escalated), validate, True)
+        return escalated
+
+    async def acall(self, route: str, prompt: str, invoke, text_of: Callable[[Any], str], validate: Callable[[str], bool]) -> Any:
+        """call() for an async invoke(model)."""
+        prompt_tokens = estimate_tokens(prompt)
+        spec = self.routes[route]
+        model, heavy = self.choose(route, prompt_tokens), spec.tiers[-1]
+        started = time.perf_counter()
+        try:
+            model, result = await self.caller.acall(model, invoke, spec.deadline_sec)
+        except LLMUnavailable:
+            self._finish(route, model, started, prompt_tokens, None, validate, False)
+            raise
+        if self._finish(route, model, started, prompt_tokens, text_of(result), validate, False) or model == heavy:
+            return result
+        started = time.perf_counter()
+        try:
+            escalated_model, escalated = await self.caller.acall(heavy, invoke, spec.deadline_sec)
+        except LLMUnavailable as e:
+            return self._keep_first(route, heavy, started, prompt_tokens, validate, result, e)
+        self._finish(route, escalated_model, started, prompt_tokens, text_of(escalated), validate, True)
+        return escalated
+
+    def report(self) -> List[Dict]:
+        """Calls, latency, escalations and estimated cost per (route, model)."""
+        with self._lock:
+            rows = []
+            for (route, model), stats in sorted(self.stats.items()):
+                calls = stats["calls"]
+                rows.append({
+                    "route": route, "model": model, "calls": int(calls),
+                    "failures": int(stats["failures"]), "escalations": int(stats["escalations"]),
+                    "mean_sec": round(stats["seconds"] / calls, 3),
+                    "cost_usd": round(stats["cost_usd"], 6),
+                })
+            return rows
+
+    def reset_stats(self):
+        with self._lock:
+            self.latency.clear()
+            self.failure_rate.clear()
+            self.stats.clear()
+            self._calls.clear()
+
+model_router = ModelRouter()
+
+# --- Validation ---
+
+def _json_in(text: str):
+    """The first JSON object or list in text (code fences and <think> blocks ignored), or None."""
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.S).replace("```json", "").replace("```", "")
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"[\[{]", text):
+        try:
+            return decoder.raw_decode(text, match.start())[0]
+        except ValueError:
+            continue
+    return None
+
+def _final_answer(validate_json: Callable[[Any], bool]) -> Callable[[str], bool]:
+    """ReAct steps: tool calls pass as they are, final answers must carry the task's JSON."""
+    def validate(text: str) -> bool:
+        if "Final Answer:" not in text:
+            return bool(re.search(r"Action\s*:", text))
+        return validate_json(_json_in(text.split("Final Answer:", 1)[1]))
+    return validate
+
+VALIDATORS: Dict[str, Callable[[str], bool]] = {
+    "parse": _final_answer(lambda value: isinstance(value, dict) and isinstance(value.get("emission_sources"), list)),
+    "calculate": _final_answer(lambda value: isinstance(value, dict) and "total_emissions" in value and isinstance(value.get("breakdown"), list)),
+    "suggest": _final_answer(lambda value: isinstance(value, list) and all(isinstance(item, dict) and "initiative" in item for item in value)),
+}
+
+def _non_empty(text: str) -> bool:
+    return bool(text and text.strip())
+
+# --- Adapters ---
+
+def reported_tokens(llm) -> Tuple[int, int]:
+    """(prompt, completion) tokens the provider has reported to a crewai LLM client so far."""
+    try:
+        usage = llm.get_token_usage_summary()
+        return usage.prompt_tokens, usage.completion_tokens
+    except Exception:
+        return 0, 0
+
+class RoutedCrewLLM(BaseLLM):
+    """
+    Crew agent LLM that routes each step. `factory(model)` returns the crewai LLM for a model name, one
+    client per agent, so the usage reported to it is this agent's. With an `account` (accounting.RunAccount)
+    the run's budget is checked before every provider call and the reported usage is recorded on it.
+    """
+    route: str
+    factory: Any
+    router: Any = None
+    account: Any = None
+    agent_role: str = ""
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        router = self.router or model_router
+        prompt = messages if isinstance(messages, str) else "\n".join(str(m.get("content", "")) for m in messages)
+        if self.account is not None:
+            # The agent retries a step that raised, so the budget is checked here too: an over-budget run
+            # raises again before reaching the provider instead of making more attempts
+            self.account.check_budget()
+
+        def invoke(model: str):
+            llm = self.factory(model)
+            before = reported_tokens(llm)
+            try:
+                # The agent sets its stop words ("Observation:") on this wrapper; the model doing the call needs them
+                with call_stop_override(llm, self.stop_sequences):
+                    return llm.call(messages, tools=tools, callbacks=callbacks, available_functions=available_functions, **kwargs)
+            finally:
+                if self.account is not None:
+                    after = reported_tokens(llm)
+                    self.account.record_usage(self.agent_role, after[0] - before[0], after[1] - before[1])
+        return router.call(self.route, prompt, invoke, str, VALIDATORS.get(self.route, _non_empty))
+
+    def supports_function_calling(self) -> bool:
+        return False
+
+    def supports_stop_words(self) -> bool:
+        return True
+
+    def get_context_window_size(self) -> int:
+        return self.factory((self.router or model_router).routes[self.route].tiers[-1]).get_context_window_size()
+
+def route_for(tags: Optional[List[str]], default: str) -> str:
+    """Chat route from a LangChain call's tags (main.py tags the chain's calls with 'stage:...')."""
+    for tag in tags or []:
+        if tag == "stage:query_rewrite":
+            return "chat_rewrite"
+        if tag == "stage:summary":
+            return "summary"
+    return default
+
+class RoutedChatModel(BaseChatModel):
+    """LangChain chat model that routes each call. `factory(model)` returns the chat model for a model name."""
+    factory: Any
+    default_route: str = "chat"
+    router: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed"
+
+    @staticmethod
+    def _text(result: ChatResult) -> str:
+        return result.generations[0].message.content if result.generations else ""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        route = route_for(run_manager.tags if run_manager else None, self.default_route)
+        prompt = "\n".join(str(m.content) for m in messages)
+        invoke = lambda model: self.factory(model)._generate(messages, stop=stop, **kwargs)
+        return (self.router or model_router).call(route, prompt, invoke, self._text, _non_empty)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        route = route_for(run_manager.tags if run_manager else None, self.default_route)
+        prompt = "\n".join(str(m.content) for m in messages)
+        invoke = lambda model: self.factory(model)._agenerate(messages, stop=stop, **kwargs)
+        return await (self.router or model_router).acall(route, prompt, invoke, self._text, _non_empty)
@@ -1,7 +1,13 @@
 from textwrap import dedent
 
 class CarbonTasks:
-    def parse_description(self, company_description, file_context=""):
+    def parse_description(self, company_description, file_context="", consumption=""):
+        # Appended after dedent: the records span several unindented lines
+        consumption_note = (
+            "\nConsumption records already extracted from the user's uploaded bills and fuel logs:\n"
+            f"{consumption}\n"
+            "Use these monthly figures for the matching emission sources instead of re-reading them from the file context.\n"
+        ) if consumption else ""
         return dedent(f"""
             You are given the following company description: '{company_description}'.
             Additional context from uploaded files: '{file_context}'.
@@ -19,7 +25,7 @@ class CarbonTasks:
 
             Note: You do not need to take any actions to obtain the company description; it is already provided above. Simply parse the given description into the required JSON format. Do NOT add backticks like ` to indicate that it is JSON text, only the content is necessary.
             Combine data from both sources, prioritizing the description if conflicts arise. If no file context is provided, use only the description.
-        """)
+        """) + consumption_note
 
     def calculate_emissions_description(self):
         return dedent("""\
@@ -31,8 +37,8 @@ class CarbonTasks:
             2. For each source, determine the substance (e.g., 'diesel', 'natural gas', 'coal', 'electricity', 'refrigerant R-410a').
             3. **Assess Information Need:** Do you have a reliable emission factor (kg CO2e per unit) for this specific substance readily available or from common knowledge? Is the calculation method clear?
             4. **Conditional Tool Use:** If, AND ONLY IF, you lack a specific factor or methodology necessary for the calculation:
-                a. Formulate a *targeted question* (e.g., "What is the CO2e emission factor per kg for refrigerant R-410a?", "Standard method for calculating emissions from industrial waste incineration?").
-                b. Use the 'Core Knowledge Lookup' tool with your specific question. Use it *sparingly* - only when essential information is missing.
+                a. For a missing factor, use the 'Emission Factor Lookup' tool with the substance name and unit (e.g., "R-410a | kg", "diesel | gallons"). It answers from an index of the core reference documents, so prefer it for factors.
+                b. Only if it finds nothing, or you need a methodology rather than a factor, formulate a *targeted question* (e.g., "Standard method for calculating emissions from industrial waste incineration?") and use the 'Core Knowledge Lookup' tool. Use it *sparingly* - only when essential information is missing.
                 c. **Evaluate Relevance:** Examine the tool's response. Does it directly answer your question and provide the necessary factor/method?
                 d. **Integrate or Discard:** If relevant and useful, use the information in your calculation. If the response is irrelevant, unhelpful, or nothing is found, *ignore it* and proceed. Note the source as potentially unhandled or use a documented standard assumption if appropriate. Do NOT include irrelevant retrieved text in your final output.
             5. If you have the factor (either from knowledge or the tool):
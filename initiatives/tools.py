@@ -1,13 +1,50 @@
 from crewai.tools import BaseTool #pip install crewai_tools
+from typing import Any, Optional
 import re
 from dotenv import load_dotenv
-from rag import get_retriever
+from rag import get_context_retriever
+from factors import factor_index, factor_text
+from metrics import logger
 
 load_dotenv()
 
-core_retriever = get_retriever("core_db")
+core_retriever = get_context_retriever("core_db")
 
-class CoreKnowledgeLookupTool(BaseTool):
+TOOL_BUDGET_MESSAGE = "Tool call budget for this run is used up. Continue with the information you already have."
+
+class MeteredTool(BaseTool):
+    # RunAccount of the process_summary run using this tool, if any
+    run_account: Optional[Any] = None
+    agent_role: str = ""
+
+    def _within_budget(self) -> bool:
+        if self.run_account is None:
+            return True
+        return self.run_account.record_tool_call(self.agent_role, self.name)
+
+class EmissionFactorLookupTool(MeteredTool):
+    name: str = "Emission Factor Lookup"
+    description: str = (
+        "Use this tool first to get the emission factor of a substance (e.g. 'diesel', 'natural gas', "
+        "'electricity', 'R-410A') from the core reference documents. Input should be the substance name, "
+        "optionally followed by '|' and the unit of the quantity (e.g. 'diesel | gallons'). Returns the factor "
+        "in kg per unit with its source document and year, or says that none is indexed."
+    )
+
+    def _run(self, substance: str) -> str:
+        """Looks the substance up in the precomputed emission-factor index."""
+        if not self._within_budget():
+            return TOOL_BUDGET_MESSAGE
+        name, _, unit = substance.partition("|")
+        try:
+            result = factor_index.lookup(name.strip(), unit.strip() or None)
+        except Exception as e:
+            return f"Error using EmissionFactorLookupTool for '{substance}': {str(e)}"
+        if result is None:
+            return f"No indexed emission factor for '{name.strip()}'. Try the 'Core Knowledge Lookup' tool."
+        return factor_text(result)
+
+class CoreKnowledgeLookupTool(MeteredTool):
     name: str = "Core Knowledge Lookup"
     description: str = (
         "Use this tool to look up supplementary information, definitions, context, "
@@ -18,6 +55,8 @@ class CoreKnowledgeLookupTool(BaseTool):
 
     def _run(self, query: str) -> str:
         """Queries the core vector database for general information."""
+        if not self._within_budget():
+            return TOOL_BUDGET_MESSAGE
         try:
             docs = core_retriever.get_relevant_documents(query)
             if not docs:
@@ -27,7 +66,7 @@ class CoreKnowledgeLookupTool(BaseTool):
         except Exception as e:
             return f"Error using CoreKnowledgeLookupTool for query '{query}': {str(e)}"
         
-class CustomCalculatorTool(BaseTool):
+class CustomCalculatorTool(MeteredTool):
     name: str = "Custom Calculator"
     description: str = (
         "Performs basic mathematical calculations like addition (+), subtraction (-), multiplication (*), and division (/). "
@@ -37,6 +76,8 @@ class CustomCalculatorTool(BaseTool):
 
     def _run(self, expression: str) -> str:
         """Evaluates a mathematical expression string safely."""
+        if not self._within_budget():
+            return TOOL_BUDGET_MESSAGE
         # 1. Validate input characters to allow only safe ones
         # Allows numbers, decimal points, +, -, *, /, parentheses, and spaces
         allowed_chars_pattern = r"^[0-9\.\s\+\-\*\/\(\)]+$"
@@ -65,5 +106,5 @@ class CustomCalculatorTool(BaseTool):
              return f"Error: Invalid operation or disallowed name in expression '{expression}'."
         except Exception as e:
             # Catch any other unexpected errors during evaluation
-            print(f"Unexpected calculator error for expression '{expression}': {e}") # Log it
+            logger.error(f"Unexpected calculator error for expression '{expression}': {e}")
             return f"Error: Could not evaluate expression '{expression}'. Reason: {type(e).__name__}"
@@ -1,43 +1,102 @@
-from fastapi import FastAPI, Form, UploadFile, HTTPException, Depends, Header, status
+from fastapi import FastAPI, Form, UploadFile, HTTPException, Depends, Header, Request, Response, status
+from fastapi.responses import StreamingResponse, FileResponse
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 from textwrap import dedent
 from initiatives.process import process_summary
+from initiatives.accounting import BudgetExceeded
+from initiatives.router import RoutedChatModel
+from initiatives.resilience import ResilienceConfig, LLMUnavailable
 import json
+import re
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_groq import ChatGroq
+from langchain_openai import ChatOpenAI
 from langchain.vectorstores import Chroma
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain.text_splitter import RecursiveCharacterTextSplitter 
 from langchain_core.documents import Document
 from langchain_community.document_loaders import PyPDFLoader 
 import tempfile
+from datetime import datetime, timezone
 import os
-from rag import get_retriever, get_chroma_client, get_embeddings
+import uuid
+import hashlib
+from rag import get_context_retriever, get_chroma_client, get_embeddings, chunk_id, delete_file_chunks, file_lock, user_collection_name, resolve_collection, collection_owner
+from session import ChatSessionStore
+from metrics import setup_logging, logger, stage, new_trace_id, trace_id_var, metrics_payload, StageCallbackHandler, REQUEST_SECONDS
+from db import SupabaseStore
+from ingest import ConsumptionStore, split_documents, extract_and_store
+from factors import extract_and_index, factor_index
+from admission import AdmissionConfig, RateLimiter, ConcurrencyLimiter, FairQueue, Rejected, too_many_requests
+from batch import BatchConfig, read_companies, run_batch
+from emissions import EmissionsRecorder, PERIOD_TYPES, TOTAL, source_name, timeseries
+from concurrent.futures import ThreadPoolExecutor
+from versions import VersionStore, collection_key, messages_key, make_etag, etag_matches
+from contextlib import asynccontextmanager
+from profiling import ProfilingMiddleware, ProfileStore
+from functools import lru_cache
+import time
 #pip install pypdf, supabase
-from supabase import create_client, Client, AuthApiError
+from supabase import AuthApiError
 
 load_dotenv()
+setup_logging()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-supabase_service: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-# Optional: Anon client if backend needs public API calls
-supabase_anon: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+# Async Supabase access over one pooled HTTP client, opened and closed with the app
+store = SupabaseStore()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await store.connect()
+    try:
+        yield
+    finally:
+        await store.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Every log line and stage timing for this request carries the same trace ID
+    trace_id = request.headers.get("X-Request-ID") or new_trace_id()
+    token = trace_id_var.set(trace_id)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Request-ID"] = trace_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.labels(request.method, getattr(route, "path", "unmatched"), str(status_code)).observe(elapsed)
+        logger.info("request finished", extra={"fields": {
+            "method": request.method, "path": request.url.path, "status": status_code, "duration_ms": round(elapsed * 1000, 2),
+        }})
+        trace_id_var.reset(token)
 
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 
 client = get_chroma_client()
 embeddings = get_embeddings()
-core_retriever = get_retriever("core_db")
-
-llm = ChatGroq(model="llama-3.3-70b-versatile")
+core_retriever = get_context_retriever("core_db")
+consumption_store = ConsumptionStore()
+# Counters behind the ETags of /list_files and /history
+versions = VersionStore()
+
+@lru_cache(maxsize=None)
+def chat_llm(model: str):
+    # openai/ models serve as the backup when Groq stalls (initiatives/resilience.py)
+    provider, name = model.split("/", 1) if "/" in model else ("groq", model)
+    if provider == "openai":
+        return ChatOpenAI(model=name, timeout=ResilienceConfig.CLIENT_TIMEOUT_SEC)
+    return ChatGroq(model=name, timeout=ResilienceConfig.CLIENT_TIMEOUT_SEC)
+
+# Routes each call (query rewrite, answer, history summary) to a model tier; see initiatives/router.py
+llm = RoutedChatModel(factory=lambda model: chat_llm(model))
 
 # Contextualize question prompt for history-aware retrieval
 contextualize_q_system_prompt = (
@@ -54,7 +113,8 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages(
         ("human", "{input}"),
     ]
 )
-history_aware_retriever = create_history_aware_retriever(llm, core_retriever, contextualize_q_prompt)
+# Tagged so StageCallbackHandler can tell the query rewrite and answer generation apart
+history_aware_retriever = create_history_aware_retriever(llm.with_config(tags=["stage:query_rewrite"]), core_retriever, contextualize_q_prompt)
 
 qa_system_prompt = dedent("""
     You’re a sharp assistant gathering detailed info about a company to calculate its carbon emissions. 
@@ -86,113 +146,147 @@ qa_prompt = ChatPromptTemplate.from_messages(
 )
 
 # Create chains for RAG
-question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+question_answer_chain = create_stuff_documents_chain(llm.with_config(tags=["stage:llm_generation"]), qa_prompt)
 rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
 
+# Conversation state lives server-side; clients only send the new query
+chat_sessions = ChatSessionStore(store, llm.with_config(tags=["stage:summary"]), versions)
+# Structured results of process_summary runs and their monthly/quarterly rollups
+emissions_recorder = EmissionsRecorder(store)
+
+# Admission control: per-user rate and concurrency limits, and a fair queue in front of the Crew runs
+chat_limiter = RateLimiter("chat", AdmissionConfig.CHAT_PER_MIN, AdmissionConfig.CHAT_BURST)
+upload_limiter = RateLimiter("upload", AdmissionConfig.UPLOAD_PER_MIN, AdmissionConfig.UPLOAD_BURST)
+user_concurrency = ConcurrencyLimiter(AdmissionConfig.MAX_CONCURRENT_PER_USER)
+crew_queue = FairQueue(AdmissionConfig.CREW_WORKERS, AdmissionConfig.CREW_MAX_QUEUED, AdmissionConfig.CREW_MAX_PENDING_PER_USER)
+batch_limiter = RateLimiter("batch", AdmissionConfig.BATCH_PER_MIN, AdmissionConfig.BATCH_BURST)
+# Batch runs get their own threads, so a portfolio can't take over the interactive Crew queue
+batch_executor = ThreadPoolExecutor(max_workers=BatchConfig.MAX_WORKERS, thread_name_prefix="batch")
+
 class ChatRequest(BaseModel):
     query: str
-    history: List[Dict[str, str]]
+    history: Optional[List[Dict[str, str]]] = None # Deprecated: ignored, history is kept server-side
 
 async def get_current_user(authorization: str = Header(...)) -> dict:
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, # Use status codes
-            detail="Invalid or missing Authorization header (must be 'Bearer token')",
-        )
-    token = authorization.split(" ")[1] # Extract token after "Bearer "
-    try:
-        # get_user() with the service key implicitly verifies the token.
-        response = supabase_service.auth.get_user(token)
-        user = response.user
-        if not response or not response.user:
-             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token or user not found")
-        
+    with stage("auth"):
+        if not authorization or not authorization.startswith("Bearer "):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, # Use status codes
+                detail="Invalid or missing Authorization header (must be 'Bearer token')",
+            )
+        token = authorization.split(" ")[1] # Extract token after "Bearer "
         try:
-            # Query the user_roles table using the validated user's ID
-            status_response = supabase_service.table("user_roles") \
-                .select("is_approved") \
-                .eq("user_id", str(user.id)) \
-                .single() \
-                .execute()
-
-            # Check if we got data and if the user is approved
-            is_approved = False # Default to not approved
-            if status_response.data:
-                is_approved = status_response.data.get("is_approved", False)
-
-            # If not approved, raise Forbidden error
-            if not is_approved:
+            # get_user() with the service key implicitly verifies the token.
+            user = await store.get_user(token)
+            if not user:
+                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token or user not found")
+        
+            try:
+                # Query the user_roles table using the validated user's ID
+                role_row = await store.get_role(str(user.id))
+
+                # Check if we got data and if the user is approved
+                is_approved = False # Default to not approved
+                if role_row:
+                    is_approved = role_row.get("is_approved", False)
+
+                # If not approved, raise Forbidden error
+                if not is_approved:
+                    raise HTTPException(
+                        status_code=status.HTTP_403_FORBIDDEN,
+                        detail="Account requires admin approval for access. (thru get_current_user)"
+                    )
+
+            except HTTPException as he:
+                 raise he # Re-raise the 403 if not approved
+            except Exception as db_error:
+                 # Handle errors fetching the role/status (e.g., DB connection issue)
+                logger.error(f"Error checking approval status for user {user.id}: {db_error}")
+                # Deny access if status cannot be confirmed
                 raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Account requires admin approval for access. (thru get_current_user)"
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Could not verify user approval status."
                 )
 
-        except HTTPException as he:
-             raise he # Re-raise the 403 if not approved
-        except Exception as db_error:
-             # Handle errors fetching the role/status (e.g., DB connection issue)
-            print(f"Error checking approval status for user {user.id}: {db_error}")
-            # Deny access if status cannot be confirmed
+            return user # Return the user object directly
+        except Exception as e:
+            # Log the actual error for debugging
+            logger.warning(f"Token validation error: {e}")
+            # Provide a generic error to the client
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Could not verify user approval status."
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token or authentication error"
             )
 
-        return user # Return the user object directly
-    except Exception as e:
-        # Log the actual error for debugging
-        print(f"Token validation error: {e}")
-        # Provide a generic error to the client
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token or authentication error"
-        )
+def admission(limiter: RateLimiter):
+    """Route dependency that rate limits the user and holds one of their concurrency slots for the request."""
+    async def admit(user: dict = Depends(get_current_user)):
+        user_id = str(user.id)
+        try:
+            limiter.check(user_id)
+            user_concurrency.acquire(user_id)
+        except Rejected as rejected:
+            raise too_many_requests(rejected)
+        try:
+            yield
+        finally:
+            user_concurrency.release(user_id)
+    return admit
     
 async def is_admin(user_id: str) -> bool:
     """Checks if the given user_id has the 'admin' role."""
     try:
-        # Use the service client which bypasses RLS for this check
-        response = supabase_service.table("user_roles") \
-            .select("role") \
-            .eq("user_id", user_id) \
-            .single() \
-            .execute() # Use single() because user_id is unique
-
-        # Debugging: print(f"Role check for {user_id}: {response}")
+        # Uses the service client which bypasses RLS for this check
+        role_row = await store.get_role(user_id)
 
         # Check if data exists and role is 'admin'
-        if response.data and response.data.get("role") == "admin":
+        if role_row and role_row.get("role") == "admin":
             return True
         return False
     except Exception as e:
         # Log error fetching role
-        print(f"Error checking admin role for user {user_id}: {e}")
+        logger.warning(f"Error checking admin role for user {user_id}: {e}")
         # Default to False if error occurs or user/role not found
         return False
 
-    
+
+async def profile_allowed(authorization: Optional[str]) -> bool:
+    """Whether the caller behind an Authorization header may ask for a profile with X-Profile (admins only)."""
+    if not authorization or not authorization.startswith("Bearer "):
+        return False
+    try:
+        user = await store.get_user(authorization.split(" ")[1])
+    except Exception:
+        return False
+    return bool(user) and await is_admin(str(user.id))
+
+# Opt-in sampling profiles of single requests (see profiling.py), listed under /admin/profiles
+profile_store = ProfileStore()
+app.add_middleware(ProfilingMiddleware, is_admin=profile_allowed, store=profile_store)
+
+async def require_admin(user: dict = Depends(get_current_user)):
+    if not await is_admin(str(user.id)):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Profiles are only available to admins.")
+    return user
+
 @app.post("/signup")
 async def signup(email: str = Form(...), password: str = Form(...)):
     try:
-        response = supabase_anon.auth.sign_up({"email": email, "password": password})
+        response = await store.sign_up(email, password)
         new_user_id = response.user.id
 
         try:
-            # Use the SERVICE client to insert the role
-            insert_response = supabase_service.table("user_roles").insert({
-                "user_id": new_user_id,
-                "role": "user",  # Assign the default role
-                "is_approved": False
-            }).execute()
+            # The store inserts the role with the SERVICE client
+            insert_response = await store.insert_role(new_user_id, role="user", is_approved=False)
 
             # Optional: Check for errors during role insertion
             if hasattr(insert_response, 'error') and insert_response.error:
-                print(f"Error inserting default role for {new_user_id}: {insert_response.error}")
+                logger.error(f"Error inserting default role for {new_user_id}: {insert_response.error}")
                 # Decide how to handle this: Log it? Raise an error?
                 # For now, we might let signup succeed but log the role issue.
 
         except Exception as role_insert_error:
-            print(f"Failed to insert default role for user {new_user_id}: {role_insert_error}")
+            logger.error(f"Failed to insert default role for user {new_user_id}: {role_insert_error}")
             # Log the error, but potentially allow signup to appear successful
 
         return {"status_code": 200, "user_id": response.user.id, "message": "Signup successful. Please check your email for confirmation."}
@@ -215,18 +309,14 @@ async def signup(email: str = Form(...), password: str = Form(...)):
 @app.post("/login")
 async def login(email: str = Form(...), password: str = Form(...)):
     try:
-        response = supabase_anon.auth.sign_in_with_password({"email": email, "password": password})
+        response = await store.sign_in(email, password)
         # Bit of a hack, approval doesnt usually happen in login, and sort of makes get_current_user code redundant 
         try:
-            status_response = supabase_service.table("user_roles") \
-                .select("is_approved") \
-                .eq("user_id", str(response.user.id)) \
-                .single() \
-                .execute()
+            role_row = await store.get_role(str(response.user.id))
 
             is_approved = False
-            if status_response.data:
-                is_approved = status_response.data.get("is_approved", False)
+            if role_row:
+                is_approved = role_row.get("is_approved", False)
 
             if not is_approved:
                 # Raise 403 Forbidden HERE if not approved
@@ -238,7 +328,7 @@ async def login(email: str = Form(...), password: str = Form(...)):
         except HTTPException as he:
             raise he # Re-raise 403
         except Exception as db_error:
-            print(f"Error checking approval status during login for {response.user.id}: {db_error}")
+            logger.error(f"Error checking approval status during login for {response.user.id}: {db_error}")
             raise HTTPException(status_code=500, detail="Could not verify user approval status during login.")
 
         return {
@@ -255,52 +345,72 @@ async def login(email: str = Form(...), password: str = Form(...)):
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
-@app.post("/chat")
+async def save_assistant_turn(user_id: str, answer: str):
+    version = None
+    try:
+        await store.insert_message(user_id, "assistant", answer)
+        version = versions.bump(messages_key(user_id))
+    except Exception as db_error:
+        logger.error(f"Error saving assistant message to DB: {db_error}")
+    chat_sessions.append(user_id, "assistant", answer, version)
+
+@app.post("/chat", dependencies=[Depends(admission(chat_limiter))])
 async def chat(request: ChatRequest, user: dict = Depends(get_current_user)): # user is the User object
     query = request.query
-    history = request.history
     user_id = str(user.id)
     try:
+        # Built before the new query is recorded, the prompt adds it as {input}
+        with stage("session.build_history"):
+            chat_history = await chat_sessions.build_history(user_id)
+
+        version = None
         try:
-            supabase_service.table("chat_messages").insert({
-                "user_id": user_id,
-                "role": "user",
-                "content": query
-            }).execute()
+            await store.insert_message(user_id, "user", query)
+            version = versions.bump(messages_key(user_id))
         except Exception as db_error:
-            print(f"Error saving user message to DB: {db_error}")
-            
-        # Convert history to LangChain message format
-        chat_history = []
-        for msg in history:
-            role = msg.get("role")
-            content = msg.get("content")
-            if role and content: # Basic validation
-                if role == "user":
-                    chat_history.append(HumanMessage(content=content))
-                elif role == "assistant":
-                    chat_history.append(AIMessage(content=content))
-            else:
-                print(f"Skipping invalid history message: {msg}")
-
+            logger.error(f"Error saving user message to DB: {db_error}")
+        chat_sessions.append(user_id, "user", query, version)
 
         # Invoke RAG chain
         try:
-            result = rag_chain.invoke({"input": query, "chat_history": chat_history})
+            with stage("rag_chain"):
+                result = await rag_chain.ainvoke({"input": query, "chat_history": chat_history}, config={"callbacks": [StageCallbackHandler()]})
             answer = result.get("answer", "Sorry, I couldn't generate a response.") # Provide default
+        except LLMUnavailable as rag_error:
+             logger.error(f"No LLM answered the chat turn: {rag_error}")
+             answer = "Sorry, the assistant is temporarily unavailable. Please try again in a minute."
         except Exception as rag_error:
-             print(f"Error invoking RAG chain: {rag_error}")
+             logger.error(f"Error invoking RAG chain: {rag_error}")
              answer = "Sorry, an error occurred while processing your request."
 
         if "FINAL DESCRIPTION:" in answer:
             summary = answer.split("FINAL DESCRIPTION:")[1].strip()
-            result = process_summary(summary, user.id)
+            # The user turn is already stored, so every early exit below stores the description the model
+            # produced as the assistant turn too: the history stays answered and a retry can reuse it
+            try:
+                with stage("process_summary"):
+                    # Runs on the Crew worker pool, in fair order across users
+                    result = await crew_queue.run(user_id, process_summary, summary, user.id)
+            except Rejected as rejected:
+                await save_assistant_turn(user_id, f"{answer}\n\nThe emissions assessment could not start because too many are running. Please try again shortly.")
+                raise too_many_requests(rejected)
+            except BudgetExceeded as budget_error:
+                logger.warning(f"process_summary for user {user_id} stopped: {budget_error}")
+                message = f"The emissions assessment was stopped early ({budget_error}). Please try again."
+                await save_assistant_turn(user_id, f"{answer}\n\n{message}")
+                return {"status_code": 503, "response_content": message}
             try:
                 parsed = json.loads(result[0])
                 emissions = json.loads(result[1])
                 suggestions = json.loads(result[2])
             except Exception as e:
+                logger.error(f"Could not parse process_summary output for user {user_id}: {e}")
+                await save_assistant_turn(user_id, f"{answer}\n\nThe emissions assessment returned output that could not be read. Please try again.")
                 return {"status_code": 501, "response_content": "Something is wrong with JSON loading"}
+            try:
+                await emissions_recorder.record(user_id, summary, parsed, emissions, suggestions)
+            except Exception as record_error:
+                logger.error(f"Error saving emissions run for user {user_id}: {record_error}")
 
             answer = (
                 "Here’s your company’s carbon footprint breakdown:\n\n"
@@ -315,24 +425,16 @@ async def chat(request: ChatRequest, user: dict = Depends(get_current_user)): #
                            for s in suggestions])
             )
 
-        try:
-            supabase_service.table("chat_messages").insert({
-                "user_id": user_id,
-                "role": "assistant",
-                "content": answer
-            }).execute()
-        except Exception as db_error:
-            print(f"Error saving assistant message to DB: {db_error}")
-
+        await save_assistant_turn(user_id, answer)
         return {"status_code": 200, "response_content": answer}
     except HTTPException as he: # Re-raise HTTP exceptions from Depends
         raise he
     except Exception as e:
-        print(f"Error in /chat endpoint: {e}") 
+        logger.exception(f"Error in /chat endpoint: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@app.post("/update_vector")
+@app.post("/update_vector", dependencies=[Depends(admission(upload_limiter))])
 async def update_vector(file: UploadFile = None, is_core: str = Form("false"), user: dict = Depends(get_current_user)):
     user_id = str(user.id)
 
@@ -353,19 +455,23 @@ async def update_vector(file: UploadFile = None, is_core: str = Form("false"), u
 
         file_content = await file.read()
         filename = file.filename
-        collection_name = "core_db" if is_core.lower() == "true" else f"user_{user_id}"
-        print(f"Authenticated user {user_id} storing in collection: {collection_name}")
+        core = is_core.lower() == "true"
+        collection_name = "core_db" if core else user_collection_name(user_id)
+        # Core files are replaced by filename alone, user files by (user, filename)
+        owner = None if core else user_id
+        logger.info(f"Authenticated user {user_id} storing in collection: {collection_name}")
 
         if filename.lower().endswith(".pdf"):
             with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
                 tmp.write(file_content)
                 tmp_path = tmp.name
             try:
-                loader = PyPDFLoader(tmp_path)
-                docs = loader.load()  # Returns a list of Document objects, one per page
+                with stage("pdf_parse", filename=filename):
+                    loader = PyPDFLoader(tmp_path)
+                    docs = loader.load()  # Returns a list of Document objects, one per page
                 for doc in docs:
                     doc.metadata.update({"filename": filename, "user_id": user_id})
-                print(f"Loaded {len(docs)} pages from {filename}")
+                logger.info(f"Loaded {len(docs)} pages from {filename}")
             finally:
                 os.unlink(tmp_path)  
         else:
@@ -374,70 +480,264 @@ async def update_vector(file: UploadFile = None, is_core: str = Form("false"), u
             docs = [Document(page_content=file_text, metadata={"filename": filename, "user_id": user_id})]
             for doc in docs:
                     doc.metadata.update({"filename": filename, "user_id": user_id})
-            print(f"Loaded text file {filename} with {len(file_text)} characters")
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-        chunked_docs = text_splitter.split_documents(docs)
-        print(f"Split into {len(chunked_docs)} chunks")
-        for i, doc in enumerate(chunked_docs):
-            print(f"Chunk {i+1}: {len(doc.page_content)} characters")
-        db = Chroma(client=client, collection_name=collection_name, embedding_function=embeddings)
-        batch_size = 50 
-        for i in range(0, len(chunked_docs), batch_size):
-            batch = chunked_docs[i:i + batch_size]
-            print(f"Adding batch {i // batch_size + 1} ({len(batch)} chunks)...")
-            db.add_documents(batch)
-            print(f"Batch {i // batch_size + 1} added")
-
-        print(f"Finished adding all {len(chunked_docs)} chunks")
-
-        return {"status_code": 200, "response_content": f"Added {filename} ({len(chunked_docs)} chunks) to {'core ' if is_core.lower() == 'true' else ''}datastore"}
+            logger.info(f"Loaded text file {filename} with {len(file_text)} characters")
+
+        with stage("chunking", filename=filename):
+            # Keeps bill and fuel log tables whole instead of cutting them every 1000 characters
+            chunked_docs = split_documents(docs)
+        logger.info(f"Split into {len(chunked_docs)} chunks")
+        # Embedding and the Chroma write are done separately (rather than db.add_documents) so each can be timed
+        collection = client.get_or_create_collection(name=collection_name, embedding_function=None)
+        # Re-uploading a filename replaces it: chunk IDs are stable per (filename, index), so the new
+        # chunks overwrite the old ones in place, and whatever the new upload didn't write is deleted after.
+        # Uploads of one filename take turns, and each only removes chunks of uploads older than itself,
+        # so an upload racing in another worker process (which the lock can't see) never deletes a newer one
+        with file_lock(collection_name, filename, owner):
+            upload_id = uuid.uuid4().hex
+            uploaded_at = datetime.now(timezone.utc).isoformat()
+            batch_size = 50 
+            for i in range(0, len(chunked_docs), batch_size):
+                batch = chunked_docs[i:i + batch_size]
+                with stage("embedding", chunks=len(batch)):
+                    vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+                with stage("chroma_write", chunks=len(batch)):
+                    collection.upsert(
+                        ids=[chunk_id(filename, i + j, owner) for j in range(len(batch))],
+                        embeddings=vectors,
+                        documents=[doc.page_content for doc in batch],
+                        metadatas=[{**doc.metadata, "upload_id": upload_id, "uploaded_at": uploaded_at, "chunk_index": i + j} for j, doc in enumerate(batch)],
+                    )
+            with stage("chroma_delete", filename=filename):
+                replaced = delete_file_chunks(collection, filename, keep_upload_id=upload_id, user_id=owner, uploaded_before=uploaded_at)
+        versions.bump(collection_key("core_db" if core else f"user_{user_id}"))
+
+        logger.info(f"Finished adding all {len(chunked_docs)} chunks, removed {replaced} stale chunks of {filename}")
+
+        if core:
+            # Emission factors stated in reference documents are indexed so the emissions stage can look them up by name
+            with stage("factor_extraction", filename=filename):
+                factor_count = extract_and_index(factor_index, filename, docs)
+            return {"status_code": 200, "response_content": f"Added {filename} ({len(chunked_docs)} chunks, {factor_count} emission factors) to core datastore"}
+
+        # Consumption rows are extracted once here so emissions runs can read them directly
+        with stage("extraction", filename=filename):
+            row_count = extract_and_store(consumption_store, user_id, filename, docs, hashlib.sha256(file_content).hexdigest())
+        return {"status_code": 200, "response_content": f"Added {filename} ({len(chunked_docs)} chunks, {row_count} consumption records) to datastore"}
     except UnicodeDecodeError:
-        print("error 1")
+        logger.warning(f"Upload of {file.filename} is not valid UTF-8")
         raise HTTPException(status_code=400, detail="File must be a valid UTF-8 text file")
         
     except Exception as e:
-        print(f"error {str(e)}")
+        logger.exception(f"File upload error: {e}")
         raise HTTPException(status_code=500, detail=f"File upload error: {str(e)}")
 
+@app.post("/batch_assess")
+async def batch_assess(file: UploadFile, workers: int = Form(BatchConfig.WORKERS), user_context: str = Form("false"),
+                       user: dict = Depends(get_current_user)):
+    """
+    Assesses a portfolio of companies (CSV or JSONL, see batch.py). The caller's files and consumption
+    records are only used as context with user_context=true. Streams one JSON line per company as runs
+    finish, then a summary line.
+    """
+    user_id = str(user.id)
+    # The size multipart parsing recorded is checked first, and the read stops one byte past the cap either way
+    too_large = HTTPException(status_code=413, detail=f"Portfolio files are limited to {BatchConfig.MAX_BYTES} bytes")
+    if file.size is not None and file.size > BatchConfig.MAX_BYTES:
+        raise too_large
+    content = await file.read(BatchConfig.MAX_BYTES + 1)
+    if len(content) > BatchConfig.MAX_BYTES:
+        raise too_large
+    try:
+        companies = read_companies(content.decode("utf-8"), file.filename or "")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read portfolio: {e}")
+    if not companies:
+        raise HTTPException(status_code=400, detail="Portfolio is empty")
+    if len(companies) > BatchConfig.MAX_COMPANIES:
+        raise HTTPException(status_code=413, detail=f"At most {BatchConfig.MAX_COMPANIES} companies per batch")
+
+    try:
+        batch_limiter.check(user_id)
+        user_concurrency.check(user_id)
+    except Rejected as rejected:
+        raise too_many_requests(rejected)
+    logger.info(f"User {user_id} started a batch of {len(companies)} companies with {workers} workers")
+
+    async def stream():
+        # The slot is held for as long as the stream runs. Taken here rather than in the handler, so a client
+        # that disconnects before the body is sent (and the generator never starts) doesn't leak it.
+        try:
+            user_concurrency.acquire(user_id)
+        except Rejected as rejected:
+            yield json.dumps({"status": "error", "error": rejected.reason}) + "\n"
+            return
+        try:
+            async for line in run_batch(companies, user_id, process_summary, batch_executor, workers, user_context.lower() == "true"):
+                yield json.dumps(line) + "\n"
+        finally:
+            user_concurrency.release(user_id)
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.delete("/delete_file", dependencies=[Depends(admission(upload_limiter))])
+async def delete_file(filename: str, is_core: str = "false", user: dict = Depends(get_current_user)):
+    """Removes a file's chunks and what was extracted from it (consumption records, or emission factors for core files)."""
+    user_id = str(user.id)
+    core = is_core.lower() == "true"
+    if core and not await is_admin(user_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Deleting from the core knowledge base requires admin privileges."
+        )
+
+    collection_name = "core_db" if core else user_collection_name(user_id)
+    try:
+        with stage("chroma_delete", filename=filename):
+            collection = client.get_or_create_collection(name=collection_name, embedding_function=None)
+            with file_lock(collection_name, filename, None if core else user_id):
+                removed = delete_file_chunks(collection, filename, user_id=None if core else user_id)
+        if removed:
+            versions.bump(collection_key("core_db" if core else f"user_{user_id}"))
+        if core:
+            factor_index.delete_source(filename)
+        else:
+            consumption_store.delete_file(user_id, filename)
+    except Exception as e:
+        logger.exception(f"File delete error: {e}")
+        raise HTTPException(status_code=500, detail=f"File delete error: {str(e)}")
+
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"{filename} not found in {'core ' if core else ''}datastore")
+    logger.info(f"User {user_id} deleted {filename} ({removed} chunks) from {collection_name}")
+    return {"status_code": 200, "response_content": f"Deleted {filename} ({removed} chunks) from {'core ' if core else ''}datastore"}
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 for a request whose If-None-Match already names etag, else None."""
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return None
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache" # Clients may keep it, but must revalidate
+
 @app.get("/list_files")
-def list_files(collection_name: str):
+def list_files(collection_name: str, request: Request, response: Response, user: dict = Depends(get_current_user)):
+    """Filenames in 'core_db' or in the caller's own 'user_{user_id}' collection."""
     try:
-        db = Chroma(client=client, collection_name=collection_name)
-        results = db.get()
-        print(f"Collection {collection_name} has {len(results['documents'])} chunks")
+        owner = collection_owner(collection_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if owner is not None and owner != str(user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can only list your own files.")
+    try:
+        # 'user_{id}' may live in a shared collection, depending on RAGConfig.COLLECTION_LAYOUT
+        physical_name, where = resolve_collection(collection_name)
+        # Read before the data, so a write racing this request can only make the next ETag differ.
+        # The chunk count also catches the offline tools (compact, migrate_layout, snapshot), which don't bump versions.
+        version = versions.get(collection_key(collection_name))
+        count = client.get_or_create_collection(name=physical_name, embedding_function=None).count()
+        etag = make_etag(versions.epoch, collection_name, version, count)
+        if cached := not_modified(request, etag):
+            return cached
+        with stage("chroma_read", collection=physical_name):
+            db = Chroma(client=client, collection_name=physical_name)
+            results = db.get(where=where, include=["metadatas"])
+        logger.info(f"Collection {collection_name} has {len(results['ids'])} chunks")
         filenames = set(meta["filename"] for meta in results["metadatas"] if "filename" in meta)
-        print(f"Found filenames: {filenames}")
-        return {"status_code": 200, "response_content": list(filenames)}
+        set_etag(response, etag)
+        return {"status_code": 200, "response_content": sorted(filenames)}
     except Exception as e:
         return {"status_code": 500, "response_content": f"Error: {str(e)}"}
     
 @app.get("/history")
-async def get_history(user: dict = Depends(get_current_user)): # user is now the User object from Supabase
+async def get_history(request: Request, response: Response, user: dict = Depends(get_current_user)): # user is now the User object from Supabase
+    user_id = str(user.id)
     try:
-        messages = supabase_service.table("chat_messages").select("role, content").eq("user_id", str(user.id)).order("created_at").execute()
-
-        # Check for PostgREST errors explicitly if possible 
-        if hasattr(messages, 'error') and messages.error:
-             print(f"Supabase error fetching history: {messages.error}")
-             raise HTTPException(status_code=500, detail="Database error fetching history")
+        etag = make_etag(versions.epoch, user_id, versions.get(messages_key(user_id)))
+        if cached := not_modified(request, etag):
+            return cached
+        messages = await store.fetch_messages(user_id)
+        set_etag(response, etag)
 
         return {
             "status_code": 200,
-            "response_content": messages.data # Directly return the list of dicts
+            "response_content": messages # Directly return the list of dicts
         }
     except HTTPException as he: # Re-raise HTTP exceptions
         raise he
     except Exception as e:
-        print(f"Error fetching history: {e}") # Log the error
+        logger.error(f"Error fetching history: {e}")
         # Avoid returning the raw exception string to the client
         return {"status_code": 500, "response_content": "Internal server error fetching history"}
     
 @app.get("/my_role")
-async def get_my_role(user: dict = Depends(get_current_user)):
+async def get_my_role(request: Request, response: Response, user: dict = Depends(get_current_user)):
     """Fetches the role for the currently authenticated user."""
     user_id = str(user.id)
     is_user_admin = await is_admin(user_id) # Reuse the helper function
     role = "admin" if is_user_admin else "user" # Determine role (can be more complex if >2 roles)
+    # Roles are changed in Supabase directly, so there's no version to go by: the ETag only saves the body
+    etag = make_etag(user_id, role)
+    if cached := not_modified(request, etag):
+        return cached
+    set_etag(response, etag)
     return {"status_code": 200, "role": role}
 
+@app.get("/emissions/timeseries")
+async def get_emissions_timeseries(period: str = "month", since: Optional[str] = None, source: Optional[str] = None,
+                                   user: dict = Depends(get_current_user)):
+    """
+    The user's emissions per month or quarter from the precomputed rollups (see emissions.py).
+    since: first period to include ('2025-01' or '2025-Q1'); source: only this emission source (plus the total).
+    """
+    if period not in PERIOD_TYPES:
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(PERIOD_TYPES)}")
+    if since and not re.fullmatch(r"\d{4}-\d{2}" if period == "month" else r"\d{4}-Q[1-4]", since):
+        raise HTTPException(status_code=400, detail=f"since must look like {'2025-01' if period == 'month' else '2025-Q1'}")
+    try:
+        rows = await store.fetch_rollups(str(user.id), period, since=since, sources=[source_name(source), TOTAL] if source else None)
+    except Exception as e:
+        logger.error(f"Error fetching emissions rollups: {e}")
+        return {"status_code": 500, "response_content": "Internal server error fetching emissions"}
+    return {"status_code": 200, "response_content": {"period_type": period, "unit": "kg CO2e", "series": timeseries(rows)}}
+
+@app.get("/emission_factors")
+async def get_emission_factors(substance: Optional[str] = None, unit: Optional[str] = None, user: dict = Depends(get_current_user)):
+    """
+    The emission factor for a substance from the core documents (see factors.py), matched by name with
+    aliases and typos tolerated; unit picks among factors given per different units. No substance lists what is indexed.
+    """
+    if not substance:
+        return {"status_code": 200, "response_content": {"substances": factor_index.substances()}}
+    result = factor_index.lookup(substance, unit)
+    if result is None:
+        return {"status_code": 404, "response_content": f"No emission factor found for '{substance}'"}
+    return {"status_code": 200, "response_content": result}
+
+@app.get("/admin/profiles")
+async def list_profiles(user: dict = Depends(require_admin)):
+    """Stored request profiles, newest first."""
+    return {"status_code": 200, "response_content": profile_store.list()}
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, user: dict = Depends(require_admin)):
+    """One profile: the request, its stage breakdown and the frames with the most samples."""
+    try:
+        return {"status_code": 200, "response_content": profile_store.get(profile_id)}
+    except (KeyError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+@app.get("/admin/profiles/{profile_id}/folded")
+async def download_profile(profile_id: str, user: dict = Depends(require_admin)):
+    """Collapsed stacks of a profile, for flamegraph.pl, speedscope or inferno."""
+    try:
+        path = profile_store.folded_path(profile_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus scrape endpoint for the per-stage latency histograms."""
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,148 @@
+from contextlib import contextmanager
+from typing import Any, Dict
+from uuid import UUID, uuid4
+import contextvars
+import json
+import logging
+import re
+import sys
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Trace ID of the request being handled; copied into threadpool workers and asyncio tasks automatically
+trace_id_var: contextvars.ContextVar = contextvars.ContextVar("trace_id", default=None)
+# List that stage() and observe_stage() append to while a request is being profiled (see profiling.py)
+stage_recorder_var: contextvars.ContextVar = contextvars.ContextVar("stage_recorder", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram("carbonx_stage_seconds", "Time spent in each request stage", ["stage"], buckets=LATENCY_BUCKETS)
+STAGE_ERRORS = Counter("carbonx_stage_errors_total", "Stages that raised an exception", ["stage"])
+REQUEST_SECONDS = Histogram("carbonx_request_seconds", "End-to-end HTTP request time", ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+ADMISSION_REJECTIONS = Counter("carbonx_admission_rejections_total", "Requests answered with 429, by reason", ["reason"])
+CREW_QUEUE_DEPTH = Gauge("carbonx_crew_queue_depth", "process_summary runs waiting for a worker")
+LLM_ROUTED_CALLS = Counter("carbonx_llm_routed_calls_total", "LLM calls by route, model and outcome (ok, invalid, escalated)", ["route", "model", "outcome"])
+LLM_RESILIENCE_EVENTS = Counter("carbonx_llm_resilience_events_total", "LLM call timeouts, errors, short circuits (open breaker), fallbacks, hedges and hedge wins, by model", ["model", "event"])
+CONTEXT_TOKENS = Histogram("carbonx_context_tokens", "Estimated tokens of retrieved context per query, before (raw) and after compression", ["phase"], buckets=(50, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000))
+
+logger = logging.getLogger("carbonx")
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, tagged with the current trace ID. Pass structured fields as extra={"fields": {...}}."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "trace_id": trace_id_var.get(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def setup_logging(level: int = logging.INFO):
+    """Routes the 'carbonx' loggers to stderr as JSON lines. Safe to call more than once."""
+    if any(isinstance(h.formatter, JsonFormatter) for h in logger.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+def new_trace_id() -> str:
+    return uuid4().hex
+
+@contextmanager
+def stage(name: str, **fields):
+    """Times a block into carbonx_stage_seconds{stage=name} and logs its duration."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        logger.info("stage finished", extra={"fields": {"stage": name, "duration_ms": round(elapsed * 1000, 2), **fields}})
+        _record_stage(name, started, elapsed, fields)
+
+def observe_stage(name: str, elapsed: float, **fields):
+    """Records a stage timed elsewhere (e.g. from a callback)."""
+    STAGE_SECONDS.labels(name).observe(elapsed)
+    logger.info("stage finished", extra={"fields": {"stage": name, "duration_ms": round(elapsed * 1000, 2), **fields}})
+    _record_stage(name, time.perf_counter() - elapsed, elapsed, fields)
+
+def _record_stage(name: str, started: float, elapsed: float, fields: Dict):
+    recorder = stage_recorder_var.get()
+    if recorder is not None:
+        recorder.append({"stage": name, "started": started, "duration_ms": round(elapsed * 1000, 2), **fields})
+
+def metrics_payload():
+    """Returns (body, content type) for the /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def stage_label(text: str) -> str:
+    """'Operations Analyst' -> 'operations_analyst'."""
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+class StageCallbackHandler(BaseCallbackHandler):
+    """
+    Times LangChain runs as stages. Retriever runs are recorded as 'retrieval'; chat model runs
+    are recorded under the stage named by a 'stage:<name>' tag (see main.py's llm.with_config).
+    """
+    def __init__(self):
+        self._started: Dict[UUID, tuple] = {}
+
+    def _start(self, run_id: UUID, name: str):
+        self._started[run_id] = (name, time.perf_counter())
+
+    def _finish(self, run_id: UUID, error: bool = False):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        name, began = started
+        if error:
+            STAGE_ERRORS.labels(name).inc()
+        observe_stage(name, time.perf_counter() - began)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, tags=None, **kwargs: Any):
+        for tag in tags or []:
+            if tag.startswith("stage:"):
+                self._start(run_id, tag[len("stage:"):])
+                return
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, error=True)
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, error=True)
+
+class CrewTaskTimer:
+    """
+    Crew task_callback that records each task as a 'crew.task.<agent role>' stage.
+    Tasks run sequentially, so a task's duration is the time since the previous one finished.
+    """
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+
+    def __call__(self, task_output):
+        now = time.perf_counter()
+        name = f"crew.task.{stage_label(str(getattr(task_output, 'agent', 'unknown')))}"
+        self.durations[name] = now - self.last
+        observe_stage(name, now - self.last)
+        self.last = now
@@ -0,0 +1,136 @@
+"""
+Moves user documents between the two Chroma layouts (see RAGConfig.COLLECTION_LAYOUT):
+per-user 'user_{user_id}' collections and shared 'user_shard_NNN' collections filtered by user_id.
+Vectors are copied as they are, so nothing is re-embedded. Sources are kept unless --delete-source
+is given, and only deleted once each of their chunks is found in the target under its user_id.
+Run it while the API is stopped, then restart the API with the new COLLECTION_LAYOUT.
+
+    python migrate_layout.py --to sharded --shards 16 --dry-run
+    python migrate_layout.py --to sharded --delete-source
+    python migrate_layout.py --to per_user
+"""
+from collections import defaultdict
+from typing import Dict, List, Tuple
+import argparse
+import time
+from rag import RAGConfig, SHARD_PREFIX, get_chroma_client, chunk_id, iter_chunks, shard_collection_name
+from metrics import logger
+
+FIELDS = ["embeddings", "documents", "metadatas"]
+BATCH_SIZE = 1000
+
+def collection_names(client) -> List[str]:
+    return [c.name if hasattr(c, "name") else c for c in client.list_collections()]
+
+def target_id(old_id: str, meta: dict, user_id: str) -> str:
+    """IDs must be unique across every user in a shared collection, so they're re-derived per user."""
+    if "filename" in meta and "chunk_index" in meta:
+        return chunk_id(meta["filename"], meta["chunk_index"], user_id)
+    return f"{user_id}-{old_id}"
+
+def write(client, name: str, rows: List[tuple]):
+    collection = client.get_or_create_collection(name=name, embedding_function=None)
+    for i in range(0, len(rows), BATCH_SIZE):
+        batch = rows[i:i + BATCH_SIZE]
+        collection.upsert(
+            ids=[r[0] for r in batch],
+            embeddings=[r[1] for r in batch],
+            documents=[r[2] for r in batch],
+            metadatas=[r[3] for r in batch],
+        )
+
+def source_names(client, layout: str) -> List[str]:
+    """The collections a migration to layout copies from: user_{id} ones to shard, user_shard_NNN ones to split."""
+    if layout == "sharded":
+        return [n for n in collection_names(client) if n.startswith("user_") and not n.startswith(SHARD_PREFIX)]
+    return [n for n in collection_names(client) if n.startswith(SHARD_PREFIX)]
+
+def planned_chunks(client, name: str, layout: str, shards: int, include: List[str]):
+    """
+    Yields (target collection, target id, user_id, {field: value}) for every chunk of source collection name,
+    a page at a time. The target is None for a shard chunk without a user_id, which can't be placed.
+    """
+    for old_id, *values in iter_chunks(client.get_collection(name=name), include):
+        fields = dict(zip(include, values))
+        meta = dict(fields.get("metadatas") or {})
+        if layout == "sharded":
+            user_id = name[len("user_"):]
+            meta["user_id"] = user_id # Older uploads may predate the user_id metadata
+            target, new_id = shard_collection_name(user_id, shards), target_id(old_id, meta, user_id)
+        else:
+            user_id = meta.get("user_id")
+            target, new_id = (f"user_{user_id}" if user_id else None), old_id
+        fields["metadatas"] = meta
+        yield target, new_id, user_id, fields
+
+def copy_collection(client, name: str, layout: str, shards: int, dry_run: bool) -> int:
+    """Copies one source collection into its targets, BATCH_SIZE chunks at a time. Returns chunks copied."""
+    copied = 0
+    pending: Dict[str, List[tuple]] = defaultdict(list)
+    for target, new_id, _, fields in planned_chunks(client, name, layout, shards, FIELDS):
+        if target is None:
+            logger.warning(f"Skipping chunk {new_id} in {name} without a user_id")
+            continue
+        copied += 1
+        if dry_run:
+            continue
+        pending[target].append((new_id, fields["embeddings"], fields["documents"], fields["metadatas"]))
+        if len(pending[target]) >= BATCH_SIZE:
+            write(client, target, pending.pop(target))
+    for target, rows in pending.items():
+        write(client, target, rows)
+    return copied
+
+def missing_chunks(client, name: str, layout: str, shards: int) -> int:
+    """
+    Chunks of source collection name that its targets don't hold under the chunk's own id and user_id, so
+    other users' data and chunks that were already there can't make up for a partial copy. Chunks that
+    couldn't be placed count as missing.
+    """
+    missing = 0
+    expected: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+
+    def check(target: str, user_id: str) -> int:
+        ids = set(expected.pop((target, user_id)))
+        found = client.get_collection(name=target).get(ids=list(ids), where={"user_id": user_id}, include=[])["ids"]
+        return len(ids - set(found))
+
+    for target, new_id, user_id, _ in planned_chunks(client, name, layout, shards, ["metadatas"]):
+        if target is None:
+            missing += 1
+            continue
+        expected[(target, user_id)].append(new_id)
+        if len(expected[(target, user_id)]) >= BATCH_SIZE:
+            missing += check(target, user_id)
+    for target, user_id in list(expected):
+        missing += check(target, user_id)
+    return missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate user documents between the per-user and sharded Chroma layouts.")
+    parser.add_argument("--to", choices=["sharded", "per_user"], required=True)
+    parser.add_argument("--shards", type=int, default=RAGConfig.USER_SHARDS)
+    parser.add_argument("--db-path", default=RAGConfig.DB_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be copied")
+    parser.add_argument("--delete-source", action="store_true", help="Delete the old collections after a verified copy")
+    args = parser.parse_args()
+
+    RAGConfig.DB_PATH = args.db_path
+    client = get_chroma_client()
+    started = time.perf_counter()
+    copied = {name: copy_collection(client, name, args.to, args.shards, args.dry_run) for name in source_names(client, args.to)}
+    total = sum(copied.values())
+    print(f"{'Would copy' if args.dry_run else 'Copied'} {total} chunks from {len(copied)} collections in {time.perf_counter() - started:.1f}s")
+
+    if args.delete_source and not args.dry_run:
+        # Each source is only deleted once every one of its chunks is found in its target
+        missing = {name: missing_chunks(client, name, args.to, args.shards) for name in copied}
+        for name, count in missing.items():
+            if not count:
+                client.delete_collection(name=name)
+        print(f"Deleted {sum(not count for count in missing.values())} source collections")
+        incomplete = {name: count for name, count in missing.items() if count}
+        if incomplete:
+            raise SystemExit("Kept source collections with chunks missing from their targets: "
+                             + ", ".join(f"{name} ({count})" for name, count in sorted(incomplete.items())))
+    print(f"Set COLLECTION_LAYOUT={args.to}" + (f" and USER_SHARDS={args.shards}" if args.to == "sharded" else "") + " before restarting the API.")
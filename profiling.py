@@ -0,0 +1,229 @@
+"""
+Opt-in request profiling. A profiled request runs under a sampling profiler (a thread that snapshots every
+thread's Python stack each ProfilingConfig.INTERVAL_SEC) and records every stage() it goes through, so a
+slow /chat or /update_vector can be split into PDF parsing, chunking, embedding, Chroma and LLM time.
+
+A request is profiled when an admin sends `X-Profile: 1`, or at random at ProfilingConfig.SAMPLE_RATE for
+ProfilingConfig.PATHS. Each profile is stored in ProfilingConfig.DIR as {id}.json (request, stages,
+hottest frames) and {id}.folded (collapsed stacks, one 'thread;outer;...;inner count' line per stack,
+readable by flamegraph.pl, speedscope and inferno). Stacks come from all threads, so a profile taken
+while other requests run includes their work too; the stage breakdown is the request's alone.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from metrics import logger, stage_recorder_var
+
+class ProfilingConfig:
+    DIR = os.getenv("PROFILE_DIR", "./profiles")
+    HEADER = b"x-profile"
+    # Share of requests to PATHS profiled without the header
+    SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PATHS = tuple(os.getenv("PROFILE_PATHS", "/chat,/update_vector").split(","))
+    INTERVAL_SEC = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+    MAX_PROFILES = int(os.getenv("PROFILE_MAX_STORED", "200"))
+    TOP_FRAMES = 25
+
+# Leaf frames of threads that are waiting for work rather than doing any
+IDLE_LEAVES = {"select", "poll", "wait", "_wait_for_tstate_lock", "accept", "_worker", "serve_forever", "run_until_complete"}
+
+def is_idle(frame) -> bool:
+    code = frame.f_code
+    # uvloop runs the loop in C, so an idle uvloop thread's innermost Python frame is asyncio.run's
+    return code.co_name in IDLE_LEAVES or (code.co_name == "run" and code.co_filename.endswith("runners.py"))
+
+PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """Counts folded stacks of all threads (except its own) until stopped."""
+
+    def __init__(self, interval_sec: float = None):
+        self.interval_sec = interval_sec or ProfilingConfig.INTERVAL_SEC
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_sec):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or is_idle(frame):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_frames(self, limit: int = None) -> List[Dict]:
+        """Frames by samples in which they were the innermost frame (self time)."""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [
+            {"frame": frame, "samples": count, "sec": round(count * self.interval_sec, 4)}
+            for frame, count in leaves.most_common(limit or ProfilingConfig.TOP_FRAMES)
+        ]
+
+class ProfileStore:
+    """Profiles as files in one directory, keeping the newest MAX_PROFILES."""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or ProfilingConfig.DIR
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        if not PROFILE_ID.match(profile_id):
+            raise KeyError(profile_id)
+        return os.path.join(self.directory, f"{profile_id}.{suffix}")
+
+    def save(self, profile: Dict, folded: str):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(profile["id"], "folded"), "w", encoding="utf-8") as f:
+            f.write(folded)
+        with open(self._path(profile["id"], "json"), "w", encoding="utf-8") as f:
+            json.dump(profile, f)
+        self.prune()
+
+    def prune(self):
+        profiles = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")), key=lambda entry: entry.stat().st_mtime)
+        for entry in profiles[:max(0, len(profiles) - ProfilingConfig.MAX_PROFILES)]:
+            for suffix in ("json", "folded"):
+                try:
+                    os.unlink(self._path(entry.name[:-len(".json")], suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict]:
+        """Summaries of stored profiles, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        summaries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    profile = json.load(f)
+            except (OSError, ValueError):
+                continue
+            summaries.append({key: profile.get(key) for key in ("id", "method", "path", "status", "duration_ms", "started_at", "trace_id", "reason", "samples")})
+        return sorted(summaries, key=lambda summary: summary["started_at"] or "", reverse=True)
+
+    def get(self, profile_id: str) -> Dict:
+        with open(self._path(profile_id, "json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def folded_path(self, profile_id: str) -> str:
+        path = self._path(profile_id, "folded")
+        if not os.path.exists(path):
+            raise KeyError(profile_id)
+        return path
+
+def stage_breakdown(stages: List[Dict], duration_ms: float) -> List[Dict]:
+    """Recorded stages in start order, with their share of the request's wall-clock time."""
+    return [
+        {**entry, "share": round(entry["duration_ms"] / duration_ms, 3) if duration_ms else None}
+        for entry in sorted(stages, key=lambda entry: entry["start_ms"])
+    ]
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles requests asking for it. Plain ASGI rather than @app.middleware, so a
+    request that isn't profiled pays for one header scan and nothing else.
+    `is_admin(authorization)` decides whether the caller may ask for a profile with the header.
+    """
+
+    def __init__(self, app, is_admin: Callable[[Optional[str]], Awaitable[bool]], store: ProfileStore = None):
+        self.app = app
+        self.is_admin = is_admin
+        self.store = store or ProfileStore()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        reason = None
+        for name, value in scope["headers"]:
+            if name == ProfilingConfig.HEADER and value not in (b"", b"0", b"false"):
+                reason = "header"
+                break
+        if reason is None and ProfilingConfig.SAMPLE_RATE and scope["path"] in ProfilingConfig.PATHS and random.random() < ProfilingConfig.SAMPLE_RATE:
+            reason = "sampled"
+        if reason is None:
+            return await self.app(scope, receive, send)
+        if reason == "header":
+            authorization = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"authorization"), None)
+            if not await self.is_admin(authorization):
+                return await self.app(scope, receive, send)
+        await self._profile(scope, receive, send, reason)
+
+    async def _profile(self, scope, receive, send, reason: str):
+        profile_id = uuid.uuid4().hex
+        response = {"status": 500, "trace_id": None}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                headers = dict(message.get("headers") or [])
+                response["trace_id"] = headers.get(b"x-request-id", b"").decode("latin-1") or None
+                message["headers"] = list(message.get("headers") or []) + [(b"x-profile-id", profile_id.encode("ascii"))]
+            await send(message)
+
+        stages: List[Dict] = []
+        token = stage_recorder_var.set(stages)
+        started_at = datetime.now(timezone.utc).isoformat()
+        started = time.perf_counter()
+        sampler = StackSampler().start()
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            sampler.stop()
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            stage_recorder_var.reset(token)
+            for entry in stages:
+                entry["start_ms"] = round((entry.pop("started") - started) * 1000, 2)
+            profile = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": response["status"],
+                "trace_id": response["trace_id"],
+                "reason": reason,
+                "started_at": started_at,
+                "duration_ms": duration_ms,
+                "interval_ms": sampler.interval_sec * 1000,
+                "samples": sampler.samples,
+                "stages": stage_breakdown(stages, duration_ms),
+                "top_frames": sampler.top_frames(),
+            }
+            try:
+                self.store.save(profile, sampler.folded())
+                logger.info(f"Stored profile {profile_id} of {scope['method']} {scope['path']} ({duration_ms} ms, {sampler.samples} samples)")
+            except OSError as e:
+                logger.error(f"Could not store profile {profile_id}: {e}")
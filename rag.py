@@ -1,24 +1,126 @@
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import os
+import threading
 from chromadb import PersistentClient
 from langchain.vectorstores import Chroma
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain_core.vectorstores import VectorStoreRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from compression import CompressionConfig, ContextCompressor
+from metrics import logger
 
 class RAGConfig:
     DB_PATH = "./chroma_db"
     EMBEDDING_MODEL = "all-mpnet-base-v2"
     K = 3
+    # 'per_user': one user_{user_id} collection per user. 'sharded': user documents are spread over
+    # USER_SHARDS user_shard_NNN collections and queries filter on the user_id metadata.
+    COLLECTION_LAYOUT = os.getenv("COLLECTION_LAYOUT", "per_user")
+    USER_SHARDS = int(os.getenv("USER_SHARDS", "16"))
+    # User retrievers kept by get_user_retriever; they all share one embedding model
+    RETRIEVER_CACHE_SIZE = int(os.getenv("RETRIEVER_CACHE_SIZE", "256"))
+
+SHARD_PREFIX = "user_shard_"
 
 def get_chroma_client():
     return PersistentClient(path=RAGConfig.DB_PATH)
 
+@lru_cache(maxsize=None)
 def get_embeddings():
+    # Loading the model takes seconds and a few hundred MB, so every retriever shares one instance
     return HuggingFaceEmbeddings(model_name=RAGConfig.EMBEDDING_MODEL)
 
-def get_retriever(collection: str) -> VectorStoreRetriever:
+def shard_collection_name(user_id: str, shards: int = None) -> str:
+    shard = int(hashlib.sha1(user_id.encode("utf-8")).hexdigest(), 16) % (shards or RAGConfig.USER_SHARDS)
+    return f"{SHARD_PREFIX}{shard:03d}"
+
+def user_collection_name(user_id: str) -> str:
+    """The collection holding a user's documents under the configured layout."""
+    if RAGConfig.COLLECTION_LAYOUT == "sharded":
+        return shard_collection_name(user_id)
+    return f"user_{user_id}"
+
+def user_filter(user_id: str) -> Optional[dict]:
+    """Metadata filter that scopes queries on user_collection_name(user_id) to the user (None if it's theirs alone)."""
+    return {"user_id": user_id} if RAGConfig.COLLECTION_LAYOUT == "sharded" else None
+
+def collection_owner(name: str) -> Optional[str]:
+    """The user_id of a logical 'user_{user_id}' collection name, None for 'core_db'. Raises ValueError for anything else."""
+    if name == "core_db":
+        return None
+    # Shard names are physical: a shard holds many users' documents, and reading one unfiltered would show them all
+    if name.startswith("user_") and not name.startswith(SHARD_PREFIX) and len(name) > len("user_"):
+        return name[len("user_"):]
+    raise ValueError(f"Unknown collection '{name}': expected 'core_db' or 'user_{{user_id}}'")
+
+def resolve_collection(name: str) -> Tuple[str, Optional[dict]]:
+    """
+    Maps a logical collection name ('core_db', 'user_{user_id}') to its physical collection and filter.
+    Raises ValueError for other names, including the physical user_shard_NNN ones.
+    """
+    user_id = collection_owner(name)
+    if user_id is None:
+        return name, None
+    return user_collection_name(user_id), user_filter(user_id)
+
+@lru_cache(maxsize=RAGConfig.RETRIEVER_CACHE_SIZE)
+def get_user_retriever(user_id: str) -> BaseRetriever:
+    """Cached: process_summary runs for the same user (a batch, say) reuse one retriever."""
+    return get_context_retriever(user_collection_name(user_id), user_filter(user_id))
+
+@lru_cache(maxsize=None)
+def get_compressor() -> ContextCompressor:
+    # Shared so every retriever uses one query embedding cache
+    return ContextCompressor(embeddings=get_embeddings())
+
+class ContextRetriever(BaseRetriever):
+    """
+    Fetches `fetch_k` chunks from a Chroma collection together with their stored embeddings and compresses
+    them (compression.ContextCompressor), so the query is embedded once and the chunks not at all.
+    """
+    collection: Any
+    compressor: ContextCompressor
+    filter: Optional[dict] = None
+    fetch_k: int = CompressionConfig.FETCH_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_vector = self.compressor.embed_query(query)
+        result = self.collection.query(
+            query_embeddings=[query_vector.tolist()], n_results=self.fetch_k, where=self.filter,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        documents = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(result["documents"][0], result["metadatas"][0])
+        ]
+        return self.compressor.compress(documents, result["embeddings"][0], query_vector)
+
+def get_context_retriever(collection: str, filter: Optional[dict] = None) -> BaseRetriever:
+    """
+    Retriever for context that goes into prompts: CompressionConfig.FETCH_K candidates compressed to the
+    context token budget (see compression.py), or plain get_retriever when CONTEXT_COMPRESSION is off.
+    """
+    if not CompressionConfig.ENABLED:
+        return get_retriever(collection, filter)
+    try:
+        chroma_collection = get_chroma_client().get_or_create_collection(name=collection, embedding_function=None)
+        return ContextRetriever(collection=chroma_collection, compressor=get_compressor(), filter=filter)
+    except Exception as e:
+        logger.error(f"Error creating context retriever for collection '{collection}': {e}")
+        raise
+
+def get_retriever(collection: str, filter: Optional[dict] = None, k: int = None) -> VectorStoreRetriever:
     """
  Creates and returns a LangChain retriever for the specified ChromaDB collection.
     Args:
         collection: Name of the collection (e.g., 'core_db', 'user_{user_id}').
+        filter: Optional metadata filter applied to every search (e.g., {'user_id': ...} for a shared collection).
+        k: Number of documents returned per query (default RAGConfig.K).
     Returns:
         A configured VectorStoreRetriever instance for the collection.
     Raises:
@@ -28,9 +130,78 @@ def get_retriever(collection: str) -> VectorStoreRetriever:
         client = get_chroma_client()
         embeddings = get_embeddings()
         db = Chroma(client=client, collection_name=collection, embedding_function=embeddings)
-        return db.as_retriever(search_type="similarity", search_kwargs={"k": RAGConfig.K})
+        search_kwargs = {"k": k or RAGConfig.K}
+        if filter:
+            search_kwargs["filter"] = filter
+        return db.as_retriever(search_type="similarity", search_kwargs=search_kwargs)
     
     except Exception as e:
-        print(f"Error creating retriever for collection '{collection}': {e}")
+        logger.error(f"Error creating retriever for collection '{collection}': {e}")
         raise
-        
\ No newline at end of file
+        
+
+def chunk_id(filename: str, index: int, user_id: str = None) -> str:
+    """
+    Stable Chroma ID for chunk `index` of a file, so re-uploads overwrite their own chunks.
+    User files are scoped by user_id so that users sharing a collection can't collide.
+    """
+    key = f"{user_id}/{filename}" if user_id else filename
+    return f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}-{index}"
+
+def file_filter(filename: str, user_id: str = None) -> dict:
+    return {"$and": [{"filename": filename}, {"user_id": user_id}]} if user_id else {"filename": filename}
+
+_file_locks: Dict[tuple, list] = {}
+_file_locks_guard = threading.Lock()
+
+@contextmanager
+def file_lock(collection: str, filename: str, user_id: str = None):
+    """
+    Serializes writes to one file's chunks within this process (an upload's upsert and cleanup, a delete),
+    so two uploads of the same filename can't each delete the chunks the other just wrote.
+    """
+    key = (collection, user_id, filename)
+    with _file_locks_guard:
+        entry = _file_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _file_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _file_locks[key]
+
+def file_chunk_ids(collection, filename: str, exclude_upload_id: str = None, user_id: str = None, uploaded_before: str = None) -> List[str]:
+    """
+    IDs of the file's chunks in the collection, optionally leaving out those written by one upload and
+    those of uploads made at or after uploaded_before (an ISO timestamp; untimestamped chunks count as older).
+    """
+    existing = collection.get(where=file_filter(filename, user_id), include=["metadatas"])
+    return [
+        chunk for chunk, meta in zip(existing["ids"], existing["metadatas"])
+        if (exclude_upload_id is None or (meta or {}).get("upload_id") != exclude_upload_id)
+        and (uploaded_before is None or (meta or {}).get("uploaded_at", "") < uploaded_before)
+    ]
+
+def delete_file_chunks(collection, filename: str, keep_upload_id: str = None, user_id: str = None, uploaded_before: str = None) -> int:
+    """
+    Deletes a file's chunks from the collection and returns how many were removed.
+    With keep_upload_id, only chunks left over from other uploads (including pre-stable-ID ones) are removed;
+    with uploaded_before as well, only those of uploads older than it, so a newer upload is never cut short.
+    """
+    stale = file_chunk_ids(collection, filename, exclude_upload_id=keep_upload_id, user_id=user_id, uploaded_before=uploaded_before)
+    if stale:
+        collection.delete(ids=stale)
+    return len(stale)
+
+def iter_chunks(collection, include: List[str], page_size: int = 5000):
+    """Yields a tuple of (id, *included fields) for every chunk in the collection, a page at a time."""
+    offset = 0
+    while True:
+        page = collection.get(include=include, limit=page_size, offset=offset)
+        if not len(page["ids"]):
+            return
+        yield from zip(page["ids"], *(page[field] for field in include))
+        offset += len(page["ids"])
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from textwrap import dedent
+from typing import Dict, List, Optional
+import os
+import threading
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from metrics import logger, stage
+from versions import messages_key
+
+class SessionConfig:
+    HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+    # After folding old turns into the summary, keep the window at this share of the budget
+    # so the next few turns don't each trigger another summarization call.
+    WINDOW_REFILL_RATIO = 0.5
+    MAX_CACHED_SESSIONS = int(os.getenv("MAX_CACHED_SESSIONS", "1000"))
+    CHARS_PER_TOKEN = 4
+
+summary_prompt = dedent("""
+    You maintain a running summary of an interview that collects data to calculate a company's carbon emissions.
+    Merge the existing summary with the new conversation turns into one updated summary.
+    You MUST preserve:
+    1. What the company does.
+    2. Every emission source mentioned, with every number and unit exactly as the user gave them (e.g. '200 gallons per truck monthly').
+    3. Which sources still lack numbers and whether the user said there are no other sources.
+    Drop greetings and small talk. Do NOT invent sources or numbers. Answer with the summary only.
+
+    Existing summary:
+    {summary}
+
+    New conversation turns:
+    {turns}
+""")
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for budgeting prompts."""
+    return max(1, len(text) // SessionConfig.CHARS_PER_TOKEN)
+
+def to_langchain_message(role: str, content: str) -> BaseMessage:
+    if role == "user":
+        return HumanMessage(content=content)
+    return AIMessage(content=content)
+
+class ChatSessionStore:
+    """
+    Keeps each user's conversation server-side so clients only send the new query.
+    Messages are loaded once from `chat_messages` through the SupabaseStore and then kept in a bounded in-process cache.
+    The history handed to the prompts is a window of the most recent turns that fits
+    SessionConfig.HISTORY_TOKEN_BUDGET, preceded by a rolling summary of everything older.
+    Summaries are persisted to the `chat_summaries` table (user_id, summary, summarized_count).
+    With a VersionStore, a cached session is reloaded once its messages counter shows a write this process
+    didn't make (another worker's turn), so several workers on one host can serve the same user.
+    Without one, the cache assumes a single worker.
+    """
+
+    def __init__(self, store, llm, versions=None):
+        self.store = store
+        self.llm = llm
+        self.versions = versions
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _version(self, user_id: str) -> Optional[int]:
+        return self.versions.get(messages_key(user_id)) if self.versions is not None else None
+
+    async def _load(self, user_id: str) -> Dict:
+        version = self._version(user_id)
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None and session["version"] == version:
+                self._sessions.move_to_end(user_id)
+                return session
+
+        # Read before the messages, so a write racing the load leaves the session marked stale
+        session = {"messages": [], "summary": "", "summarized_count": 0, "version": version}
+        try:
+            messages = await self.store.fetch_messages(user_id)
+            session["messages"] = [m for m in messages if m.get("role") and m.get("content")]
+        except Exception as db_error:
+            logger.error(f"Error loading chat session for user {user_id}: {db_error}")
+        try:
+            stored = await self.store.fetch_summary(user_id)
+            if stored:
+                session["summary"] = stored.get("summary") or ""
+                session["summarized_count"] = min(stored.get("summarized_count") or 0, len(session["messages"]))
+        except Exception as db_error:
+            logger.error(f"Error loading chat summary for user {user_id}: {db_error}")
+
+        with self._lock:
+            self._sessions[user_id] = session
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > SessionConfig.MAX_CACHED_SESSIONS:
+                self._sessions.popitem(last=False)
+        return session
+
+    def append(self, user_id: str, role: str, content: str, version: int = None):
+        """
+        Records a message in the cached session. The caller persists it to chat_messages and passes the
+        messages counter its write bumped to, if it did.
+        """
+        with self._lock:
+            session = self._sessions.get(user_id)
+            # Sessions that aren't cached are reloaded from chat_messages, which already has the message
+            if session is None:
+                return
+            if version is not None and session["version"] is not None:
+                if version != session["version"] + 1:
+                    # Someone else wrote in between: reload on the next turn rather than miss their messages
+                    del self._sessions[user_id]
+                    return
+                session["version"] = version
+            session["messages"].append({"role": role, "content": content})
+
+    async def _summarize(self, summary: str, turns: List[Dict]) -> str:
+        formatted = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+        response = await self.llm.ainvoke(summary_prompt.format(summary=summary or "(none yet)", turns=formatted))
+        return getattr(response, "content", str(response)).strip()
+
+    async def _persist_summary(self, user_id: str, session: Dict):
+        try:
+            await self.store.upsert_summary(user_id, session["summary"], session["summarized_count"])
+        except Exception as db_error:
+            logger.error(f"Error saving chat summary for user {user_id}: {db_error}")
+
+    async def build_history(self, user_id: str) -> List[BaseMessage]:
+        """
+        Returns the chat history to feed the prompts for the user's next turn.
+        Older turns that no longer fit the token budget are folded into the rolling summary.
+        """
+        session = await self._load(user_id)
+        messages = session["messages"]
+        pending = messages[session["summarized_count"]:]
+        budget = SessionConfig.HISTORY_TOKEN_BUDGET
+
+        if sum(estimate_tokens(m["content"]) for m in pending) > budget:
+            # Keep the newest turns that fit the refill target, fold the rest into the summary.
+            target = int(budget * SessionConfig.WINDOW_REFILL_RATIO)
+            kept_tokens = 0
+            keep_from = len(messages)
+            while keep_from > session["summarized_count"]:
+                tokens = estimate_tokens(messages[keep_from - 1]["content"])
+                if kept_tokens + tokens > target:
+                    break
+                kept_tokens += tokens
+                keep_from -= 1
+            try:
+                with stage("session.summarize"):
+                    session["summary"] = await self._summarize(session["summary"], messages[session["summarized_count"]:keep_from])
+                session["summarized_count"] = keep_from
+                await self._persist_summary(user_id, session)
+            except Exception as llm_error:
+                # Without a fresh summary, fall back to the plain window; older turns are dropped for this call only.
+                logger.error(f"Error summarizing chat history for user {user_id}: {llm_error}")
+            pending = messages[keep_from:]
+
+        chat_history = []
+        if session["summary"]:
+            chat_history.append(SystemMessage(content=f"Summary of the earlier conversation:\n{session['summary']}"))
+        chat_history.extend(to_langchain_message(m["role"], m["content"]) for m in pending)
+        return chat_history
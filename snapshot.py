@@ -0,0 +1,155 @@
+"""
+Snapshots of Chroma collections that can be restored without re-embedding anything.
+A snapshot directory holds, per collection:
+  chunks.parquet   id, document and metadata (JSON) of every chunk, in embedding order
+  embeddings.npy   an (n, dim) float32 or float16 array, loadable with np.load(mmap_mode="r")
+  manifest.json    collection name and metadata, count, dim, dtype and the embedding model
+
+    python snapshot.py export core_db --out snapshots/2025-06-01
+    python snapshot.py export --all --out snapshots/full --dtype float16
+    python snapshot.py import snapshots/2025-06-01 --replace
+"""
+from datetime import datetime, timezone
+from typing import Dict, List
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from rag import RAGConfig, get_chroma_client, iter_chunks
+from metrics import logger
+
+FORMAT_VERSION = 1
+PAGE_SIZE = 5000
+SCHEMA = pa.schema([("id", pa.string()), ("document", pa.string()), ("metadata", pa.string())])
+
+def changed_during_export(name: str, read: int, count: int) -> RuntimeError:
+    return RuntimeError(f"{name} changed during export ({read} chunks read, {count} expected); stop writers and retry")
+
+def export_collection(client, name: str, out_dir: str, dtype: str = "float32") -> Dict:
+    """Writes one collection's snapshot to out_dir/name and returns its manifest."""
+    collection = client.get_collection(name=name)
+    count = collection.count()
+    target = os.path.join(out_dir, name)
+    os.makedirs(target, exist_ok=True)
+
+    embeddings = None
+    written = 0
+    with pq.ParquetWriter(os.path.join(target, "chunks.parquet"), SCHEMA, compression="zstd") as writer:
+        page = []
+        for chunk, embedding, document, meta in iter_chunks(collection, ["embeddings", "documents", "metadatas"], PAGE_SIZE):
+            if embeddings is None:
+                # Sized from the count up front so rows can be written as they're read
+                embeddings = np.lib.format.open_memmap(os.path.join(target, "embeddings.npy"), mode="w+", dtype=dtype, shape=(count, len(embedding)))
+            if written == count:
+                # Grew since count() was taken: the array has no row for this chunk
+                raise changed_during_export(name, written + 1, count)
+            embeddings[written] = embedding
+            written += 1
+            page.append((chunk, document, json.dumps(meta or {})))
+            if len(page) == PAGE_SIZE:
+                writer.write_table(pa.table(list(zip(*page)), schema=SCHEMA))
+                page = []
+        if page:
+            writer.write_table(pa.table(list(zip(*page)), schema=SCHEMA))
+    if written != count:
+        raise changed_during_export(name, written, count)
+
+    dim = embeddings.shape[1] if embeddings is not None else 0
+    if embeddings is not None:
+        embeddings.flush()
+        del embeddings
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "collection": name,
+        "collection_metadata": collection.metadata,
+        "count": count,
+        "dim": dim,
+        "dtype": dtype,
+        "embedding_model": RAGConfig.EMBEDDING_MODEL,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(target, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def import_collection(client, snapshot_dir: str, name: str = None, replace: bool = False, batch_size: int = None) -> Dict:
+    """Loads one collection snapshot into Chroma in bulk. Returns the manifest."""
+    with open(os.path.join(snapshot_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest['format_version']}")
+    if manifest["embedding_model"] != RAGConfig.EMBEDDING_MODEL:
+        raise ValueError(f"Snapshot was embedded with {manifest['embedding_model']}, this node uses {RAGConfig.EMBEDDING_MODEL}")
+
+    name = name or manifest["collection"]
+    if replace and name in [c.name if hasattr(c, "name") else c for c in client.list_collections()]:
+        client.delete_collection(name=name)
+    collection = client.get_or_create_collection(name=name, metadata=manifest["collection_metadata"], embedding_function=None)
+    if not manifest["count"]:
+        return manifest
+
+    embeddings = np.load(os.path.join(snapshot_dir, "embeddings.npy"), mmap_mode="r")
+    batch_size = batch_size or min(PAGE_SIZE, client.get_max_batch_size())
+    offset = 0
+    for batch in pq.ParquetFile(os.path.join(snapshot_dir, "chunks.parquet")).iter_batches(batch_size=batch_size):
+        rows = batch.to_pydict()
+        end = offset + len(rows["id"])
+        collection.upsert(
+            ids=rows["id"],
+            embeddings=np.asarray(embeddings[offset:end], dtype=np.float32),
+            documents=rows["document"],
+            metadatas=[json.loads(meta) or None for meta in rows["metadata"]],
+        )
+        offset = end
+    if offset != manifest["count"]:
+        raise RuntimeError(f"Snapshot of {name} is incomplete: {offset} of {manifest['count']} chunks")
+    return manifest
+
+def snapshot_collections(snapshot_root: str) -> List[str]:
+    return sorted(d for d in os.listdir(snapshot_root) if os.path.exists(os.path.join(snapshot_root, d, "manifest.json")))
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and import Chroma collections without re-embedding.")
+    parser.add_argument("--db-path", default=RAGConfig.DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("collections", nargs="*")
+    export_parser.add_argument("--all", action="store_true", help="Export every collection")
+    export_parser.add_argument("--out", required=True)
+    export_parser.add_argument("--dtype", choices=["float32", "float16"], default="float32",
+                               help="float16 halves the snapshot; similarity scores shift by ~1e-3")
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("snapshot")
+    import_parser.add_argument("--collection", action="append", help="Only import these (repeatable; default: all)")
+    import_parser.add_argument("--replace", action="store_true", help="Drop existing collections first instead of upserting into them")
+    args = parser.parse_args()
+
+    RAGConfig.DB_PATH = args.db_path
+    client = get_chroma_client()
+    if args.command == "export":
+        names = [c.name if hasattr(c, "name") else c for c in client.list_collections()] if args.all else args.collections
+        if not names:
+            parser.error("name the collections to export, or pass --all")
+        for name in names:
+            started = time.perf_counter()
+            manifest = export_collection(client, name, args.out, args.dtype)
+            elapsed = time.perf_counter() - started
+            size = directory_size(os.path.join(args.out, name))
+            print(f"Exported {name}: {manifest['count']} chunks, {size / 1e6:.1f} MB in {elapsed:.1f}s "
+                  f"({manifest['count'] / max(elapsed, 1e-9):,.0f} chunks/s)")
+    else:
+        for name in args.collection or snapshot_collections(args.snapshot):
+            path = os.path.join(args.snapshot, name)
+            started = time.perf_counter()
+            manifest = import_collection(client, path, replace=args.replace)
+            elapsed = time.perf_counter() - started
+            size = directory_size(path)
+            print(f"Imported {name}: {manifest['count']} chunks in {elapsed:.1f}s "
+                  f"({manifest['count'] / max(elapsed, 1e-9):,.0f} chunks/s, {size / 1e6 / max(elapsed, 1e-9):.1f} MB/s)")
+            logger.info(f"Imported snapshot of {name}", extra={"fields": {"chunks": manifest["count"], "seconds": round(elapsed, 2)}})
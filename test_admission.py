@@ -0,0 +1,127 @@
+"""
+Admission control (admission.py): per-user token buckets and concurrency slots, and the weighted fair queue in
+front of the Crew workers, which orders runs by virtual finish time rather than arrival.
+
+    python -m unittest test_admission
+"""
+import asyncio
+import threading
+import unittest
+from unittest import mock
+from admission import ConcurrencyLimiter, FairQueue, RateLimiter, Rejected
+
+class QueueRun:
+    """Queues runs on a one-worker FairQueue while a first run holds the worker, then records the order they ran in."""
+
+    def __init__(self, queue: FairQueue):
+        self.queue = queue
+        self.order = []
+        self.release = threading.Event()
+
+    def hold(self):
+        self.release.wait(5)
+
+    def record(self, name: str):
+        self.order.append(name)
+
+    async def run(self, runs):
+        """runs: [(user_id, name, weight)], queued in this order behind the held worker."""
+        tasks = [asyncio.create_task(self.queue.run("holder", self.hold))]
+        await asyncio.sleep(0)
+        for user_id, name, weight in runs:
+            tasks.append(asyncio.create_task(self.queue.run(user_id, self.record, name, weight=weight)))
+            await asyncio.sleep(0)
+        self.release.set()
+        await asyncio.gather(*tasks)
+        return self.order
+
+class FairQueueTest(unittest.TestCase):
+    def queue(self, **limits) -> FairQueue:
+        limits = {"max_queued": 0, "max_pending_per_user": 0, **limits}
+        queue = FairQueue(1, limits["max_queued"], limits["max_pending_per_user"])
+        self.addCleanup(queue.executor.shutdown)
+        return queue
+
+    def test_a_users_backlog_only_delays_their_own_runs(self):
+        runs = [("a", "a1", 1), ("a", "a2", 1), ("a", "a3", 1), ("b", "b1", 1)]
+        self.assertEqual(asyncio.run(QueueRun(self.queue()).run(runs)), ["a1", "b1", "a2", "a3"])
+
+    def test_weight_sets_the_share_of_turns(self):
+        runs = [("a", f"a{i}", 2) for i in range(1, 5)] + [("b", "b1", 1), ("b", "b2", 1)]
+        self.assertEqual(asyncio.run(QueueRun(self.queue()).run(runs)), ["a1", "a2", "b1", "a3", "a4", "b2"])
+
+    def test_limits_reject_with_retry_after(self):
+        async def scenario():
+            queue = self.queue(max_queued=1, max_pending_per_user=1)
+            holder = QueueRun(queue)
+            held = asyncio.create_task(queue.run("holder", holder.hold))
+            await asyncio.sleep(0)
+            waiting = asyncio.create_task(queue.run("a", holder.record, "a1"))
+            await asyncio.sleep(0)
+            rejections = []
+            for user_id in ("a", "b"):
+                try:
+                    await queue.run(user_id, holder.record, "late")
+                except Rejected as rejected:
+                    rejections.append((rejected.reason, rejected.retry_after))
+            holder.release.set()
+            await asyncio.gather(held, waiting)
+            return rejections, holder.order
+
+        rejections, order = asyncio.run(scenario())
+        self.assertIn("already in progress", rejections[0][0])
+        self.assertIn("queue is full", rejections[1][0])
+        self.assertTrue(all(retry_after >= 1 for _, retry_after in rejections))
+        self.assertEqual(order, ["a1"])
+
+    def test_cancelled_run_leaves_the_queue(self):
+        async def scenario():
+            queue = self.queue(max_pending_per_user=1)
+            holder = QueueRun(queue)
+            held = asyncio.create_task(queue.run("holder", holder.hold))
+            await asyncio.sleep(0)
+            waiting = asyncio.create_task(queue.run("a", holder.record, "cancelled"))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            queued_after_cancel = queue.queued
+            retry = asyncio.create_task(queue.run("a", holder.record, "retried")) # Not rejected as already pending
+            await asyncio.sleep(0)
+            holder.release.set()
+            await asyncio.gather(held, retry)
+            return queued_after_cancel, holder.order
+
+        queued, order = asyncio.run(scenario())
+        self.assertEqual(queued, 0)
+        self.assertEqual(order, ["retried"])
+
+class LimiterTest(unittest.TestCase):
+    def test_rate_limiter_allows_the_burst_then_rejects(self):
+        limiter = RateLimiter("chat", per_min=60, burst=2)
+        with mock.patch("admission.time.monotonic", return_value=100.0):
+            limiter.check("u1")
+            limiter.check("u1")
+            with self.assertRaises(Rejected) as caught:
+                limiter.check("u1")
+            limiter.check("u2") # Buckets are per user
+        self.assertEqual(caught.exception.retry_after, 1)
+        with mock.patch("admission.time.monotonic", return_value=101.0):
+            limiter.check("u1") # One token back after a second at 60 per minute
+
+    def test_zero_rate_disables_the_limit(self):
+        limiter = RateLimiter("chat", per_min=0, burst=0)
+        for _ in range(100):
+            limiter.check("u1")
+
+    def test_concurrency_slots(self):
+        limiter = ConcurrencyLimiter(2)
+        limiter.acquire("u1")
+        limiter.acquire("u1")
+        with self.assertRaises(Rejected):
+            limiter.check("u1")
+        limiter.check("u2")
+        limiter.release("u1")
+        limiter.acquire("u1")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Offline compaction (compact.py): chunks the latest upload of their file didn't write are removed, files from
+before upload tags lose only exact duplicates, and files of different users in a shard are kept apart.
+
+    python -m unittest test_compact
+"""
+import unittest
+import uuid
+import chromadb
+from compact import compact, orphaned_ids
+
+def add(collection, ids, documents, metas):
+    collection.add(ids=ids, embeddings=[[float(i), 1.0] for i in range(len(ids))], documents=documents, metadatas=metas)
+
+class CompactTest(unittest.TestCase):
+    def setUp(self):
+        self.client = chromadb.EphemeralClient()
+
+    def collection(self, prefix: str = "user_"):
+        return self.client.get_or_create_collection(f"{prefix}{uuid.uuid4().hex[:12]}", embedding_function=None)
+
+    def test_chunks_of_earlier_uploads_are_orphans(self):
+        collection = self.collection()
+        add(collection, ["old-0", "old-1", "old-2"], ["a", "b", "c"],
+            [{"filename": "bill.pdf", "upload_id": "u1", "uploaded_at": "2025-01-01T00:00:00"}] * 3)
+        add(collection, ["new-0", "new-1"], ["a", "b"],
+            [{"filename": "bill.pdf", "upload_id": "u2", "uploaded_at": "2025-02-01T00:00:00"}] * 2)
+        add(collection, ["other-0"], ["x"], [{"filename": "log.csv", "upload_id": "u0", "uploaded_at": "2024-12-01T00:00:00"}])
+        self.assertEqual(sorted(orphaned_ids(collection)), ["old-0", "old-1", "old-2"])
+
+    def test_untagged_files_lose_only_exact_duplicates(self):
+        collection = self.collection()
+        add(collection, ["c0", "c1", "c2", "c3"], ["same", "same", "other", "same"], [{"filename": "notes.txt"}] * 4)
+        self.assertEqual(sorted(orphaned_ids(collection)), ["c1", "c3"])
+
+    def test_shard_keeps_each_users_file_of_the_same_name(self):
+        collection = self.collection("user_shard_")
+        add(collection, ["a-0", "b-0"], ["a", "b"], [
+            {"filename": "bill.pdf", "user_id": "a", "upload_id": "u1", "uploaded_at": "2025-01-01T00:00:00"},
+            {"filename": "bill.pdf", "user_id": "b", "upload_id": "u2", "uploaded_at": "2025-02-01T00:00:00"},
+        ])
+        self.assertEqual(orphaned_ids(collection), [])
+
+    def test_compact_removes_orphans_and_reports(self):
+        collection = self.collection()
+        add(collection, ["old-0", "new-0"], ["a", "a"], [
+            {"filename": "bill.pdf", "upload_id": "u1", "uploaded_at": "2025-01-01T00:00:00"},
+            {"filename": "bill.pdf", "upload_id": "u2", "uploaded_at": "2025-02-01T00:00:00"},
+        ])
+        dry = compact(self.client, [collection.name], dry_run=True)
+        self.assertEqual(dry, [{"collection": collection.name, "chunks_before": 2, "orphans": 1, "chunks_after": 1}])
+        self.assertEqual(collection.count(), 2)
+        compact(self.client, [collection.name])
+        self.assertEqual(collection.get()["ids"], ["new-0"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+"""
+Context compression (compression.py): duplicates are dropped, the kept context fits the token budget, and the
+raw and compressed token counts are observed on every call, including ones that keep nothing.
+
+    python -m unittest test_compression
+"""
+import unittest
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from compression import ContextCompressor
+from prometheus_client import REGISTRY
+
+def observations(phase: str) -> float:
+    return REGISTRY.get_sample_value("carbonx_context_tokens_count", {"phase": phase}) or 0.0
+
+class CompressorTest(unittest.TestCase):
+    def setUp(self):
+        self.compressor = ContextCompressor(embeddings=DeterministicFakeEmbedding(size=8), token_budget=50, min_similarity=-1.0)
+        self.query = np.ones(8, dtype=np.float32)
+
+    def test_duplicates_dropped_and_budget_kept(self):
+        documents = [Document(page_content="diesel " * 30), Document(page_content="diesel " * 30), Document(page_content="electricity " * 40)]
+        vectors = [[1.0] * 8, [1.0] * 8, [0.5, 1.0] * 4]
+        kept = self.compressor.compress(documents, vectors, self.query)
+        self.assertLessEqual(sum(len(document.page_content) // 4 for document in kept), 50)
+        self.assertEqual(sum(document.page_content.startswith("diesel") for document in kept), 1)
+
+    def test_every_call_is_observed(self):
+        before = observations("raw"), observations("compressed")
+        self.assertEqual(self.compressor.compress([], [], self.query), [])
+        self.compressor.compress([Document(page_content="short")], [[1.0] * 8], self.query)
+        after = observations("raw"), observations("compressed")
+        self.assertEqual((after[0] - before[0], after[1] - before[1]), (2, 2))
+
+if __name__ == "__main__":
+    unittest.main()
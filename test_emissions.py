@@ -0,0 +1,90 @@
+"""
+Emissions rollups (emissions.py): a month holds the latest run's figures, a quarter the sum of its months, sources
+a run no longer reports are dropped, and source names differing only in case or spacing are one series.
+
+    python -m unittest test_emissions
+"""
+import asyncio
+import unittest
+from datetime import datetime, timezone
+from emissions import TOTAL, EmissionsRecorder, quarter_months, quarter_of, source_totals, timeseries, to_number
+
+class RollupStore:
+    """The emission_runs and emission_rollups methods of db.SupabaseStore, in memory."""
+
+    def __init__(self):
+        self.runs = []
+        self.rollups = {}
+
+    async def insert_emission_run(self, run):
+        self.runs.append(run)
+
+    async def fetch_rollups(self, user_id, period_type, periods=None, since=None, sources=None):
+        rows = [dict(row) for (user, kind, period, source), row in self.rollups.items()
+                if user == user_id and kind == period_type and (not periods or period in periods)
+                and (not since or period >= since) and (not sources or source in sources)]
+        return sorted(rows, key=lambda row: row["period"])
+
+    async def upsert_rollups(self, rows):
+        for row in rows:
+            self.rollups[(row["user_id"], row["period_type"], row["period"], row["source"])] = row
+
+    async def delete_rollups(self, user_id, period_type, period, sources):
+        for source in sources:
+            self.rollups.pop((user_id, period_type, period, source), None)
+
+def breakdown(**sources):
+    return {"breakdown": [{"source": name.replace("_", " "), "emissions": kg} for name, kg in sources.items()], "total_emissions": sum(sources.values())}
+
+def day(month: int, day: int = 15) -> datetime:
+    return datetime(2025, month, day, tzinfo=timezone.utc)
+
+class EmissionsTest(unittest.TestCase):
+    def setUp(self):
+        self.store = RollupStore()
+        self.recorder = EmissionsRecorder(self.store)
+
+    def record(self, emissions, at):
+        asyncio.run(self.recorder.record("u1", "summary", {"company_type": "logistics"}, emissions, [], at=at))
+
+    def rollup(self, period_type, period):
+        rows = asyncio.run(self.store.fetch_rollups("u1", period_type, [period]))
+        return {row["source"]: (row["emissions_kg"], row["runs"]) for row in rows}
+
+    def test_month_keeps_the_latest_run(self):
+        self.record(breakdown(diesel=1000, electricity=200), day(4, 2))
+        self.record(breakdown(diesel=900, electricity=250), day(4, 20))
+        self.assertEqual(self.rollup("month", "2025-04"), {"diesel": (900, 2), "electricity": (250, 2), TOTAL: (1150, 2)})
+        self.assertEqual(len(self.store.runs), 2)
+
+    def test_quarter_sums_its_months(self):
+        self.record(breakdown(diesel=1000), day(4))
+        self.record(breakdown(diesel=800, electricity=100), day(5))
+        self.record(breakdown(diesel=500), day(7)) # Q3
+        self.assertEqual(self.rollup("quarter", "2025-Q2"), {"diesel": (1800, 2), "electricity": (100, 1), TOTAL: (1900, 2)})
+        self.assertEqual(self.rollup("quarter", "2025-Q3"), {"diesel": (500, 1), TOTAL: (500, 1)})
+
+    def test_dropped_source_leaves_month_and_quarter(self):
+        self.record(breakdown(diesel=1000, natural_gas=300), day(4, 2))
+        self.record(breakdown(diesel=1000), day(4, 20))
+        self.assertNotIn("natural gas", self.rollup("month", "2025-04"))
+        self.assertNotIn("natural gas", self.rollup("quarter", "2025-Q2"))
+
+    def test_source_names_differing_in_case_are_one_series(self):
+        emissions = {"breakdown": [{"source": "Diesel", "emissions": "1,000 kg CO2e"}, {"source": " diesel ", "emissions": 200}],
+                     "total_emissions": "1200"}
+        self.assertEqual(source_totals(emissions), {"diesel": 1200, TOTAL: 1200})
+        self.record(emissions, day(4))
+        self.record(breakdown(DIESEL=900), day(5))
+        series = timeseries(asyncio.run(self.store.fetch_rollups("u1", "month")))
+        self.assertEqual([(point["period"], point["total_kg"], point["sources"]) for point in series],
+                         [("2025-04", 1200, {"diesel": 1200}), ("2025-05", 900, {"diesel": 900})])
+
+    def test_helpers(self):
+        self.assertEqual([to_number(v) for v in (12, "1,234.5 kg", "-3", None, "n/a", True)], [12, 1234.5, -3, None, None, None])
+        self.assertEqual(source_totals({"breakdown": [{"source": "diesel", "emissions": 5}]}), {"diesel": 5, TOTAL: 5})
+        self.assertEqual([quarter_of(m) for m in ("2025-01", "2025-03", "2025-04", "2025-12")], ["2025-Q1", "2025-Q1", "2025-Q2", "2025-Q4"])
+        self.assertEqual(quarter_months("2025-Q4"), ["2025-10", "2025-11", "2025-12"])
+
+if __name__ == "__main__":
+    unittest.main()
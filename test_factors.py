@@ -0,0 +1,107 @@
+"""
+Emission-factor extraction and lookup (factors.py): fuel aliases resolve to one substance, while qualified
+names ('biodiesel', 'renewable diesel', 'landfill gas', 'charcoal') stay substances of their own.
+
+    python -m unittest test_factors
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from langchain_core.documents import Document
+from factors import FactorIndex, extract_and_index, extract_factors, factor_text, normalize
+
+TABLE = """
+Emission factors 2024
+Fuel | kg CO2 per gallon
+Biodiesel (B100) | 9.45
+Renewable diesel | 1.20
+Diesel | 10.21
+Motor gasoline | 8.78
+
+Fuel | kg CO2 per kg
+Charcoal | 3.1
+Coal | 2.0
+"""
+
+PROSE = (
+    "Landfill gas emits 0.05 kg CO2e per scf. Biogas emits 0.04 kg CO2e per scf. "
+    "Pipeline natural gas emits 5.31 kg CO2e per therm. Each gallon of propane burned emits 5.72 kg of CO2."
+)
+
+TONS = """
+Fuel | kg CO2 per short ton | kg CO2 per metric ton
+Coal | 2325 | 2563
+Petroleum coke | 3072 | 3386
+"""
+
+def by_substance(factors):
+    return {(f["substance"], f["unit"]): f["factor"] for f in factors}
+
+class FactorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="carbonx-factors-")
+        self.index = FactorIndex(os.path.join(self.directory, "factors.db"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_aliases_resolve_to_one_fuel(self):
+        for name, fuel in [("Diesel fuel", "diesel"), ("US diesel", "diesel"), ("petrol", "gasoline"), ("Motor gasoline", "gasoline"),
+                           ("Pipeline natural gas", "natural gas"), ("grid electricity", "electricity"), ("R410a", "r-410a")]:
+            self.assertEqual(normalize(name), fuel, name)
+
+    def test_qualified_names_are_separate_substances(self):
+        for name in ["Biodiesel (B100)", "renewable diesel", "biogas", "landfill gas", "charcoal", "bituminous coal"]:
+            self.assertNotIn(normalize(name), {"diesel", "natural gas", "coal"}, name)
+
+    def test_table_rows_do_not_replace_each_other(self):
+        factors = by_substance(extract_factors(TABLE))
+        self.assertEqual(factors[("diesel", "gallons")], 10.21)
+        self.assertEqual(factors[("biodiesel b100", "gallons")], 9.45)
+        self.assertEqual(factors[("renewable diesel", "gallons")], 1.2)
+        self.assertEqual(factors[("gasoline", "gallons")], 8.78)
+        self.assertEqual(factors[("coal", "kg")], 2.0)
+        self.assertEqual(factors[("charcoal", "kg")], 3.1)
+
+    def test_prose_keeps_qualified_gases_apart(self):
+        factors = by_substance(extract_factors(PROSE))
+        self.assertEqual(factors[("natural gas", "therms")], 5.31)
+        self.assertEqual(factors[("landfill gas", "scf")], 0.05)
+        self.assertEqual(factors[("biogas", "scf")], 0.04)
+        self.assertEqual(factors[("propane", "gallons")], 5.72)
+
+    def test_short_and_metric_tons_are_separate_units(self):
+        factors = by_substance(extract_factors(TONS + "Wood pellets emit 1,640 kg CO2 per tonne."))
+        self.assertEqual(factors[("coal", "tons")], 2325)
+        self.assertEqual(factors[("coal", "tonnes")], 2563)
+        self.assertEqual(factors[("petroleum coke", "tons")], 3072)
+        self.assertEqual(factors[("petroleum coke", "tonnes")], 3386)
+        self.assertEqual(factors[("wood pellets", "tonnes")], 1640)
+        extract_and_index(self.index, "hub_2024.pdf", [Document(page_content=TONS)])
+        self.assertEqual(self.index.lookup("coal", "metric tons")["factor"]["factor"], 2563)
+        self.assertEqual(self.index.lookup("coal", "short tons")["factor"]["factor"], 2325)
+
+    def test_lookup_flags_a_factor_in_another_unit(self):
+        extract_and_index(self.index, "hub_2024.pdf", [Document(page_content=TONS)])
+        result = self.index.lookup("coal", "gallons")
+        self.assertTrue(result["unit_mismatch"])
+        self.assertTrue(factor_text(result).startswith("UNIT MISMATCH: no factor per gallons"))
+        self.assertFalse(self.index.lookup("coal", "tons")["unit_mismatch"])
+        self.assertFalse(self.index.lookup("coal")["unit_mismatch"])
+
+    def test_lookup_does_not_match_a_different_fuel(self):
+        extract_and_index(self.index, "hub_2024.pdf", [Document(page_content="Fuel | kg CO2 per gallon\nDiesel | 10.21\nCoal | 2.0")])
+        self.assertEqual(self.index.lookup("diesel fuel")["match"], "exact")
+        self.assertEqual(self.index.lookup("Diesl")["match"], "fuzzy")
+        for name in ["biodiesel", "renewable diesel", "charcoal", "landfill gas"]:
+            self.assertIsNone(self.index.lookup(name), name)
+
+    def test_deleted_source_leaves_the_index(self):
+        extract_and_index(self.index, "hub_2024.pdf", [Document(page_content=TABLE)])
+        self.assertEqual(self.index.lookup("diesel")["factor"]["factor"], 10.21)
+        self.index.delete_source("hub_2024.pdf")
+        self.assertIsNone(self.index.lookup("diesel"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Consumption records (ingest.py): rows are read from bills and fuel logs, including PyPDF's text of PDF tables,
+rows of the same month are added up, and the same file uploaded twice counts once.
+
+    python -m unittest test_ingest
+"""
+import os
+import tempfile
+import unittest
+from langchain_community.document_loaders import PyPDFLoader
+from ingest import extract_consumption_rows, find_period, format_consumption
+
+def row(filename: str, period: str, quantity: float, fuel: str = "diesel", unit: str = "gallons", content_hash: str = None):
+    return {"filename": filename, "period": period, "fuel_type": fuel, "quantity": quantity, "unit": unit, "content_hash": content_hash or filename}
+
+def table_pdf(rows, columns=(72, 200, 300, 400)) -> bytes:
+    """A one-page PDF with each row's cells drawn at the given x positions, as a spreadsheet export lays them out."""
+    ops = ["BT", "/F1 10 Tf"]
+    for line, cells in enumerate(rows):
+        ops.extend(f"1 0 0 1 {x} {720 - 14 * line} Tm ({cell}) Tj" for x, cell in zip(columns, cells))
+    ops.append("ET")
+    stream = "\n".join(ops).encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1) + b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+def pdf_text(rows) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        tmp.write(table_pdf(rows))
+    try:
+        return "\n".join(doc.page_content for doc in PyPDFLoader(tmp.name).load())
+    finally:
+        os.unlink(tmp.name)
+
+class FormatConsumptionTest(unittest.TestCase):
+    def test_rows_in_the_same_month_are_summed(self):
+        rows = [row("fuel_log.csv", "2025-01", q) for q in (50, 60, 55)] + [row("fuel_log.csv", "2025-02", 70)]
+        text = format_consumption(rows)
+        self.assertIn("- diesel: 117.5 gallons per month (average of 2 months, 2025-01 to 2025-02)", text)
+        self.assertIn("- 2025-01, diesel, 165, gallons", text)
+
+    def test_same_bill_uploaded_twice_counts_once(self):
+        rows = [row(name, "2025-01", 800, "electricity", "kWh", "same-bytes") for name in ("bill.pdf", "bill (1).pdf")]
+        self.assertIn("- electricity: 800.0 kWh per month", format_consumption(rows))
+
+    def test_different_files_with_equal_totals_are_added(self):
+        rows = [row(name, "2025-01", 800, "electricity", "kWh") for name in ("meter_a.pdf", "meter_b.pdf")]
+        self.assertIn("- electricity: 1,600.0 kWh per month", format_consumption(rows))
+
+    def test_different_files_for_the_same_month_are_added(self):
+        rows = [row("meter_a.pdf", "2025-01", 800, "electricity", "kWh"), row("meter_b.pdf", "2025-01", 300, "electricity", "kWh")]
+        self.assertIn("- electricity: 1,100.0 kWh per month", format_consumption(rows))
+
+class ExtractConsumptionTest(unittest.TestCase):
+    def test_full_dates(self):
+        for text, period in [("03/15/2024", "2024-03"), ("3/1/24", "2024-03"), ("15/03/2024", "2024-03"), ("2024-03-15", "2024-03"),
+                             ("01/2024", "2024-01"), ("Mar 2024", "2024-03")]:
+            self.assertEqual(find_period(text), period, text)
+
+    def test_fuel_log_pdf(self):
+        text = pdf_text([("Date", "Fuel", "Gallons", "Cost"), ("03/15/2024", "Diesel", "45.2", "$150.00"),
+                         ("03/22/2024", "Diesel", "38.0", "$126.10"), ("04/02/2024", "Gasoline", "20.5", "$70.00")])
+        self.assertIn("03/15/2024 Diesel 45.2 $150.00", text) # Single spaces between the columns
+        rows = [(r["period"], r["fuel_type"], r["quantity"], r["unit"]) for r in extract_consumption_rows(text)]
+        self.assertEqual(rows, [("2024-03", "diesel", 45.2, "gallons"), ("2024-03", "diesel", 38.0, "gallons"), ("2024-04", "gasoline", 20.5, "gallons")])
+
+    def test_utility_bill_pdf(self):
+        text = pdf_text([("Month", "Electricity (kWh)", "Natural Gas (therms)"), ("Jan 2024", "1,200", "300"), ("Feb 2024", "1,100", "280")])
+        rows = [(r["period"], r["fuel_type"], r["quantity"], r["unit"]) for r in extract_consumption_rows(text)]
+        self.assertEqual(rows, [("2024-01", "electricity", 1200.0, "kWh"), ("2024-01", "natural gas", 300.0, "therms"),
+                                ("2024-02", "electricity", 1100.0, "kWh"), ("2024-02", "natural gas", 280.0, "therms")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Opt-in request profiling (profiling.py): what a profile records, who can ask for one, and that requests
+which aren't profiled go straight through the middleware.
+
+    python -m unittest test_profiling
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from metrics import stage, stage_recorder_var
+from profiling import ProfilingConfig, ProfilingMiddleware, ProfileStore, StackSampler
+
+HEADERS = [
+    (b"host", b"api.example.com"), (b"user-agent", b"python-httpx/0.28"), (b"accept", b"*/*"),
+    (b"accept-encoding", b"gzip, deflate"), (b"connection", b"keep-alive"), (b"content-type", b"application/json"),
+    (b"content-length", b"42"), (b"authorization", b"Bearer token"), (b"x-request-id", b"abc"),
+]
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+async def send(message):
+    pass
+
+async def endpoint(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"x-request-id", b"abc")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+def busy(seconds: float):
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        sum(range(100))
+
+async def slow_endpoint(scope, receive, send):
+    with stage("embedding", chunks=3):
+        busy(0.1)
+    with stage("chroma_write"):
+        busy(0.05)
+    await endpoint(scope, receive, send)
+
+def scope(path: str = "/chat", headers=HEADERS):
+    return {"type": "http", "method": "POST", "path": path, "headers": list(headers)}
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="carbonx-profiles-")
+        self.store = ProfileStore(self.directory)
+        self.saved_rate = ProfilingConfig.SAMPLE_RATE
+
+    def tearDown(self):
+        ProfilingConfig.SAMPLE_RATE = self.saved_rate
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def middleware(self, app, admin: bool = True) -> ProfilingMiddleware:
+        async def is_admin(authorization):
+            return admin and authorization == "Bearer token"
+        return ProfilingMiddleware(app, is_admin=is_admin, store=self.store)
+
+    def test_unprofiled_request_is_passed_straight_through(self):
+        seen = []
+
+        async def app(scope, receive, send_):
+            seen.append((receive, send_, stage_recorder_var.get()))
+            await endpoint(scope, receive, send_)
+
+        with mock.patch.object(StackSampler, "start") as start, mock.patch.object(self.store, "save") as save:
+            for _ in range(100):
+                asyncio.run(self.middleware(app)(scope(), receive, send))
+        # No sampler thread, no stored profile, no stage recording, and the app gets the server's own callables
+        start.assert_not_called()
+        save.assert_not_called()
+        self.assertEqual(seen, [(receive, send, None)] * 100)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_admin_header_stores_profile(self):
+        headers = []
+
+        async def capture(message):
+            headers.extend(message.get("headers") or [])
+
+        asyncio.run(self.middleware(slow_endpoint)(scope(headers=HEADERS + [(b"x-profile", b"1")]), receive, capture))
+        [summary] = self.store.list()
+        self.assertIn((b"x-profile-id", summary["id"].encode()), headers)
+        profile = self.store.get(summary["id"])
+        self.assertEqual((profile["path"], profile["status"], profile["trace_id"], profile["reason"]), ("/chat", 200, "abc", "header"))
+        self.assertEqual([entry["stage"] for entry in profile["stages"]], ["embedding", "chroma_write"])
+        self.assertGreater(profile["stages"][0]["share"], 0.5)
+        self.assertEqual(profile["stages"][0]["chunks"], 3)
+        self.assertGreater(profile["samples"], 10)
+        with open(self.store.folded_path(summary["id"])) as f:
+            folded = f.read()
+        self.assertIn("busy (test_profiling.py", folded)
+        stack, count = folded.splitlines()[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+
+    def test_header_from_non_admin_is_ignored(self):
+        asyncio.run(self.middleware(slow_endpoint, admin=False)(scope(headers=HEADERS + [(b"x-profile", b"1")]), receive, send))
+        self.assertEqual(self.store.list(), [])
+
+    def test_sampling_only_covers_configured_paths(self):
+        ProfilingConfig.SAMPLE_RATE = 1.0
+        app = self.middleware(endpoint, admin=False)
+        asyncio.run(app(scope("/list_files"), receive, send))
+        asyncio.run(app(scope("/update_vector"), receive, send))
+        self.assertEqual([(p["path"], p["reason"]) for p in self.store.list()], [("/update_vector", "sampled")])
+
+    def test_invalid_profile_id_is_not_a_path(self):
+        with self.assertRaises(KeyError):
+            self.store.folded_path("../../etc/passwd")
+
+if __name__ == "__main__":
+    unittest.main()
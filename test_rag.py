@@ -0,0 +1,80 @@
+"""
+File replacement in Chroma (rag.py): stable chunk IDs, cleanup of earlier uploads that never removes a newer
+one, and the per-file lock uploads take. Also the logical collection names /list_files accepts.
+
+    python -m unittest test_rag
+"""
+import threading
+import time
+import unittest
+import uuid
+import chromadb
+from rag import chunk_id, delete_file_chunks, file_lock, resolve_collection
+
+def upload(collection, filename: str, chunks: int, uploaded_at: str, user_id: str = "u1") -> str:
+    """Writes a file's chunks the way /update_vector does, returning the upload_id."""
+    upload_id = uuid.uuid4().hex
+    collection.upsert(
+        ids=[chunk_id(filename, i, user_id) for i in range(chunks)],
+        embeddings=[[float(i), 1.0] for i in range(chunks)],
+        documents=[f"{upload_id} chunk {i}" for i in range(chunks)],
+        metadatas=[{"filename": filename, "user_id": user_id, "upload_id": upload_id, "uploaded_at": uploaded_at, "chunk_index": i} for i in range(chunks)],
+    )
+    return upload_id
+
+class FileReplacementTest(unittest.TestCase):
+    def setUp(self):
+        self.collection = chromadb.EphemeralClient().get_or_create_collection(f"test_{uuid.uuid4().hex}", embedding_function=None)
+
+    def test_reupload_removes_leftover_chunks(self):
+        upload(self.collection, "bill.txt", 5, "2025-01-01T00:00:00")
+        second = upload(self.collection, "bill.txt", 3, "2025-01-02T00:00:00")
+        removed = delete_file_chunks(self.collection, "bill.txt", keep_upload_id=second, user_id="u1", uploaded_before="2025-01-02T00:00:00")
+        self.assertEqual(removed, 2)
+        self.assertEqual({meta["upload_id"] for meta in self.collection.get()["metadatas"]}, {second})
+
+    def test_older_uploads_cleanup_keeps_a_newer_upload(self):
+        first = upload(self.collection, "bill.txt", 3, "2025-01-01T00:00:00")
+        newer = upload(self.collection, "bill.txt", 4, "2025-01-02T00:00:00")
+        # The first upload's cleanup runs after the newer upload wrote everything
+        removed = delete_file_chunks(self.collection, "bill.txt", keep_upload_id=first, user_id="u1", uploaded_before="2025-01-01T00:00:00")
+        self.assertEqual(removed, 0)
+        self.assertEqual(self.collection.count(), 4)
+        self.assertEqual({meta["upload_id"] for meta in self.collection.get()["metadatas"]}, {newer})
+
+    def test_other_users_file_of_the_same_name_is_kept(self):
+        upload(self.collection, "bill.txt", 2, "2025-01-01T00:00:00", user_id="u2")
+        mine = upload(self.collection, "bill.txt", 2, "2025-01-02T00:00:00")
+        delete_file_chunks(self.collection, "bill.txt", keep_upload_id=mine, user_id="u1", uploaded_before="2025-01-02T00:00:00")
+        self.assertEqual(self.collection.count(), 4)
+
+    def test_file_lock_serializes_one_file(self):
+        events = []
+
+        def write(name: str):
+            with file_lock("user_u1", "bill.txt", "u1"):
+                events.append(f"{name} start")
+                time.sleep(0.05)
+                events.append(f"{name} end")
+
+        threads = [threading.Thread(target=write, args=(name,)) for name in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([event.split()[1] for event in events], ["start", "end", "start", "end"])
+        with file_lock("user_u1", "other.txt", "u1"), file_lock("user_u1", "bill.txt", "u1"):
+            pass # Different files don't wait on each other
+
+class ResolveCollectionTest(unittest.TestCase):
+    def test_logical_names(self):
+        self.assertEqual(resolve_collection("core_db"), ("core_db", None))
+        self.assertEqual(resolve_collection("user_abc")[0][:5], "user_")
+
+    def test_physical_shard_names_are_rejected(self):
+        for name in ["user_shard_000", "user_", "chroma_internal"]:
+            with self.assertRaises(ValueError, msg=name):
+                resolve_collection(name)
+
+if __name__ == "__main__":
+    unittest.main()
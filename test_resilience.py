@@ -0,0 +1,175 @@
+"""
+Deadlines, fallback, hedging and circuit breakers (initiatives/resilience.py) against local stub LLM servers
+that speak the OpenAI chat completions API and can be told to stall or fail.
+
+    python -m unittest test_resilience
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import threading
+import time
+import unittest
+from langchain_openai import ChatOpenAI
+from initiatives.resilience import ResilienceConfig, ResilientCaller, LLMUnavailable
+from initiatives.router import ModelRouter, Route, RoutedChatModel
+
+class StubLLM:
+    """OpenAI-compatible server answering with `answer` (its own name) after `stall_sec`, or with HTTP `status`."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.answer = name
+        self.stall_sec = 0.0
+        self.status = 200
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests += 1
+                time.sleep(stub.stall_sec)
+                body = json.dumps({
+                    "id": "stub", "object": "chat.completion", "created": 0, "model": stub.name,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": stub.answer}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                } if stub.status == 200 else {"error": {"message": "injected failure"}}).encode("utf-8")
+                try:
+                    self.send_response(stub.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass # The client gave up on a stalled call
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.block_on_close = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class ResilienceTest(unittest.TestCase):
+    DEADLINE_SEC = 1.0
+
+    def setUp(self):
+        self.saved = (ResilienceConfig.BREAKER_FAILURES, ResilienceConfig.BREAKER_COOLDOWN_SEC, ResilienceConfig.HEDGE_DEFAULT_DELAY_SEC)
+        ResilienceConfig.BREAKER_FAILURES = 2
+        ResilienceConfig.BREAKER_COOLDOWN_SEC = 0.3
+        ResilienceConfig.HEDGE_DEFAULT_DELAY_SEC = 0.2
+        self.stubs = {"stub/primary": StubLLM("primary"), "stub/backup": StubLLM("backup")}
+
+    def tearDown(self):
+        for stub in self.stubs.values():
+            stub.close()
+        ResilienceConfig.BREAKER_FAILURES, ResilienceConfig.BREAKER_COOLDOWN_SEC, ResilienceConfig.HEDGE_DEFAULT_DELAY_SEC = self.saved
+
+    def model(self, hedging: bool = False, backup: bool = True, tiers=("stub/primary",)) -> RoutedChatModel:
+        self.caller = ResilientCaller(hedging=hedging, backup=lambda model: "stub/backup" if backup and model == "stub/primary" else None)
+        router = ModelRouter(routes={"chat": Route(list(tiers), 10000, 60, self.DEADLINE_SEC)}, caller=self.caller)
+        clients = {
+            name: ChatOpenAI(model=name, base_url=stub.url, api_key="stub", max_retries=0, timeout=10)
+            for name, stub in self.stubs.items()
+        }
+        return RoutedChatModel(factory=lambda model: clients[model], router=router)
+
+    def ask(self, model: RoutedChatModel):
+        started = time.perf_counter()
+        answer = model.invoke("How much CO2 per gallon of diesel?").content
+        return answer, time.perf_counter() - started
+
+    def test_fast_primary_answers_without_backup(self):
+        answer, _ = self.ask(self.model(hedging=True))
+        self.assertEqual(answer, "primary")
+        self.assertEqual(self.stubs["stub/backup"].requests, 0)
+
+    def test_stall_without_backup_ends_at_deadline(self):
+        self.stubs["stub/primary"].stall_sec = 5
+        model = self.model(backup=False)
+        started = time.perf_counter()
+        with self.assertRaises(LLMUnavailable):
+            model.invoke("hello")
+        self.assertLess(time.perf_counter() - started, self.DEADLINE_SEC + 0.5)
+
+    def test_stall_falls_back_to_backup(self):
+        self.stubs["stub/primary"].stall_sec = 5
+        answer, elapsed = self.ask(self.model())
+        self.assertEqual(answer, "backup")
+        self.assertLess(elapsed, 2 * self.DEADLINE_SEC + 0.5)
+
+    def test_error_falls_back_to_backup(self):
+        self.stubs["stub/primary"].status = 500
+        answer, elapsed = self.ask(self.model())
+        self.assertEqual(answer, "backup")
+        self.assertLess(elapsed, self.DEADLINE_SEC)
+
+    def test_hedge_answers_before_the_deadline(self):
+        self.stubs["stub/primary"].stall_sec = 5
+        answer, elapsed = self.ask(self.model(hedging=True))
+        self.assertEqual(answer, "backup")
+        self.assertLess(elapsed, self.DEADLINE_SEC)
+        self.assertEqual(self.stubs["stub/backup"].requests, 1)
+
+    def test_async_hedge_answers_before_the_deadline(self):
+        self.stubs["stub/primary"].stall_sec = 5
+        model = self.model(hedging=True)
+        started = time.perf_counter()
+        answer = asyncio.run(model.ainvoke("hello")).content
+        self.assertEqual(answer, "backup")
+        self.assertLess(time.perf_counter() - started, self.DEADLINE_SEC)
+
+    def test_hedge_delay_follows_observed_p95(self):
+        model = self.model(hedging=True)
+        for _ in range(ResilienceConfig.HEDGE_MIN_SAMPLES):
+            self.ask(model)
+        self.assertLess(self.caller.hedge_delay("stub/primary"), ResilienceConfig.HEDGE_DEFAULT_DELAY_SEC)
+        self.stubs["stub/primary"].stall_sec = 5
+        answer, elapsed = self.ask(model)
+        self.assertEqual(answer, "backup")
+        self.assertLess(elapsed, ResilienceConfig.HEDGE_DEFAULT_DELAY_SEC)
+
+    def test_open_breaker_skips_the_failing_model(self):
+        primary = self.stubs["stub/primary"]
+        primary.status = 500
+        model = self.model()
+        for _ in range(ResilienceConfig.BREAKER_FAILURES):
+            self.assertEqual(self.ask(model)[0], "backup")
+        self.assertEqual(self.caller.breaker("stub/primary").state, "open")
+        self.assertEqual(self.ask(model)[0], "backup")
+        self.assertEqual(primary.requests, ResilienceConfig.BREAKER_FAILURES)
+
+    def test_breaker_closes_after_successful_probe(self):
+        primary = self.stubs["stub/primary"]
+        primary.status = 500
+        model = self.model()
+        for _ in range(ResilienceConfig.BREAKER_FAILURES):
+            self.ask(model)
+        primary.status = 200
+        time.sleep(ResilienceConfig.BREAKER_COOLDOWN_SEC + 0.05)
+        self.assertEqual(self.ask(model)[0], "primary")
+        self.assertEqual(self.caller.breaker("stub/primary").state, "closed")
+
+    def test_unavailable_heavy_tier_keeps_the_first_answer(self):
+        # An empty answer fails validation and escalates to the heavy tier, which is down
+        self.stubs["stub/primary"].answer = ""
+        self.stubs["stub/backup"].status = 500
+        answer, _ = self.ask(self.model(backup=False, tiers=("stub/primary", "stub/backup")))
+        self.assertEqual(answer, "")
+        self.assertEqual(self.stubs["stub/backup"].requests, 1)
+
+    def test_both_failing_raises_unavailable(self):
+        self.stubs["stub/primary"].status = 500
+        self.stubs["stub/backup"].stall_sec = 5
+        with self.assertRaises(LLMUnavailable):
+            self.model().invoke("hello")
+
+if __name__ == "__main__":
+    unittest.main()
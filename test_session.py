@@ -0,0 +1,79 @@
+"""
+Server-side chat sessions (session.py) shared by several workers: a cached session is reloaded once another
+worker writes to the conversation, and kept while only this worker does.
+
+    python -m unittest test_session
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from session import ChatSessionStore
+from versions import VersionStore, messages_key
+
+class MessageStore:
+    """The chat_messages and chat_summaries methods of db.SupabaseStore, in memory, counting reads."""
+
+    def __init__(self):
+        self.messages = []
+        self.summary = None
+        self.fetches = 0
+
+    async def fetch_messages(self, user_id):
+        self.fetches += 1
+        return list(self.messages)
+
+    async def fetch_summary(self, user_id):
+        return self.summary
+
+    async def upsert_summary(self, user_id, summary, summarized_count):
+        self.summary = {"summary": summary, "summarized_count": summarized_count}
+
+class Worker:
+    """One API process: its own ChatSessionStore over the shared database and version counters."""
+
+    def __init__(self, db: MessageStore, versions: VersionStore):
+        self.db, self.versions = db, versions
+        self.sessions = ChatSessionStore(db, llm=None, versions=versions)
+
+    def write(self, role: str, content: str):
+        self.db.messages.append({"role": role, "content": content})
+        self.sessions.append("u1", role, content, self.versions.bump(messages_key("u1")))
+
+    def history(self):
+        return [message.content for message in asyncio.run(self.sessions.build_history("u1"))]
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="carbonx-session-")
+        self.db = MessageStore()
+        versions = VersionStore(os.path.join(self.directory, "versions.db"))
+        self.a, self.b = Worker(self.db, versions), Worker(self.db, versions)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_own_writes_keep_the_cache(self):
+        self.a.history()
+        self.a.write("user", "We run 3 trucks.")
+        self.a.write("assistant", "How much diesel do they use?")
+        self.assertEqual(self.a.history(), ["We run 3 trucks.", "How much diesel do they use?"])
+        self.assertEqual(self.db.fetches, 1)
+
+    def test_another_workers_turn_reloads_the_session(self):
+        self.a.history()
+        self.b.history()
+        self.a.write("user", "We run 3 trucks.")
+        self.b.write("user", "Each uses 800 gallons a month.") # Worker b's cache missed a's message
+        self.assertEqual(self.a.history(), ["We run 3 trucks.", "Each uses 800 gallons a month."])
+        self.assertEqual(self.b.history(), ["We run 3 trucks.", "Each uses 800 gallons a month."])
+
+    def test_without_versions_the_cache_is_kept(self):
+        sessions = ChatSessionStore(self.db, llm=None)
+        asyncio.run(sessions.build_history("u1"))
+        self.db.messages.append({"role": "user", "content": "written elsewhere"})
+        self.assertEqual(asyncio.run(sessions.build_history("u1")), [])
+
+if __name__ == "__main__":
+    unittest.main()
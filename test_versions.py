@@ -0,0 +1,64 @@
+"""
+ETag revalidation (versions.py): version counters shared through SQLite, ETags that change once a write bumps
+their counter, and If-None-Match matching as /list_files and /history do it.
+
+    python -m unittest test_versions
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from versions import VersionStore, collection_key, etag_matches, make_etag, messages_key
+
+class VersionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="carbonx-versions-")
+        self.path = os.path.join(self.directory, "versions.db")
+        self.versions = VersionStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_bump_counts_up_per_key(self):
+        self.assertEqual(self.versions.get(messages_key("u1")), 0)
+        self.assertEqual([self.versions.bump(messages_key("u1")) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(self.versions.get(messages_key("u1")), 3)
+        self.assertEqual(self.versions.get(messages_key("u2")), 0)
+
+    def test_workers_share_counters_and_epoch(self):
+        other_worker = VersionStore(self.path)
+        self.versions.bump(collection_key("core_db"))
+        self.assertEqual(other_worker.get(collection_key("core_db")), 1)
+        self.assertEqual(other_worker.epoch, self.versions.epoch)
+
+    def test_recreated_database_gets_a_new_epoch(self):
+        etag = make_etag(self.versions.epoch, "user_u1", self.versions.get(collection_key("user_u1")), 4)
+        os.remove(self.path)
+        fresh = VersionStore(self.path)
+        self.assertEqual(fresh.get(collection_key("user_u1")), 0)
+        self.assertNotEqual(make_etag(fresh.epoch, "user_u1", fresh.get(collection_key("user_u1")), 4), etag)
+
+    def test_bump_invalidates_the_etag(self):
+        def history_etag():
+            return make_etag(self.versions.epoch, "u1", self.versions.get(messages_key("u1")))
+
+        before = history_etag()
+        self.assertEqual(history_etag(), before) # Nothing written: a revalidating client gets a 304
+        self.assertTrue(etag_matches(before, history_etag()))
+        self.versions.bump(messages_key("u1"))
+        self.assertFalse(etag_matches(before, history_etag()))
+        self.versions.bump(messages_key("u2")) # Another user's write leaves this ETag alone
+        after = history_etag()
+        self.assertTrue(etag_matches(after, history_etag()))
+
+class EtagMatchesTest(unittest.TestCase):
+    def test_if_none_match_forms(self):
+        etag = make_etag("a", 1)
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(f'"other", W/{etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches(None, etag))
+        self.assertFalse(etag_matches('"other"', etag))
+
+if __name__ == "__main__":
+    unittest.main()
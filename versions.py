@@ -0,0 +1,62 @@
+"""
+Version counters behind the ETags of the read endpoints. Every write that changes what /list_files or
+/history would return bumps a counter, so those endpoints can answer If-None-Match with a 304 before
+scanning a collection or fetching messages.
+"""
+from typing import Optional
+import hashlib
+import os
+import sqlite3
+import uuid
+
+class VersionConfig:
+    # Shared by every worker process on the host; Chroma's PersistentClient is host-local as well
+    VERSIONS_DB_PATH = os.getenv("VERSIONS_DB_PATH", "./versions.db")
+
+class VersionStore:
+    """SQLite table of monotonically increasing counters, one per key. Safe to use from any thread."""
+
+    def __init__(self, path: str = None):
+        self.path = path or VersionConfig.VERSIONS_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            # Part of every ETag, so counters restarting from a deleted database can't match an old ETag
+            conn.execute("INSERT OR IGNORE INTO versions (key, version) VALUES ('__epoch__', ?)", (uuid.uuid4().int >> 72,))
+            self.epoch = conn.execute("SELECT version FROM versions WHERE key = '__epoch__'").fetchone()[0]
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key: str) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, key: str) -> int:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO versions (key, version) VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET version = version + 1",
+                (key,),
+            )
+            return conn.execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchone()[0]
+
+def collection_key(name: str) -> str:
+    """Key of a logical collection ('core_db', 'user_{user_id}'), whatever its physical layout."""
+    return f"collection:{name}"
+
+def messages_key(user_id: str) -> str:
+    return f"messages:{user_id}"
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:20] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header (possibly a list, possibly weak validators) covers etag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)